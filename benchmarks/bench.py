@@ -0,0 +1,287 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Headless benchmarks of the solver hot paths, using fixed cartridges from
+the simulations.  Results are printed and saved as JSON, and may be
+compared with an earlier run to catch regressions :
+
+  python bench.py -o new.json
+  python bench.py -o new.json -c old.json
+'''
+from __future__ import print_function
+
+import sys
+import os
+import json
+import time
+import platform
+import argparse
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy
+from numpy      import array, arange, linspace
+from Cartridge  import Cartridge
+from Ballistics import Ballistics
+from functions  import ft_to_m, inches_to_m
+import functions as func
+import model
+
+clock = getattr(time, 'perf_counter', time.time)
+
+METHODS = ['segment', 'DormandPrince', 'RK45', 'RungeKutta', 'Predictor',
+           'EulerRichardson', 'Euler', 'EulerCromer']
+
+# right-hand sides and kernels counted as RHS evaluations :
+RHS = ['fbar_gmodel', 'fbar_emodel', 'fbar_gmodel_batch',
+       'fbar_emodel_batch', 'gmodel_segment']
+
+
+def cartridges():
+  '''
+  PURPOSE:
+    The fixed cartridges of simulations/wwII_rounds.py and the XM855 of
+    simulations/556_rounds.py with its measured trajectory.
+  '''
+  traj = [-2.57, -0.39, 1.49, 3.06, 4.31, 5.21, 5.73, 5.88, 5.58, 4.90,
+          3.72, 2.14, -0.04, -2.83, -6.11, -10.09, -14.77]
+  return [Cartridge('7.92 x 57 mm 198 gr Bullet', 198, 0.32, 760, 0.593),
+          Cartridge('.30-06 150 gr Bullet', 150, .308, ft_to_m(2910), .387),
+          Cartridge('.50 BMG 661 gr Bullet', 661, .51, ft_to_m(2750), .62),
+          Cartridge('0.338 Lapua Mag no. 4 PL 8013 300 grain', 300, 0.338,
+                    ft_to_m(2723), 0.736),
+          Cartridge('XM855 5.56x45 mm 62 grain bullet', 62, 0.224,
+                    ft_to_m(3090), 0.307,
+                    traj=inches_to_m(array(traj)), x=arange(0, 401, 25))]
+
+
+class counting(object):
+  '''
+  PURPOSE:
+    Count calls of the RHS functions while in a with block.
+  '''
+  def __enter__(self):
+    self.calls = 0
+    self.saved = dict((n, getattr(func, n)) for n in RHS)
+    for n, f in self.saved.items():
+      setattr(func, n, self._wrap(f))
+    return self
+
+  def _wrap(self, f):
+    def counted(*args):
+      self.calls += 1
+      return f(*args)
+    return counted
+
+  def __exit__(self, *exc):
+    for n, f in self.saved.items():
+      setattr(func, n, f)
+
+
+def best(fn, repeat):
+  '''
+  PURPOSE:
+    Best wall time in seconds of repeat calls of fn.
+  '''
+  times = []
+  for i in range(repeat):
+    t0 = clock()
+    fn()
+    times.append(clock() - t0)
+  return min(times)
+
+
+IMPORT = """
+import sys, time
+clock = getattr(time, 'perf_counter', time.time)
+sys.path.insert(0, %r)
+t0 = clock()
+import %s
+print(clock() - t0)
+print(int('matplotlib' in sys.modules))
+"""
+
+def bench_import(repeat):
+  '''
+  PURPOSE:
+    Import time of the solver modules, each in a fresh interpreter, and
+    whether importing them loaded matplotlib.
+  '''
+  src = os.path.join(here, '..', 'src')
+  out = {}
+  for mod in ['functions', 'Cartridge', 'Ballistics']:
+    times = []
+    for i in range(repeat):
+      res = subprocess.check_output([sys.executable, '-c',
+                                     IMPORT % (src, mod)])
+      t, plt = res.decode().split()
+      times.append(float(t))
+    out['import/' + mod] = {'latency_s'  : min(times),
+                            'matplotlib' : bool(int(plt))}
+  return out
+
+
+def bench_kernels(repeat, n):
+  v     = linspace(500.0, 4000.0, n)
+  x     = [0.0, 800.0, 0.0, 5.0]
+  drag  = func.compile_table(model.G1)
+  out   = {}
+  t     = best(lambda: [func.g_param(model.G1, vi) for vi in v], repeat)
+  out['g_param'] = {'calls_per_s' : n / t}
+  t     = best(lambda: [func.fbar_gmodel(0.0, x, 32.174, 0.4, drag)
+                        for i in range(n)], repeat)
+  out['fbar_gmodel'] = {'calls_per_s' : n / t}
+  t     = best(lambda: [func.fbar_emodel(0.0, x, 32.174, 10.0, 1.225,
+                                         2.5e-5) for i in range(n)], repeat)
+  out['fbar_emodel'] = {'calls_per_s' : n / t}
+  return out
+
+
+def bench_integrate(repeat, rng):
+  out = {}
+  for m in METHODS:
+    carts = array(cartridges())
+    ball  = Ballistics(carts, m, 0.0, 1.0, 0.001, 0.001)
+    def run():
+      for c in carts:
+        ball.model_integrate(c, rng=rng)
+    try:
+      with counting() as calls:
+        run()
+      t = best(run, repeat)
+    except Exception as e:
+      out['model_integrate/' + m] = {'error' : repr(e)}
+      continue
+    out['model_integrate/' + m] = {'traj_per_s'  : len(carts) / t,
+                                   'rhs_per_s'   : calls.calls / t,
+                                   'rhs_per_traj': calls.calls /
+                                                   float(len(carts))}
+  return out
+
+
+def bench_zero(repeat, rng):
+  out = {}
+  for m in ['segment', 'DormandPrince', 'RungeKutta']:
+    carts = array(cartridges())
+    ball  = Ballistics(carts, m, 0.0, 1.0, 0.001, 0.001)
+    try:
+      diag = ball.hit_target(rng)
+      t    = best(lambda: ball.hit_target(rng), repeat)
+    except Exception as e:
+      out['hit_target/' + m] = {'error' : repr(e)}
+      continue
+    its = sum([d['iterations'] for d in diag])
+    out['hit_target/' + m] = {'latency_s'  : t / len(carts),
+                              'iterations' : its / float(len(carts))}
+
+  carts = array(cartridges())
+  ball  = Ballistics(carts, 'RungeKutta', 0.0, 1.0, 0.001, 0.001)
+  diag  = ball.batch_zero(carts, rng)
+  t     = best(lambda: ball.batch_zero(carts, rng), repeat)
+  out['batch_zero/RungeKutta'] = {'latency_s'  : t / len(carts),
+                                  'iterations' : diag['iterations'].mean()}
+
+  carts = array(cartridges()[-1:])
+  ball  = Ballistics(carts, 'RungeKutta', 0.0, 1.0, 0.001, 0.001)
+  ball.find_theta(carts[0], 300, 1e-5, 0.0)
+  t = best(lambda: ball.calc_error(carts[0]), repeat)
+  out['calc_error'] = {'latency_s' : t}
+  return out
+
+
+def compare(new, old, threshold):
+  '''
+  PURPOSE:
+    Print the change of every metric in both runs and return the names
+    of those which got worse by more than the fraction threshold.
+  '''
+  worse = []
+  for name in sorted(new):
+    if name not in old:
+      continue
+    for key, value in sorted(new[name].items()):
+      prev = old[name].get(key)
+      if not isinstance(value, float) or not isinstance(prev, float) \
+         or key in ('iterations', 'rhs_per_traj') or prev == 0:
+        continue
+      # rates are better higher, latencies lower :
+      change = value / prev - 1.0
+      if key.endswith('_s') and not key.endswith('per_s'):
+        change = -change
+      flag = ''
+      if change < -threshold:
+        flag = '  REGRESSION'
+        worse.append('%s %s' % (name, key))
+      print('%-32s %-14s %12.4g %12.4g %+7.1f%%%s'
+            % (name, key, prev, value, 100*change, flag))
+  return worse
+
+
+def main(argv=None):
+  p = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+  p.add_argument('-o', '--output', help='JSON file to save results in')
+  p.add_argument('-c', '--compare', help='JSON results to compare with')
+  p.add_argument('-r', '--repeat', type=int, default=3,
+                 help='timing repeats, the best is kept (default 3)')
+  p.add_argument('-n', type=int, default=20000,
+                 help='calls per kernel benchmark (default 20000)')
+  p.add_argument('--range', type=float, default=600.0,
+                 help='range in meters to integrate to (default 600)')
+  p.add_argument('--zero', type=float, default=300.0,
+                 help='range in meters to zero at (default 300)')
+  p.add_argument('--threshold', type=float, default=0.2,
+                 help='fractional slowdown reported as a regression')
+  a = p.parse_args(argv)
+
+  results = {}
+  results.update(bench_import(a.repeat))
+  results.update(bench_kernels(a.repeat, a.n))
+  results.update(bench_integrate(a.repeat, a.range))
+  results.update(bench_zero(a.repeat, a.zero))
+
+  for name in sorted(results):
+    print('%-32s %s' % (name, ', '.join('%s=%.4g' % kv if
+                        isinstance(kv[1], float) else '%s=%s' % kv
+                        for kv in sorted(results[name].items()))))
+
+  doc = {'meta'    : {'python'   : platform.python_version(),
+                      'numpy'    : numpy.__version__,
+                      'platform' : platform.platform(),
+                      'time'     : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                      'args'     : vars(a)},
+         'results' : results}
+  if a.output:
+    with open(a.output, 'w') as f:
+      json.dump(doc, f, indent=2, sort_keys=True)
+
+  if a.compare:
+    with open(a.compare) as f:
+      old = json.load(f)['results']
+    print()
+    worse = compare(results, old, a.threshold)
+    if worse:
+      print('\n%d regression(s)' % len(worse))
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,182 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy     import arange, asarray, atleast_1d, empty_like, exp, log, \
+                      sqrt, interp, nan, isnan, broadcast_arrays
+from threading import Lock
+
+R_AIR   = 287.05287     # specific gas constant of dry air - J/(kg K)
+R_VAP   = 461.495       # specific gas constant of water vapour - J/(kg K)
+GAMMA   = 1.4           # ratio of specific heats of air
+G0      = 9.80665       # standard gravity - m/s^2
+T0      = 288.15        # sea level standard temperature - K
+P0      = 101325.0      # sea level standard pressure - Pa
+RHO_STD = 1.225         # density the drag tables are referred to - kg/m^3
+A_STD   = 340.294       # speed of sound the drag tables are indexed by - m/s
+
+# base altitude (m) and temperature lapse rate (K/m) of the ISA layers :
+LAYERS  = [(0.0,     -0.0065),
+           (11000.0,  0.0),
+           (20000.0,  0.001),
+           (32000.0,  0.0028),
+           (47000.0,  0.0)]
+
+
+def _layers(h):
+  '''
+  PURPOSE:
+    Exact ISA temperature and pressure at geopotential altitudes h.
+  '''
+  h = asarray(h, dtype=float)
+  T = empty_like(h)
+  P = empty_like(h)
+  Tb, Pb = T0, P0
+  for i, (hb, L) in enumerate(LAYERS):
+    top = LAYERS[i+1][0] if i + 1 < len(LAYERS) else float('inf')
+    on  = (h >= hb) & (h < top) if i else (h < top)
+    dh  = h[on] - hb
+    T[on] = Tb + L*dh
+    if L == 0.0:
+      P[on] = Pb*exp(-G0*dh / (R_AIR*Tb))
+    else:
+      P[on] = Pb*(T[on]/Tb)**(-G0 / (L*R_AIR))
+    if top < float('inf'):
+      dt = top - hb
+      Pb = Pb*exp(-G0*dt / (R_AIR*Tb)) if L == 0.0 else \
+           Pb*((Tb + L*dt)/Tb)**(-G0 / (L*R_AIR))
+      Tb = Tb + L*dt
+  return T, P
+
+
+_tables = {}
+_lock   = Lock()
+
+def isa_table(step=10.0, top=50000.0):
+  '''
+  PURPOSE:
+    The shared table of ISA temperature and pressure against altitude,
+    built on first use.
+  INPUTS:
+    step - altitude spacing in meters.
+    top  - highest altitude in meters.
+  OUTPUTS:
+    h, T, lnP - altitudes (m), temperatures (K) and the logarithms of
+                the pressures (Pa).
+  '''
+  key   = (step, top)
+  table = _tables.get(key)
+  if table is None:
+    with _lock:
+      table = _tables.get(key)
+      if table is None:
+        h     = arange(-1000.0, top + step, step)
+        T, P  = _layers(h)
+        table = (h, T, log(P))
+        _tables[key] = table
+  return table
+
+
+def standard(altitude):
+  '''
+  PURPOSE:
+    ISA temperature and pressure at altitudes in meters, interpolated
+    from isa_table (pressure in its logarithm).
+  OUTPUTS:
+    T - temperatures in K.
+    P - pressures in Pa.
+  '''
+  h, T, lnP = isa_table()
+  return interp(altitude, h, T), exp(interp(altitude, h, lnP))
+
+
+def saturation_pressure(T):
+  '''
+  PURPOSE:
+    Saturation vapour pressure of water in Pa at temperatures T in K
+    (Buck's equation).
+  '''
+  Tc = asarray(T, dtype=float) - 273.15
+  return 611.21*exp((18.678 - Tc/234.5) * (Tc/(257.14 + Tc)))
+
+
+class Atmosphere(object):
+  """
+  Air at the firing point, from the International Standard Atmosphere
+  at an altitude with optional measured temperature, pressure and
+  humidity.  G model drag is scaled by density_ratio and indexed by
+  Mach number through sound_ratio.
+  """
+  def __init__(self, altitude=0.0, temperature=None, pressure=None,
+               humidity=0.0):
+    """
+    INPUTS:
+      altitude    -- altitude above sea level - m
+      temperature -- air temperature - degrees C (default ISA)
+      pressure    -- station pressure - Pa (default ISA)
+      humidity    -- relative humidity in [0, 1]
+    OUTPUTS:
+      T             -- temperature - K
+      P             -- pressure - Pa
+      rho           -- density of moist air - kg/m^3
+      a             -- speed of sound - m/s
+      density_ratio -- rho / RHO_STD
+      sound_ratio   -- A_STD / a, the factor taking a speed to the
+                       standard speed of the same Mach number
+    """
+    T, P = standard(altitude)
+    if temperature is not None:
+      T = temperature + 273.15
+    if pressure is not None:
+      P = pressure
+    e = humidity * saturation_pressure(T)
+
+    self.altitude      = altitude
+    self.humidity      = humidity
+    self.T             = float(T)
+    self.P             = float(P)
+    self.rho           = float((P - e)/(R_AIR*T) + e/(R_VAP*T))
+    self.a             = float(sqrt(GAMMA*R_AIR*T / (1 - 0.378*e/P)))
+    self.density_ratio = self.rho / RHO_STD
+    self.sound_ratio   = A_STD / self.a
+
+  def __repr__(self):
+    return 'Atmosphere(altitude=%g, T=%.2f K, P=%.0f Pa, rho=%.4f, a=%.2f)' \
+           % (self.altitude, self.T, self.P, self.rho, self.a)
+
+  def key(self):
+    '''
+    PURPOSE:
+      The values of this atmosphere which change a trajectory.
+    '''
+    return (self.rho, self.sound_ratio)
+
+
+def sweep(altitudes=0.0, temperatures=None, pressures=None, humidities=0.0):
+  '''
+  PURPOSE:
+    Atmospheres for arrays of conditions, broadcast against each other,
+    for batched solves over many atmospheres with
+    Ballistics.batch_at_ranges.
+  INPUTS:
+    arrays or scalars as in Atmosphere, None for ISA values.
+  OUTPUTS:
+    list of Atmosphere.
+  '''
+  none = lambda x: nan if x is None else x
+  h, t, p, u = broadcast_arrays(*[atleast_1d(asarray(none(x), dtype=float))
+                                  for x in (altitudes, temperatures,
+                                            pressures, humidities)])
+  return [Atmosphere(hi, None if isnan(ti) else ti,
+                     None if isnan(pi) else pi, ui)
+          for hi, ti, pi, ui in zip(h, t, p, u)]
@@ -13,27 +13,41 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys
-sys.path.append("../../ode_solvers/src")
-
-from Predictor            import *
-from RungeKutta           import *
-from EulerRichardson      import *
-from Euler                import *
-from EulerCromer          import *
-from scipy.integrate._ode import *
-from scipy.interpolate    import interp1d
-from Cartridge            import *
-from numpy                import *
+from Cartridge            import Cartridge
+from CartridgeTable       import CartridgeTable
+from DragTable            import DragTableStack, compile_table
+from DragCurve            import DragCurve
+from Atmosphere           import RHO_STD
+from Trajectory           import Trajectory
+from TrajectoryCache      import TrajectoryCache, make_key
+from Instruments          import Instruments, DictSink, NULL
+from Figures              import FigureTemplate, render, new_figure, \
+                                 downsample, units_of
+from numpy                import array, asarray, ascontiguousarray, \
+                                 atleast_1d, zeros, ones, empty, full, \
+                                 arange, append, repeat, tile, vstack, \
+                                 column_stack, diff, sort, nonzero, \
+                                 sqrt, sin, cos, arctan, arctan2, ceil, \
+                                 rint, maximum, minimum, inf, nan, pi, \
+                                 newaxis, ndarray, where, isnan
 
 import functions as func
-import random
-import matplotlib.pyplot as plt
+import integrators
+import events as evt
+try:
+  from multiprocessing import shared_memory
+except ImportError:
+  shared_memory = None
+
+# the step counts of the adaptive methods kept in cart.stats :
+STATS = ('nsteps', 'nreject', 'nfev')
 
 class Ballistics:
 
   def __init__(self, cart, intMethod, t0, tf, dt, intDt, y0=0.0,
-               model='g', rho=1.225):
+               model='g', rho=1.225, flat_angle=0.0873, tmax=10.0,
+               ground=None, rtol=1e-6, atol=1e-9, cache=None,
+               instrument=None, atmosphere=None):
     '''
     Purpose:
       Initialize the variables and data.
@@ -41,7 +55,7 @@ class Ballistics:
       cart      - a Cartridge object.
       intMethod - string name of integration method choices are:
                   {RungeKutta, Predictor, EulerRichardson, Euler,
-                   EulerCromer}
+                   EulerCromer, segment, DormandPrince (or RK45)}
       traj      - trajectory choice {s, l}
       t0        - initial time in seconds
       tf        - end time in seconds
@@ -49,95 +63,1125 @@ class Ballistics:
       intDt     - time step for integrator to integrate in seconds
       y0        - initial height of bullet
       model     - model to use {g or e}
-      rho       - density of fluid (air) in kg/m^3
+      rho       - density of fluid (air) in kg/m^3, G model drag is
+                  scaled by rho / Atmosphere.RHO_STD
+      flat_angle - largest launch angle in radians integrated by the
+                   segment method, steeper shots use the ODE path
+      tmax      - longest time in seconds to integrate while waiting for
+                  a terminal event such as the target range
+      ground    - height in meters of the ground relative to the line
+                  of sight, enables the impact event (default None)
+      rtol      - relative error tolerance of adaptive methods
+      atol      - absolute error tolerance of adaptive methods
+      cache     - TrajectoryCache of integrated trajectories and zeroing
+                  results (default None, no caching)
+      instrument - Instruments counting RHS evaluations, steps, zeroing
+                   iterations and cache hits and timing each phase
+                   (default None, disabled)
+      atmosphere - Atmosphere giving the air density, in place of rho,
+                   and the speed of sound indexing G model drag by Mach
+                   number (default None, standard speed of sound)
     '''
     self.n            = len(cart)
     self.cart         = cart    # array of cartridge objects
     self.g            = 32.174  # ft/sec for model coefficients
     self.intDt        = intDt
     self.t0           = t0
+    self.tf           = tf
     self.dt           = dt
     self.times        = arange(t0,tf,dt)
     self.intMethod    = intMethod
     self.model        = model
     self.rho          = rho
+    self.atmosphere   = atmosphere
+    self.mach         = 1.0
+    if atmosphere is not None:
+      self.rho        = atmosphere.rho
+      self.mach       = atmosphere.sound_ratio
+    self.flat_angle   = flat_angle
+    self.tmax         = tmax
+    self.ground       = ground
+    self.rtol         = rtol
+    self.atol         = atol
+    self.cache        = cache
+    self.instrument   = NULL if instrument is None else instrument
     self.vx           = zeros(self.n)
     self.vy           = zeros(self.n)
     self.x0           = []
     self.y0           = y0
 
 
-  def model_integrate(self, cart):
+  def _spec(self):
+    '''
+    PURPOSE:
+      The constructor arguments of this object other than the cartridges
+      and cache, so that worker processes can rebuild it.
+    '''
+    return {'intMethod'  : self.intMethod,
+            't0'         : self.t0,
+            'tf'         : self.tf,
+            'dt'         : self.dt,
+            'intDt'      : self.intDt,
+            'y0'         : self.y0,
+            'model'      : self.model,
+            'rho'        : self.rho,
+            'atmosphere' : self.atmosphere,
+            'flat_angle' : self.flat_angle,
+            'tmax'       : self.tmax,
+            'ground'     : self.ground,
+            'rtol'       : self.rtol,
+            'atol'       : self.atol}
+
+
+  def model_integrate(self, cart, rng=None, events=None):
     '''
     PURPOSE:
       Integrate through the model using the initialized parameters.
     INPUTS:
-      model - {g,e} g = G model , e = Evan's model
+      model  - {g,e} g = G model , e = Evan's model
+      rng    - range in meters at which to stop integrating (default
+               None, integrate to tf).
+      events - list of events.Event to locate (default the apex,
+               transonic, subsonic, range and ground impact events).
+    OUTPUTS:
+      the Trajectory dense output of the integration.
+    OUTCOME:
+      cart.y and cart.t hold the trajectory samples, cart.trajectory
+      their dense output, and cart.events maps each event name to the
+      (t, [x, vx, y, vy]) where it occurred.  When a terminal event such
+      as the range is given, integration stops on it, continuing past
+      tf up to tmax if needed.
+    '''
+    inst = self.instrument
+    with inst.phase('model_integrate'):
+      key = None
+      if events is None:
+        events = evt.default_events(rng, self.ground)
+        if self.cache is not None:
+          key = self._cache_key(cart, 'trajectory', list(cart.y0), rng)
+          hit = self.cache.get(key)
+          if hit is not None:
+            inst.count('cache_hits')
+            return self._unpack(cart, hit)
+          inst.count('cache_misses')
+      elif rng is not None:
+        events = list(events) + [evt.range_event(rng)]
+
+      with inst.phase('integrate'):
+        if self.intMethod == 'segment':
+          self.segment_integrate(cart, events)
+        elif self.intMethod in ('DormandPrince', 'RK45'):
+          self.adaptive_integrate(cart, events)
+        else:
+          self.ode_integrate(cart, events)
+      inst.count('trajectories')
+      with inst.phase('dense_output'):
+        cart.trajectory = self._trajectory(cart)
+      if key is not None:
+        self.cache.put(key, self._pack(cart))
+      return cart.trajectory
+
+
+  def _cache_key(self, cart, kind, *extra):
+    '''
+    PURPOSE:
+      Content hash of cart's ballistic properties and every setting of
+      this object that changes its trajectory, for the cache.
+    '''
+    return make_key(kind, cart.mv, cart.bc, cart.mass, cart.A, cart.drag.G,
+                    self.model, self.intMethod, self.g, self.rho, self.mach,
+                    self.t0,
+                    self.dt, self.intDt, len(self.times), self.tmax,
+                    self.ground, self.flat_angle, self.rtol, self.atol,
+                    extra)
+
+
+  def _pack(self, cart):
+    '''
+    PURPOSE:
+      Arrays holding cart's integrated trajectory and events, and the
+      step counts of the adaptive methods.
+    '''
+    names = sorted(cart.events)
+    ev_y  = array([cart.events[k][1] for k in names]).reshape(-1, 4)
+    hit   = {'t'       : cart.trajectory.t,
+             'y'       : cart.trajectory.y,
+             'dy'      : cart.trajectory.dy,
+             'ev_name' : array(names, dtype=str),
+             'ev_t'    : array([cart.events[k][0] for k in names]),
+             'ev_y'    : ev_y}
+    if self.intMethod in ('DormandPrince', 'RK45'):
+      hit['stats'] = array([cart.stats[k] for k in STATS], dtype=float)
+    return hit
+
+
+  def _unpack(self, cart, hit):
+    '''
+    PURPOSE:
+      Restore cart's trajectory and events from a cache entry.
+    '''
+    cart.t = hit['t']
+    cart.y = hit['y']
+    cart.events = dict((str(k), (t, y)) for k, t, y in
+                       zip(hit['ev_name'], hit['ev_t'], hit['ev_y']))
+    cart.trajectory = Trajectory(hit['t'], hit['y'], hit['dy'], cart.mass)
+    if 'stats' in hit:
+      cart.stats = dict(zip(STATS, [int(n) for n in hit['stats']]))
+    return cart.trajectory
+
+
+  def ode_integrate(self, cart, events=(), chunk=64):
+    '''
+    PURPOSE:
+      Integrate with the fixed-step method intMethod of
+      integrators.STEPS, taking steps of intDt and sampling every dt.
+      The grid is integrated chunk samples at a time, each chunk in one
+      call, and scanned for events after each.
+    INPUTS:
+      events - list of events.Event to locate.
+      chunk  - samples integrated per call (default 64).
+    OUTCOME:
+      cart.y, cart.t and cart.events are set as in model_integrate.
+    '''
+    if self.intMethod not in integrators.STEPS:
+      raise ValueError('unknown integration method %r' % self.intMethod)
+    step    = integrators.STEPS[self.intMethod]
+    f, args = self._rhs(cart)
+    f       = self.instrument.counted('rhs', f)
+    rhs     = lambda t, y: f(t, y, *args)
+    nsteps  = self._nsteps(events)
+    nsub    = int(maximum(1, rint(self.dt / self.intDt)))
+
+    cart.events = {}
+    y = [array(cart.y0, dtype=float)]
+    T = [self.t0]
+    k = 0
+    stop = None
+    while k < nsteps and stop is None:
+      m      = int(minimum(chunk, nsteps - k))
+      tc, yc = integrators.fixed_grid(step, f, T[-1], y[-1], self.dt, nsub,
+                                      m, args)
+      for j in range(1, m + 1):
+        stop = evt.scan(events, cart.events, tc[j-1], yc[j-1], tc[j],
+                        yc[j], rhs)
+        if stop is not None:
+          T.append(stop[0])
+          y.append(stop[1])
+          break
+        T.append(tc[j])
+        y.append(yc[j])
+      k += m
+    self.instrument.count('steps', (len(T) - 1)*nsub)
+    cart.y = array(y)
+    cart.t = array(T)
+
+
+  def adaptive_integrate(self, cart, events=(), ranges=None):
+    '''
+    PURPOSE:
+      Integrate with the adaptive Dormand-Prince 5(4) method, whose
+      step size follows the local error estimate against rtol and atol.
+      Output samples are taken from the method's dense output.
+    INPUTS:
+      events - list of events.Event to locate.
+      ranges - ranges in meters at which to sample the trajectory
+               (default None, sample every dt as the fixed-step methods
+               do).
+    OUTCOME:
+      cart.y, cart.t and cart.events are set as in model_integrate and
+      cart.stats holds the number of accepted steps, rejected steps and
+      RHS evaluations.
+    '''
+    f, args = self._rhs(cart)
+    rhs     = lambda t, y: f(t, y, *args)
+    nsteps  = self._nsteps(events)
+    tf      = self.t0 + nsteps*self.dt
+    solver  = integrators.DormandPrince(f, args, self.rtol, self.atol)
+    solver.start(self.t0, cart.y0)
+
+    if ranges is None:
+      targets = self.t0 + self.dt*arange(1, nsteps + 1)
+      y = [array(cart.y0, dtype=float)]
+      T = [self.t0]
+    else:
+      targets = sort(ranges)
+      y = []
+      T = []
+
+    cart.events = {}
+    k = 0
+    while solver.t < tf:
+      t0, y0 = solver.t, solver.y
+      t1, y1 = solver.step()
+      stop = evt.scan(events, cart.events, t0, y0, t1, y1, rhs,
+                      solver.dense)
+      if stop is not None and stop[0] > tf:
+        stop = None
+      tend, yend = (t1, y1) if stop is None else stop
+
+      # output samples passed in this step :
+      while k < len(targets):
+        if ranges is None and targets[k] <= tend:
+          T.append(targets[k])
+          y.append(solver.dense(targets[k]))
+        elif ranges is not None and targets[k] <= yend[0]:
+          e = evt.Event(k, lambda t, y, xk=targets[k]: y[0] - xk, 1)
+          ts, ys = evt.locate(e, t0, tend, solver.dense)
+          T.append(ts)
+          y.append(ys)
+        else:
+          break
+        k += 1
+      if stop is not None:
+        T.append(stop[0])
+        y.append(stop[1])
+        break
+
+    for name in list(cart.events):
+      if cart.events[name][0] > tf:
+        del cart.events[name]
+    cart.y = array(y)
+    cart.t = array(T)
+    cart.stats = {'nsteps'  : solver.nsteps,
+                  'nreject' : solver.nreject,
+                  'nfev'    : solver.nfev}
+    self.instrument.count('rhs',      solver.nfev)
+    self.instrument.count('steps',    solver.nsteps)
+    self.instrument.count('rejected', solver.nreject)
+
+
+  def _rhs(self, cart):
+    '''
+    PURPOSE:
+      Return the right-hand side function and its extra arguments for
+      cart under the current model.
     '''
     if self.model == 'g':
-      i = ode(func.fbar_gmodel)
-      i.set_f_params(self.g, cart.bc, cart.model)
+      drag, bc = self._drag(cart)
+      return func.fbar_gmodel, (self.g, bc, drag)
     elif self.model == 'e':
-      i = ode(func.fbar_emodel)
-      i.set_f_params(self.g, cart.mass, self.rho, cart.A)
-    
-    i.set_integrator(self.intMethod, dt=self.intDt)
-    i.set_initial_value(cart.y0, self.t0)
-    cart.y.append(cart.y0)
-    for t in self.times:
-      i.integrate(i.t + self.dt)
-      cart.y.append(i.y)
-    cart.y = array(cart.y)
+      return func.fbar_emodel, (self.g, cart.mass, self.rho, cart.A,
+                                self._curve([cart.drag]))
 
 
-  def find_theta(self, cart, rng, tol, zero):
+  def _drag(self, cart):
     '''
     PURPOSE:
-      Find the optimal theta to range in the rifle.
+      cart's G model drag table indexed by Mach number in this object's
+      air, and its ballistics coefficient divided by the density ratio.
+    '''
+    return compile_table(cart.drag, self.mach), cart.bc * RHO_STD / self.rho
+
+
+  def _curve(self, drags):
+    '''
+    PURPOSE:
+      The DragCurve giving the e model drag coefficient in this object's
+      air for lanes with the drag tables drags, or None for get_cd when
+      none is a curve.  The lanes of a batch must share one curve.
+    '''
+    curves = [d for d in drags if isinstance(d, DragCurve)]
+    if not curves:
+      return None
+    if len(curves) < len(drags) or any(d is not curves[0] for d in curves):
+      raise ValueError('e model lanes must share one drag curve')
+    return compile_table(curves[0], self.mach)
+
+
+  def _trajectory(self, cart):
+    '''
+    PURPOSE:
+      Build the Trajectory dense output of cart.t and cart.y from the
+      model's derivatives at the samples.
+    '''
+    keep = append(True, diff(cart.t) > 0)
+    t, y = cart.t[keep], cart.y[keep]
+    return Trajectory(t, y, self._derivs(cart, t, y), cart.mass)
+
+
+  def _derivs(self, cart, t, y):
+    '''
+    PURPOSE:
+      The model's derivatives of cart's (n, 4) states y at times t.
+    '''
+    if self.model == 'g':
+      drag, bc = self._drag(cart)
+      drag = DragTableStack([drag.fold(bc)])
+      return func.fbar_gmodel_batch(t, y, self.g, drag, zeros(len(y), int))
+    elif self.model == 'e':
+      return func.fbar_emodel_batch(t, y, self.g, cart.mass, self.rho,
+                                    cart.A, self._curve([cart.drag]))
+
+
+  def _nsteps(self, events):
+    '''
+    PURPOSE:
+      Number of dt output steps to take, running on to tmax when a
+      terminal event will end the integration.
+    '''
+    for e in events:
+      if e.terminal:
+        return int(ceil((self.tmax - self.t0) / self.dt))
+    return len(self.times)
+
+
+  def segment_integrate(self, cart, events=()):
+    '''
+    PURPOSE:
+      Integrate the G model in the velocity domain, stepping from one
+      drag table breakpoint to the next with the flat-fire solution of
+      functions.gmodel_segment rather than in fixed dt steps.  Gravity
+      drop is added from the same quadrature.  The e model and shots
+      steeper than flat_angle fall back to batch_integrate.
     INPUTS:
-      Theta - angle (begins with 0.0 rad)
-      dist  - target range in meters
-      zero  - distance from zero (default 0.0)
+      events - list of events.Event to locate between breakpoints.
     OUTCOME:
-      Ballistics.theta is changed to optimal theta (err < 0.01 inches)
+      cart.y is set to [x, vx, y, vy] at each breakpoint crossed up to
+      tf (or the first terminal event), cart.t to the matching times
+      and cart.events to the events found.
     '''
-    cart.y = []  # initialize the history for (new) shot
-    vx, vy  = func.vel_comp(cart.mv, cart.theta)
-    cart.y0 = [0.0, vx, cart.traj[0], vy]
-    self.model_integrate(cart)
-    
-    x = cart.y[:,0]           # x-position
-    y = cart.y[:,2]           # y-position
-    f = interp1d(x, y)
-    xint = array([rng])
-    yint = f(xint)
-    print 'yErr:', yint[0], '\ttheta:', cart.theta, '\tzero:', zero
-    yErr = yint[0]
-    
-    if (yErr < zero and yErr > zero - tol) or \
-       (yErr > zero and yErr < zero + tol):
-      None
-    elif yErr > zero + tol:
-      cart.theta = cart.theta - math.atan( (abs(yErr) + zero) / rng ) / 1.15
-      self.find_theta(cart, rng, tol, zero)
-    elif yErr < zero - tol:
-      cart.theta = cart.theta + math.atan( (abs(yErr) + zero) / rng ) / 1.15
-      self.find_theta(cart, rng, tol, zero)
+    x0, vx0, y0, vy0 = cart.y0
+    theta = arctan2(vy0, vx0)
+    if self.model != 'g' or abs(theta) > self.flat_angle:
+      self.batch_integrate(array([cart]), nsteps=self._nsteps(events))
+      self._scan_history(cart, events)
+      return
+    cart.events = {}
+
+    f, args = self._rhs(cart)
+    rhs   = lambda t, y: f(t, y, *args)
+    c     = func.m_to_ft(1.0)
+    drag  = self._drag(cart)
+    drag  = drag[0].fold(drag[1])
+    tf    = self.t0 + self._nsteps(events)*self.dt
+    v     = c * sqrt(vx0**2 + vy0**2)
+    nodes = drag.v[drag.v < v][::-1]      # breakpoints below v
+
+    t, s, J, K = self.t0, 0.0, 0.0, 0.0
+    y = [array(cart.y0, dtype=float)]
+    T = [t]
+    for vb in nodes:
+      dt, ds, dJ, dK = func.gmodel_segment(drag, v, vb, J)
+      last = t + dt >= tf
+      if last:
+        vb = self._segment_end(drag, v, vb, J, tf - t)
+        dt, ds, dJ, dK = func.gmodel_segment(drag, v, vb, J)
+      t += dt
+      s += ds
+      K += dK
+      J += dJ
+      v  = vb
+      w  = v / c
+      yn = array([x0 + s*cos(theta), w*cos(theta),
+                  y0 + s*sin(theta) - self.g*K, w*sin(theta) - self.g*w*J])
+      stop = evt.scan(events, cart.events, T[-1], y[-1], t, yn, rhs)
+      if stop is not None:
+        T.append(stop[0])
+        y.append(stop[1])
+        break
+      T.append(t)
+      y.append(yn)
+      if last:
+        break
+    self.instrument.count('segments', len(T) - 1)
+    cart.y = array(y)
+    cart.t = array(T)
+
+
+  def _scan_history(self, cart, events):
+    '''
+    PURPOSE:
+      Locate events along an already integrated cart.y history,
+      truncating it at the first terminal event.
+    '''
+    f, args = self._rhs(cart)
+    rhs = lambda t, y: f(t, y, *args)
+    cart.events = {}
+    for k in range(1, len(cart.y)):
+      stop = evt.scan(events, cart.events, cart.t[k-1], cart.y[k-1],
+                      cart.t[k], cart.y[k], rhs)
+      if stop is not None:
+        cart.y = vstack([cart.y[:k], stop[1]])
+        cart.t = append(cart.t[:k], stop[0])
+        break
+
+
+  def _segment_end(self, drag, va, vb, J, T, tol=1e-10):
+    '''
+    PURPOSE:
+      Find the speed reached T seconds after entering a segment at va
+      by safeguarded Newton iteration on the segment time.
+    '''
+    c      = func.m_to_ft(1.0)
+    lo, hi = vb, va
+    u      = va
+    for k in range(20):
+      F = func.gmodel_segment(drag, va, u, J)[0] - T
+      if abs(F) < tol * T:
+        break
+      if F > 0:
+        lo = u
+      else:
+        hi = u
+      A, M = drag.lookup(u)
+      u = u + F * c * A * u**M           # Newton step, dF/du = -1/(cD)
+      if not lo < u < hi:
+        u = (lo + hi) / 2.0
+    return u
+
+
+  def batch_integrate(self, cart=None, rng=None, nsteps=None):
+    '''
+    PURPOSE:
+      Integrate many cartridges together, advancing every lane's
+      [x, vx, y, vy] state as one (N, 4) array with the fixed-step
+      method of _batch_steps.  Lanes which pass their range are
+      dropped from the batch.
+    INPUTS:
+      cart - array of Cartridge objects (default Ballistics.cart).
+      rng  - float or (N,) array of ranges in meters at which each lane
+             is retired (default None, integrate every lane to tf).
+      nsteps - number of dt steps to take (default len(times)).
+    OUTCOME:
+      each Cartridge.y is set to its trajectory history, sampled every
+      dt as in model_integrate, ending on the first sample past rng,
+      Cartridge.t to the sample times and Cartridge.trajectory to
+      their dense output.
+    '''
+    if cart is None:
+      cart = self.cart
+    n = len(cart)
+    if rng is None:
+      rng = inf
+    if nsteps is None:
+      nsteps = len(self.times)
+
+    y0   = array([c.y0 for c in cart], dtype=float)
+    hist = empty((nsteps + 1, n, 4))
+    hist[0] = y0
+    count   = ones(n, dtype=int)
+    with self.instrument.phase('batch_integrate'):
+      for k, t, active, yp, y in self._batch_steps(y0, cart, rng, nsteps):
+        hist[k+1, active] = y
+        count[active]     = k + 2
+
+    for i in range(n):
+      cart[i].y = hist[:count[i], i].copy()
+      cart[i].t = self.t0 + self.dt*arange(count[i])
+      cart[i].trajectory = self._trajectory(cart[i])
+
+
+  def batch_at_ranges(self, y0, cart, ranges, bc=None, rho=None,
+                      nsteps=None, sens=False, atmosphere=None, wind=None,
+                      omega=None):
+    '''
+    PURPOSE:
+      Integrate a batch of lanes and return only their states at the
+      given ranges, without keeping the trajectories.  Lanes retire
+      once they pass the last range.
+    INPUTS:
+      y0     - (N, 4) initial states [x, vx, y, vy] of the lanes.
+      cart   - Cartridge, (N,) array of Cartridges or CartridgeTable,
+               giving each lane's mass, area and drag table.
+      ranges - (k,) increasing ranges in meters.
+      bc     - (N,) ballistics coefficients (default those of cart).
+      rho    - (N,) air densities (default Ballistics.rho).
+      nsteps - number of dt steps allowed (default up to tmax).
+      sens   - also integrate the sensitivities of the states to
+               functions.SENS_PARAMS (default False).
+      atmosphere - (N,) Atmosphere of each lane, in place of rho, for
+                   sweeps over many atmospheres in one batch.
+      wind   - (N, 3) or (3,) air velocities of functions.wind_vector,
+               integrating the 3-D state [x, vx, y, vy, z, vz] with z to
+               the right of the line of fire (default None, 2-D).
+      omega  - (N, 3) or (3,) angular velocity of the earth from
+               functions.earth_rotation, adding Coriolis acceleration to
+               the 3-D state (default None).
+    OUTPUTS:
+      y - (N, k, 4) states at each range, nan where it was not reached,
+          (N, k, 6) 3-D states with wind or omega, or (N, k, 20) states
+          and flattened sensitivities when sens.
+      t - (N, k) times of flight to each range.
+    '''
+    y0     = asarray(y0, dtype=float)
+    if sens and (wind is not None or omega is not None):
+      raise ValueError('sensitivities are only integrated in 2-D')
+    if sens:
+      y0   = func.sens_initial(y0)
+    elif (wind is not None or omega is not None) and y0.shape[1] == 4:
+      y0   = column_stack([y0, zeros((len(y0), 2))])
+    ranges = asarray(ranges, dtype=float)
+    n      = len(y0)
+    if nsteps is None:
+      nsteps = int(ceil((self.tmax - self.t0) / self.dt))
+
+    yr = full((n, len(ranges), y0.shape[1]), nan)
+    tr = full((n, len(ranges)), nan)
+    at = y0[:,0:1] >= ranges
+    yr[at] = repeat(y0[:,newaxis], len(ranges), 1)[at]
+    tr[at] = self.t0
+    mach  = None
+    if atmosphere is not None:
+      rho  = array([a.rho for a in atmosphere])
+      mach = array([a.sound_ratio for a in atmosphere])
+    steps = self._batch_steps(y0, cart, ranges[-1], nsteps, bc, rho, sens,
+                              mach, wind, omega)
+    with self.instrument.phase('batch_at_ranges'):
+      for k, t, active, yp, y in steps:
+        li, rj = nonzero((yp[:,0:1] < ranges) & (y[:,0:1] >= ranges))
+        if len(li):
+          w = (ranges[rj] - yp[li,0]) / (y[li,0] - yp[li,0])
+          yr[active[li], rj] = yp[li] + w[:,newaxis]*(y[li] - yp[li])
+          tr[active[li], rj] = t - self.dt + w*self.dt
+    return yr, tr
+
+
+  def batch_to_range(self, y0, cart, rng, nsteps=None):
+    '''
+    PURPOSE:
+      Integrate a batch of lanes, each only out to its own range, and
+      return their states there.  Positions at a range are cubic
+      Hermite interpolants within the dt step, so that heights are
+      smooth in the range and launch angle.
+    INPUTS:
+      y0     - (N, 4) initial states [x, vx, y, vy] of the lanes.
+      cart   - Cartridge, (N,) array of Cartridges or CartridgeTable.
+      rng    - (N,) range of each lane in meters.
+      nsteps - number of dt steps allowed (default up to tmax).
+    OUTPUTS:
+      y - (N, 4) states at each lane's range, nan where not reached.
+      t - (N,) times of flight.
+    '''
+    y0  = asarray(y0, dtype=float)
+    rng = ones(len(y0)) * rng
+    if nsteps is None:
+      nsteps = int(ceil((self.tmax - self.t0) / self.dt))
+    yr  = full(y0.shape, nan)
+    tr  = full(len(y0), nan)
+    with self.instrument.phase('batch_to_range'):
+      for k, t, active, yp, y in self._batch_steps(y0, cart, rng, nsteps):
+        r  = rng[active]
+        on = (yp[:,0] < r) & (y[:,0] >= r)
+        if on.any():
+          w = _crossing(yp[on], y[on], r[on], self.dt)
+          yr[active[on]] = _hermite(yp[on], y[on], w, self.dt)
+          tr[active[on]] = t - self.dt + w*self.dt
+    return yr, tr
 
 
-  def hit_target(self, rng, tol=1e-5, zero=0.0):
+  def sensitivity(self, cart, ranges):
+    '''
+    PURPOSE:
+      Derivatives of the drop, speed and time of flight at ranges with
+      respect to the muzzle velocity, ballistics coefficient, air
+      density and launch angle (functions.SENS_PARAMS), from a single
+      integration of the variational equations alongside the state.
+    INPUTS:
+      cart   - Cartridge, fired from its launch state cart.y0.
+      ranges - increasing ranges in meters.
+    OUTPUTS:
+      dict with keys
+        range, drop, velocity, time - (k,) values at the ranges, in
+                                      meters, m/s and seconds.
+        J_drop, J_velocity, J_time  - (k, 4) derivatives of each with
+                                      columns ordered as SENS_PARAMS.
+        S                           - (k, 4, 4) derivatives of the state
+                                      [x, vx, y, vy] at the time of
+                                      flight to each range.
+    NOTES:
+      The state sensitivities S are at fixed time, so the derivatives at
+      fixed range remove the motion along the path, e.g.
+        d(drop)/dp = S_y - (vy/vx) S_x.
+    '''
+    ranges = atleast_1d(asarray(ranges, dtype=float))
+    y, t   = self.batch_at_ranges([cart.y0], cart, ranges, sens=True)
+    y, t   = y[0], t[0]
+    S      = y[:,4:].reshape(-1, 4, 4)
+    f      = self._derivs(cart, t, y[:,:4])
+    v      = sqrt(y[:,1]**2 + y[:,3]**2)
+    Sv     = (y[:,1:2]*S[:,1] + y[:,3:4]*S[:,3]) / v[:,newaxis]
+    dv     = (y[:,1]*f[:,1] + y[:,3]*f[:,3]) / v
+    Sx     = S[:,0] / f[:,0:1]       # minus the change in time of flight
+    return {'range'      : ranges,
+            'drop'       : y[:,2],
+            'velocity'   : v,
+            'time'       : t,
+            'J_drop'     : S[:,2] - f[:,2:3]*Sx,
+            'J_velocity' : Sv - dv[:,newaxis]*Sx,
+            'J_time'     : -Sx,
+            'S'          : S}
+
+
+  def wind_table(self, cart, ranges, speeds, angle=pi/2, omega=None):
+    '''
+    PURPOSE:
+      Drop and windage of cartridges at ranges for a bracket of wind
+      speeds, every cartridge and wind speed integrated as one lane of
+      a single 3-D batch.
+    INPUTS:
+      cart   - Cartridge or array of Cartridges, fired from cart.y0.
+      ranges - increasing ranges in meters.
+      speeds - wind speeds in m/s, e.g. mph_to_mps(arange(0, 21, 5)).
+      angle  - direction the wind blows from, clockwise from the line
+               of fire in radians (default pi/2, a full value wind from
+               the right).
+      omega  - angular velocity of the earth from
+               functions.earth_rotation (default None, no Coriolis).
+    OUTPUTS:
+      dict with keys
+        range   - (k,) ranges in meters.
+        speed   - (S,) wind speeds in m/s.
+        drop    - (C, S, k) heights in meters, nan where not reached.
+        windage - (C, S, k) deflections to the right in meters.
+        time    - (C, S, k) times of flight in seconds.
+      where C is the number of cartridges.
+    '''
+    if isinstance(cart, Cartridge):
+      cart = [cart]
+    ranges = atleast_1d(asarray(ranges, dtype=float))
+    speeds = atleast_1d(asarray(speeds, dtype=float))
+    C, S   = len(cart), len(speeds)
+    lanes  = repeat(array(cart, dtype=object), S)
+    y0     = repeat(array([c.y0 for c in cart], dtype=float), S, axis=0)
+    wind   = tile(func.wind_vector(speeds, angle), (C, 1))
+    y, t   = self.batch_at_ranges(y0, lanes, ranges, wind=wind, omega=omega)
+    y      = y.reshape(C, S, len(ranges), 6)
+    return {'range'   : ranges,
+            'speed'   : speeds,
+            'drop'    : y[:,:,:,2],
+            'windage' : y[:,:,:,4],
+            'time'    : t.reshape(C, S, len(ranges))}
+
+
+  def _batch_steps(self, y0, cart, rng, nsteps, bc=None, rho=None,
+                   sens=False, mach=None, wind=None, omega=None):
+    '''
+    PURPOSE:
+      Advance a batch of lanes as one (N, 4) array with steps of size
+      intDt of the fixed-step method intMethod of integrators.STEPS
+      (RungeKutta for the segment and adaptive methods), yielding after
+      every dt.  Lanes which pass their range are dropped from the
+      batch.
+    INPUTS:
+      y0     - (N, 4) initial states.
+      cart   - Cartridge, (N,) array of Cartridges or CartridgeTable of
+               the lanes.
+      rng    - float or (N,) ranges at which the lanes retire.
+      nsteps - number of dt steps to take.
+      bc     - (N,) ballistics coefficients (default those of cart).
+      rho    - (N,) air densities (default Ballistics.rho).
+      sens   - y0 holds the states augmented with their sensitivities,
+               which are advanced by the variational equations.
+      mach   - (N,) speed of sound ratios (default Ballistics.mach).
+      wind   - (N, 3) air velocities; with wind or omega y0 holds the
+               (N, 6) 3-D states, advanced by the 3-D kernels.
+      omega  - (N, 3) angular velocity of the earth.
+    OUTPUTS:
+      yields (k, t, active, yp, y) after step k, where active holds the
+      lanes still in the batch and yp, y their states before and after.
+    '''
+    n = len(y0)
+    if isinstance(cart, Cartridge):
+      cart = [cart] * n
+    if bc is None:
+      bc = cart.bc if isinstance(cart, CartridgeTable) else \
+           [c.bc for c in cart]
+    bc   = array(bc, dtype=float)
+    rng  = ones(n) * rng
+    rho  = ones(n) * (self.rho if rho is None else rho)
+    mach = ones(n) * (self.mach if mach is None else mach)
+    if isinstance(cart, CartridgeTable):
+      mass   = cart.mass
+      A      = cart.A
+      tables = cart.drag_tables(mach)
+    else:
+      mass   = array([c.mass for c in cart], dtype=float)
+      A      = array([c.A for c in cart], dtype=float)
+      tables = [compile_table(c.drag, m) for c, m in zip(cart, mach)]
+    if wind is not None or omega is not None:
+      wind  = ones((n, 3)) * (0.0 if wind is None else wind)
+      if omega is not None:
+        omega = ones((n, 3)) * omega
+    if self.model == 'g':
+      f    = func.fbar_gmodel_sens_batch if sens else func.fbar_gmodel_batch
+      drag = DragTableStack(tables, bc * RHO_STD / rho)
+    elif self.model == 'e':
+      f    = func.fbar_emodel_sens_batch if sens else func.fbar_emodel_batch
+      drag = self._curve([cart.models[d] for d in set(cart.drag)]
+                         if isinstance(cart, CartridgeTable) else
+                         [c.drag for c in cart])
+      if sens and drag is not None:
+        raise ValueError('sensitivities use the e model get_cd only')
+    if wind is not None:
+      f    = func.fbar_gmodel3_batch if self.model == 'g' \
+             else func.fbar_emodel3_batch
+    if not sens:
+      bc   = None
+
+    step   = integrators.STEPS.get(self.intMethod, integrators.rk4_step)
+    if sens and step is integrators.euler_cromer_step:
+      step = integrators.rk4_step     # sensitivities are not [x, v] pairs
+    calls  = integrators.RHS_CALLS[step]
+    nsub   = int(maximum(1, rint(self.dt / self.intDt)))
+    h      = self.dt / nsub
+    active = arange(n)
+    y      = array(y0, dtype=float)
+    t      = self.t0
+    args   = self._batch_args(active, drag, mass, A, rho, bc, wind,
+                              omega)
+    inst   = self.instrument if self.instrument.enabled else None
+    for k in range(nsteps):
+      yp = y
+      for j in range(nsub):
+        y = step(f, t + j*h, y, h, args)
+      t = t + self.dt
+      if inst is not None:
+        inst.count('rhs',   calls*nsub*len(active))
+        inst.count('steps', nsub*len(active))
+      yield k, t, active, yp, y
+
+      # retire lanes which have passed their range :
+      keep = y[:,0] < rng[active]
+      if not keep.all():
+        active = active[keep]
+        y      = y[keep]
+        if len(active) == 0:
+          return
+        args   = self._batch_args(active, drag, mass, A, rho, bc, wind,
+                              omega)
+
+
+  def _batch_args(self, active, drag, mass, A, rho, bc=None, wind=None,
+                  omega=None):
+    '''
+    PURPOSE:
+      Build the extra right-hand-side arguments for the active lanes
+      of a batch, with their bc when integrating sensitivities and their
+      wind and earth rotation when integrating in 3-D.  With the e model
+      drag is the lanes' DragCurve, or None.
+    '''
+    if wind is not None:
+      w = (wind[active], None if omega is None else omega[active])
+      if self.model == 'g':
+        return (self.g, drag, active) + w
+      return (self.g, mass[active], rho[active], A[active]) + w + (drag,)
+    if self.model == 'g' and bc is not None:
+      return (self.g, drag, active, bc[active], rho[active])
+    elif self.model == 'g':
+      return (self.g, drag, active)
+    elif self.model == 'e' and bc is not None:
+      return (self.g, mass[active], rho[active], A[active])
+    elif self.model == 'e':
+      return (self.g, mass[active], rho[active], A[active], drag)
+
+
+  def find_theta(self, cart, rng, tol, zero, maxiter=20):
+    '''
+    PURPOSE:
+      Find the optimal theta to range in the rifle.  The drop at rng is
+      driven to zero by a safeguarded secant iteration on theta,
+      warm-started from cart.theta and falling back to bisection once
+      the root is bracketed.  Each iteration integrates only out to rng.
+    INPUTS:
+      cart    - Cartridge to zero, cart.theta is the starting guess.
+      rng     - target range in meters
+      tol     - allowed distance in meters from zero at rng
+      zero    - distance from zero (default 0.0)
+      maxiter - largest number of trajectories to integrate
+    OUTPUTS:
+      dict of convergence diagnostics with keys
+        theta      - the angle found
+        residual   - height at rng minus zero for that angle
+        iterations - number of trajectories integrated
+        converged  - True if abs(residual) < tol
+    OUTCOME:
+      cart.theta is changed to the optimal theta and cart.y holds its
+      trajectory out to rng.  If rng is not reached, ValueError is
+      raised with cart.theta and cart.y0 left as they were.
+    '''
+    with self.instrument.phase('find_theta'):
+      return self._find_theta(cart, rng, tol, zero, maxiter)
+
+
+  def _find_theta(self, cart, rng, tol, zero, maxiter):
+    '''
+    PURPOSE:
+      The secant iteration of find_theta.  An error raised by it carries
+      the number of trajectories integrated as its iterations, and
+      leaves cart.theta and cart.y0 as they were on entry.
+    '''
+    calls = [0]
+    theta, y0 = cart.theta, cart.y0
+    try:
+      return self._secant(cart, rng, tol, zero, maxiter, calls)
+    except ValueError as e:
+      cart.theta, cart.y0 = theta, y0
+      e.iterations = calls[0]
+      raise
+
+
+  def _secant(self, cart, rng, tol, zero, maxiter, calls):
+    '''
+    PURPOSE:
+      The body of _find_theta, counting trajectories in calls[0].
+    '''
+    def residual(theta):
+      self.instrument.count('zero_iterations')
+      calls[0]  += 1
+      cart.theta = theta
+      vx, vy  = func.vel_comp(cart.mv, theta)
+      cart.y0 = [0.0, vx, cart.traj[0], vy]
+      self.model_integrate(cart, rng=rng)
+      if 'range' not in cart.events:
+        raise ValueError('%s does not reach %g m within tmax' %
+                         (cart.name, rng))
+      return cart.events['range'][1][2] - zero
+
+    if self.cache is not None:
+      key = self._cache_key(cart, 'zero', cart.theta, cart.traj[0], rng,
+                            tol, zero, maxiter)
+      hit = self.cache.get(key)
+      if hit is not None:
+        self.instrument.count('cache_hits')
+        residual(float(hit['theta']))
+        return {'theta'      : cart.theta,
+                'residual'   : float(hit['residual']),
+                'iterations' : int(hit['iterations']),
+                'converged'  : bool(hit['converged'])}
+      self.instrument.count('cache_misses')
+
+    t0 = cart.theta
+    r0 = residual(t0)
+    n  = 1
+    lo = hi = None                # bracket, drop increases with theta
+    best = (abs(r0), t0)
+    t1 = t0 - arctan(r0 / rng)    # first guess from the line of sight
+    while abs(r0) >= tol and n < maxiter:
+      r1 = residual(t1)
+      n += 1
+      if abs(r1) < best[0]:
+        best = (abs(r1), t1)
+      if abs(r1) < tol:
+        t0, r0 = t1, r1
+        break
+      if r1 > 0:
+        hi = t1
+      else:
+        lo = t1
+      if r1 != r0:
+        t2 = t1 - r1 * (t1 - t0) / (r1 - r0)
+      else:
+        t2 = t1 - arctan(r1 / rng)
+      if lo is not None and hi is not None and not lo < t2 < hi and \
+         not hi < t2 < lo:
+        t2 = (lo + hi) / 2.0
+      t0, r0, t1 = t1, r1, t2
+
+    if abs(r0) >= tol and cart.theta != best[1]:
+      r0 = residual(best[1])      # leave cart on the best angle found
+      n += 1
+    diag = {'theta'      : cart.theta,
+            'residual'   : r0,
+            'iterations' : n,
+            'converged'  : abs(r0) < tol}
+    if self.cache is not None:
+      self.cache.put(key, diag)
+    return diag
+
+
+  def batch_zero(self, cart, rng, tol=1e-5, zero=0.0, maxiter=20):
+    '''
+    PURPOSE:
+      Zero many cartridges at many ranges at once.  The safeguarded
+      secant iteration of find_theta runs in lockstep on every
+      (cartridge, range) lane, each iteration integrating the lanes not
+      yet converged as one batch_to_range, so that converged lanes
+      retire early.
+    INPUTS:
+      cart    - (N,) array of Cartridges or CartridgeTable, each lane
+                started from its cartridge's theta.
+      rng     - float, (N,) zero range of each cartridge, or (N, K)
+                ranges broadcast against the cartridges, e.g.
+                [[91.44, 182.88, 274.32]] zeroes every cartridge at 100,
+                200 and 300 yards.
+      tol     - allowed distance in meters from zero at rng
+      zero    - distance from zero, float or broadcast as rng
+      maxiter - largest number of trajectories integrated per lane
+    OUTPUTS:
+      dict of arrays of the shape of rng, (N,) or (N, K), with the keys
+      of the find_theta diagnostics :
+        theta      - the angles found, the best ones tried where not
+                     converged and nan where the range is never reached
+        residual   - heights at rng minus zero for those angles
+        iterations - number of trajectories integrated per lane
+        converged  - True where abs(residual) < tol
+      The cartridges are not changed.
+    '''
+    with self.instrument.phase('batch_zero'):
+      return self._batch_zero(cart, rng, tol, zero, maxiter)
+
+
+  def _batch_zero(self, cart, rng, tol, zero, maxiter):
+    '''
+    PURPOSE:
+      The lockstep secant iteration of batch_zero.
+    '''
+    if isinstance(cart, Cartridge):
+      cart = [cart]
+    n    = len(cart)
+    rng  = asarray(rng, dtype=float)
+    lane = lambda a: a[:,newaxis] if a.ndim == 1 else a
+    K    = lane(rng).shape[1] if rng.ndim else 1
+    R    = (ones((n, K)) * lane(rng)).ravel()
+    Z    = (ones((n, K)) * lane(asarray(zero, dtype=float))).ravel()
+    rows = repeat(arange(n), K)
+    if isinstance(cart, CartridgeTable):
+      lanes = cart.take(rows)
+      sub   = lanes.take
+      mv, h, theta = lanes.mv, lanes.traj.first(), lanes.theta.copy()
+    else:
+      lanes    = empty(n, dtype=object)
+      lanes[:] = list(cart)
+      lanes    = lanes[rows]
+      sub      = lambda i: lanes[i]
+      mv    = array([c.mv for c in lanes], dtype=float)
+      h     = array([c.traj[0] for c in lanes], dtype=float)
+      theta = array([c.theta for c in lanes], dtype=float)
+
+    def residual(i, th):
+      self.instrument.count('zero_iterations', len(i))
+      vx, vy = func.vel_comp(mv[i], th)
+      y0     = column_stack([zeros(len(i)), vx, h[i], vy])
+      y, t   = self.batch_to_range(y0, sub(i), R[i])
+      return y[:,2] - Z[i]
+
+    M      = len(R)
+    every  = arange(M)
+    t0     = theta
+    r0     = residual(every, t0)
+    iters  = ones(M, dtype=int)
+    best_t = t0.copy()
+    best_r = r0.copy()
+    lo     = full(M, nan)         # bracket, drop increases with theta
+    hi     = full(M, nan)
+    t1     = t0 - arctan(r0 / R)  # first guess from the line of sight
+    active = nonzero(abs(r0) >= tol)[0]
+    k      = 1
+    while len(active) and k < maxiter:
+      a  = active
+      r1 = residual(a, t1[a])
+      k += 1
+      iters[a] = k
+      better   = abs(r1) < abs(best_r[a])
+      best_t[a] = where(better | isnan(best_r[a]), t1[a], best_t[a])
+      best_r[a] = where(better | isnan(best_r[a]), r1, best_r[a])
+      hi[a] = where(r1 > 0,  t1[a], hi[a])
+      lo[a] = where(r1 <= 0, t1[a], lo[a])
+      d  = r1 - r0[a]
+      d  = where(d == 0, nan, d)
+      t2 = where(isnan(d), t1[a] - arctan(r1 / R[a]),
+                 t1[a] - r1 * (t1[a] - t0[a]) / d)
+      out = ~((lo[a] < t2) & (t2 < hi[a])) & ~((hi[a] < t2) & (t2 < lo[a]))
+      t2 = where(~isnan(lo[a]) & ~isnan(hi[a]) & out,
+                 (lo[a] + hi[a]) / 2.0, t2)
+      t0[a], r0[a], t1[a] = t1[a], r1, t2
+      active = a[abs(r1) >= tol]     # retire converged and lost lanes
+
+    best_t[isnan(best_r)] = nan
+    shape = (n, K) if rng.ndim == 2 else (n,)
+    return {'theta'      : best_t.reshape(shape),
+            'residual'   : best_r.reshape(shape),
+            'iterations' : iters.reshape(shape),
+            'converged'  : (abs(best_r) < tol).reshape(shape)}
+
+
+  def hit_target(self, rng, tol=1e-5, zero=0.0, maxiter=20, processes=1):
     '''
     PURPOSE:
       Method to begin zero the rifle on desired range and model trajectory.
     INPUT:
-      rng  - the zeroed range in yards you want to hit.
-      zero - distance from zero (default 0.0)
+      rng       - the zeroed range in meters you want to hit.
+      tol       - allowed distance in meters from zero at rng
+      zero      - distance from zero (default 0.0)
+      maxiter   - iteration budget of find_theta for each cartridge
+      processes - number of worker processes the cartridges are spread
+                  over (default 1, zero them one after another)
+    OUTPUT:
+      list of find_theta diagnostics, one per cartridge in input order.
+      A cartridge which fails to zero has the exception under 'error',
+      its starting theta, a nan residual and converged False instead of
+      raising.
     OUTCOME:
-      trajectory saved to Ballistics.x as a numpy array [x, vx, y, vy]
+      each cartridge's trajectory at its zeroed angle, to tf or its
+      farthest measured range, saved to cart.y as [x, vx, y, vy]
     '''
-    for i in range(self.n):
-      self.find_theta(self.cart[i], rng, tol, zero)
- 
+    with self.instrument.phase('hit_target'):
+      if processes <= 1:
+        diags = []
+        for cart in self.cart:
+          theta = cart.theta
+          try:
+            diags.append(self.find_theta(cart, rng, tol, zero, maxiter))
+          except ValueError as e:
+            diags.append(_failed(theta, e))
+            continue
+          self._extend(cart)
+        return diags
+      return self._hit_target_pool(rng, tol, zero, maxiter, processes)
+
+
+  def _extend(self, cart):
+    '''
+    PURPOSE:
+      Integrate cart at its zeroed angle to tf, and on to its farthest
+      measured range if that lies beyond, as find_theta stops at the
+      zero range and calc_error and plot need the whole trajectory.
+    '''
+    far = max([0.0] + [max(x) for x in (cart.x, cart.vel_x)
+                       if x is not None and len(x)])
+    self.model_integrate(cart)
+    if cart.y[-1,0] < far:
+      self.model_integrate(cart, rng=far)
+
+
+  def _hit_target_pool(self, rng, tol, zero, maxiter, processes):
+    '''
+    PURPOSE:
+      Zero the cartridges in a pool of worker processes, adding the
+      workers' counts to this object's instruments.
+    '''
+    from multiprocessing import Pool
+    path = None if self.cache is None else self.cache.path
+    inst = self.instrument
+    if shared_memory is not None:
+      # workers must share our tracker, or theirs frees the blocks :
+      from multiprocessing import resource_tracker
+      resource_tracker.ensure_running()
+    pool = Pool(int(minimum(processes, self.n)))
+    try:
+      jobs = [pool.apply_async(_zero_worker, (self._spec(), c, rng, tol,
+                                              zero, maxiter, path,
+                                              inst.enabled))
+              for c in self.cart]
+      out  = [job.get() for job in jobs]
+    finally:
+      pool.close()
+      pool.join()
+
+    diags = []
+    for cart, (diag, names, shared, counts) in zip(self.cart, out):
+      for name, n in counts.items():
+        inst.count(name, n)
+      if 'error' not in diag:
+        hit = _unshare(shared)
+        hit['ev_name'] = names
+        cart.theta = diag['theta']
+        vx, vy     = func.vel_comp(cart.mv, cart.theta)
+        cart.y0    = [0.0, vx, cart.traj[0], vy]
+        self._unpack(cart, hit)
+      diags.append(diag)
+    return diags
+
   def fire_round(self, cart, theta, tol=1e-5, zero=0.0): 
     '''
     PURPOSE:
@@ -154,7 +1198,14 @@ class Ballistics:
     self.model_integrate(cart)
   
   def calc_error(self, cart):
-    
+    '''
+    PURPOSE:
+      Compare the model trajectory with the cartridge's measured data.
+    OUTPUTS:
+      x, y, v - the model's sampled range, height and speed.
+      yErr    - RMS error of the height at the measured ranges.
+      vErr    - RMS error of the speed at the measured ranges.
+    '''
     # model results:   
     x = cart.y[:,0]           # x-position
     y = cart.y[:,2]           # y-position
@@ -162,18 +1213,14 @@ class Ballistics:
     
     if len(cart.traj) > 1:
       # for quantitative analysis:
-      f = interp1d(x, y)
-      xint = array(cart.x)
-      yint = f(xint)
+      yint = cart.trajectory.drop(cart.x)
       # compute mean square error:
       yErr = sqrt(sum((yint - cart.traj)**2/len(yint)))
     else:
       yErr = 0
 
-    if cart.vel != None and len(cart.traj) > 1:
-      f = interp1d(x, v)
-      xint = array(cart.vel_x)
-      vint = f(xint)
+    if cart.vel is not None and len(cart.traj) > 1:
+      vint = cart.trajectory.velocity(cart.vel_x)
       # compute mean square error:
       vErr = sqrt(sum((vint - cart.vel)**2/len(vint)))
     else:
@@ -182,98 +1229,80 @@ class Ballistics:
     return x, y, v, yErr, vErr
 
 
-  def plot(self, cart, units='m'):
+  def plot(self, cart, units='m', filename=None, tol=1e-3, dpi=100):
     '''
     Purpose:
       plot the trajectory and velocity for the data and model given.
+    INPUTS:
+      cart     - integrated Cartridge.
+      units    - [m] = metric, [i] = yards, inches and feet/s.
+      filename - file to write the figure to without a display (default
+                 None, show it interactively).
+      tol      - downsampling tolerance of Figures.downsample.
+      dpi      - resolution when written to a raster file.
     '''
-    x, y, v, yErr, vErr = self.calc_error(cart)
-        
-    fig = plt.figure(figsize=(14,10))
-    ax = fig.add_subplot(211)
-    
-    if units != 'm':
-      x = func.m_to_yards(x)
-      y = func.m_to_inches(y)
-      v = func.m_to_ft(v)
-      traj_x = func.m_to_yards(traj_x)
-      traj   = func.m_to_inches(traj)
-      xunit = 'yards'
-      yunit = 'inches'
-      vunit = 'feet/s'
+    if filename is None:
+      import matplotlib.pyplot as plt
+      fig  = plt.figure(figsize=(14,10))
+      tmpl = FigureTemplate(self.intMethod, units, tol=tol, figure=fig)
     else:
-      xunit = 'm'
-      yunit = 'm'
-      vunit = 'm/s'
+      tmpl = FigureTemplate(self.intMethod, units, tol=tol)
+    tmpl.draw(cart, *self.calc_error(cart))
 
-    if len(cart.traj) > 1:
-      plt.plot(cart.traj_x, 
-               cart.traj, 'r.', label='Data')
-    plt.plot(x, y, label=self.intMethod, lw=2)
-    plt.text(min(x) + 10, min(y) + (max(y) - min(y))/10.0, 
-             'Mean-Squared Err: %f m' % yErr)
-    plt.text(min(x) + 10, min(y) + (max(y) - min(y))/100.0, 
-             'Muzzle Velocity: %.0f m/s' % cart.mv)
-    leg = plt.legend(loc='lower left')
-    leg.get_frame().set_alpha(0.5)
-    plt.xlabel('Distance (%s)' % xunit)
-    plt.ylabel('Drop (%s)' % yunit)
-    plt.title('Trajectory for ' + cart.name)
-    plt.grid()
-    
-    ax = fig.add_subplot(212)
-    
-    if cart.vel != None:
-      plt.plot(cart.vel_x, 
-               cart.vel, 'r.', label='Data')
-      plt.text(min(x)+10, min(v)+10 , 'Mean-Squared Err: %f m/s' % (vErr))
-    
-    plt.plot(x, v, label=self.intMethod, lw=2)
-    plt.xlabel('Distance (%s)' % xunit)
-    plt.ylabel('Velocity (%s)' % vunit)
-    plt.title('Velocity for ' + cart.name)
-    plt.grid()
-    
-    plt.show()
+    if filename is None:
+      plt.show()
+    else:
+      tmpl.save(filename, dpi)
 
 
-  def plot_all(self, units='m'):
+  def save_plots(self, directory, units='m', fmt='png', dpi=100,
+                 tol=1e-3):
+    '''
+    PURPOSE:
+      Write the figure of plot for every cartridge to directory without
+      a display, drawing each in the same reused figure.
+    OUTPUTS:
+      list of the files written, one per cartridge.
+    '''
+    with self.instrument.phase('save_plots'):
+      return render(self, directory, units=units, fmt=fmt, dpi=dpi,
+                    tol=tol)
+
+
+  def plot_all(self, units='m', filename=None, tol=1e-3, dpi=100):
     '''
     Purpose:
       plot the trajectory and velocity for the data and model given.
+    INPUTS:
+      units, filename, tol, dpi - as in plot.
     '''
-    fig = plt.figure(figsize=(12,6))
+    if filename is None:
+      import matplotlib.pyplot as plt
+      fig = plt.figure(figsize=(12,6))
+    else:
+      fig = new_figure((12,6))
     ax1 = fig.add_subplot(211)
     ax2 = fig.add_subplot(212)
+    (fx, fy, fv), (xunit, yunit, vunit) = units_of(units)
     
     for i in range(self.n):
-      x, y, v, yErr, vErr = self.calc_error(self.cart[i])
-    
-      if units != 'm':
-        x = func.m_to_yards(x)
-        y = func.m_to_inches(y)
-        v = func.m_to_ft(v)
-        traj_x = func.m_to_yards(self.cart[i].x)
-        traj   = func.m_to_inches(self.cart[i].traj)
-        xunit = 'yards'
-        yunit = 'inches'
-        vunit = 'feet/s'
-      else:
-        xunit = 'm'
-        yunit = 'm'
-        vunit = 'm/s'
+      cart = self.cart[i]
+      x, y, v, yErr, vErr = self.calc_error(cart)
+      x, y, v = fx(x), fy(y), fv(v)
+      iy = downsample(x, y, tol)
+      iv = downsample(x, v, tol)
       
-      if len(self.cart[i].traj) > 1:
-        ax1.plot(traj_x, traj,
-                 'r.', label='%s Data' % self.cart[i].name)
-      ax1.plot(x, y, lw=2, 
-               label=self.cart[i].name)
+      if len(cart.traj) > 1:
+        ax1.plot(fx(cart.x), fy(cart.traj),
+                 'r.', label='%s Data' % cart.name)
+      ax1.plot(x[iy], y[iy], lw=2, 
+               label=cart.name)
     
-      if self.cart[i].vel != None:
-        ax2.plot(self.cart[i].vel_x, self.cart[i].vel,
-                 'r.', label='%s Data' % self.cart[i].name)
-      ax2.plot(x, v, lw=2, 
-               label=self.cart[i].name)
+      if cart.vel is not None:
+        ax2.plot(fx(cart.vel_x), fv(cart.vel),
+                 'r.', label='%s Data' % cart.name)
+      ax2.plot(x[iv], v[iv], lw=2, 
+               label=cart.name)
     
     leg = ax1.legend(loc='lower left')
     leg.get_frame().set_alpha(0.5)
@@ -286,7 +1315,10 @@ class Ballistics:
     ax2.set_ylabel('Velocity (%s)' % vunit)
     ax2.grid()
     
-    plt.show()
+    if filename is None:
+      plt.show()
+    else:
+      fig.savefig(filename, dpi=dpi)
 
 
   def test_model_plot(self, G):
@@ -295,6 +1327,8 @@ class Ballistics:
       Plot random numbers on the plot of model G to test accurate
       interpolation.
     '''
+    import matplotlib.pyplot as plt
+    import random
     rand = []
     for i in range(200):
       num = random.uniform(G[0,0], G[-1,0])
@@ -334,3 +1368,106 @@ class Ballistics:
 
 
 
+def _hermite(a, b, w, h):
+  '''
+  PURPOSE:
+    States a fraction w of a step h from a to b, the positions x and y
+    by cubic Hermite interpolation with their rates and the velocities
+    linearly.  The rates are the velocities scaled as the chord of x
+    over the step, as the G model advances positions in ft/s.
+  '''
+  c = (b[:,0] - a[:,0]) / (h*(a[:,1] + b[:,1])/2.0)
+  y = a + w[:,newaxis]*(b - a)
+  for p, v in ((0, 1), (2, 3)):
+    y[:,p] = (1 - w)**2*(1 + 2*w)*a[:,p] + w**2*(3 - 2*w)*b[:,p] + \
+             c*h*w*(1 - w)*((1 - w)*a[:,v] - w*b[:,v])
+  return y
+
+
+def _crossing(a, b, r, h):
+  '''
+  PURPOSE:
+    Fractions of steps h from a to b at which the Hermite x reaches r.
+  '''
+  w = (r - a[:,0]) / (b[:,0] - a[:,0])
+  for i in range(2):
+    w = w - (_hermite(a, b, w, h)[:,0] - r) / (b[:,0] - a[:,0])
+  return w
+
+
+def _zero_worker(spec, cart, rng, tol, zero, maxiter, path, counted):
+  '''
+  PURPOSE:
+    Zero one cartridge in a worker process of Ballistics.hit_target.
+  OUTPUTS:
+    diag   - find_theta diagnostics, or those of _failed.
+    names  - names of the events found.
+    shared - the trajectory and event arrays placed by _share.
+    counts - instrument counts of the work, when counted is True.
+  '''
+  sink  = DictSink()
+  inst  = Instruments(sink) if counted else None
+  theta = cart.theta
+  try:
+    cache = None if path is None else TrajectoryCache(path=path)
+    ball  = Ballistics(array([cart]), cache=cache, instrument=inst, **spec)
+    diag  = ball.find_theta(cart, rng, tol, zero, maxiter)
+    ball._extend(cart)
+    hit   = ball._pack(cart)
+    names = hit.pop('ev_name')
+    return diag, names, _share(hit), sink.metrics['counts']
+  except ValueError as e:
+    return _failed(theta, e), None, None, sink.metrics['counts']
+
+
+def _failed(theta, e):
+  '''
+  PURPOSE:
+    The hit_target diagnostics of a cartridge started at theta whose
+    zeroing raised e.
+  '''
+  return {'theta'      : theta,
+          'residual'   : nan,
+          'iterations' : getattr(e, 'iterations', 0),
+          'converged'  : False,
+          'error'      : e}
+
+
+def _share(arrays):
+  '''
+  PURPOSE:
+    Place a dict of float arrays in one shared memory block, so only its
+    name and layout are pickled back to the parent process.  Without
+    multiprocessing.shared_memory the arrays are returned as they are.
+  '''
+  if shared_memory is None:
+    return arrays
+  arrays = dict((k, ascontiguousarray(v, dtype=float))
+                for k, v in arrays.items())
+  size   = sum([v.nbytes for v in arrays.values()])
+  block  = shared_memory.SharedMemory(create=True, size=int(maximum(size, 1)))
+  layout = []
+  offset = 0
+  for k, v in arrays.items():
+    ndarray(v.shape, float, block.buf, offset)[...] = v
+    layout.append((k, v.shape, offset))
+    offset += v.nbytes
+  block.close()
+  return block.name, layout
+
+
+def _unshare(shared):
+  '''
+  PURPOSE:
+    Copy the arrays placed by _share out of shared memory and free it.
+  '''
+  if shared_memory is None:
+    return shared
+  name, layout = shared
+  block = shared_memory.SharedMemory(name=name)
+  try:
+    return dict((k, ndarray(shape, float, block.buf, offset).copy())
+                for k, shape, offset in layout)
+  finally:
+    block.close()
+    block.unlink()
@@ -15,11 +15,19 @@
 from numpy import *
 from functions import *
 from model import *
+from DragTable import compile_table
 
-class Cartridge:
+class Cartridge(object):
     """
-    A data object representing a cartridge.
+    A data object representing a cartridge.  Its fields are slots, so
+    that catalogues of many loads stay small; CartridgeTable returns
+    Cartridges whose arrays are views of its columns.
     """
+    __slots__ = ('name', 'mass', 'cal', 'mv', 'bc', 'A', 'ff', 'y',
+                 'theta', 'y0', 'model', 'drag', 'traj', 'x', 'vel',
+                 'vel_x', 'l_traj', 'l_x', 't', 'trajectory', 'events',
+                 'stats')
+
     def __init__(self, name, mass, caliber, mv, bc, theta=0.0, traj=None, 
                  x=None, units='m', velocity=None, vel_x=None, model=None,
                  long_traj=None, l_x=None):
@@ -52,6 +60,7 @@ class Cartridge:
           A          -- cross-sectional area - m^2
           ff         -- ?
           y          -- trajectory info list [x, vx, y, vy]
+          drag       -- shared compiled DragTable for model
         """
         self.name       = name
         self.mass       = grains_to_g(mass)
@@ -63,13 +72,14 @@ class Cartridge:
         self.y          = []
         self.theta      = theta
         self.y0         = []
-        if model == None:
+        if model is None:
           self.model    = G1
         else:
           self.model    = model
+        self.drag       = compile_table(self.model)
         
         # if traject ry information is provided :
-        if traj != None:
+        if traj is not None:
           if type(traj) == float or type(traj) == int:
             self.traj  = array([traj])
             self.x     = array([0.0])
@@ -80,12 +90,8 @@ class Cartridge:
           self.traj  = zeros(1)
           self.x     = zeros(1)
         
-        # load initial values :
-        vx, vy = vel_comp(self.mv, self.theta)
-        self.y0 = [0.0, vx, self.traj[0], vy]
-
         # if velocity information is provided :
-        if velocity != None:
+        if velocity is not None:
           self.vel   = array(velocity)
           self.vel_x = array(vel_x)
         else:
@@ -93,7 +99,7 @@ class Cartridge:
           self.vel_x = None
         
         # if long-range trajectory info is provided :
-        if long_traj != None:
+        if long_traj is not None:
           self.l_traj = array(long_traj)
           self.l_x    = array(l_x)
         else:
@@ -103,11 +109,15 @@ class Cartridge:
         # convert to metric if needed :
         if units == 'i':
           self.mv     = ft_to_m(self.mv)
-          self.vel    = ft_to_m(self.vel)
-          self.vel_x  = yards_to_m(self.vel_x)
           self.traj   = inches_to_m(self.traj)
           self.x      = yards_to_m(self.x)
-          self.l_traj = inches_to_m(self.l_traj)
-          self.l_x    = yards_to_m(self.l_x)
-
+          if self.vel is not None:
+            self.vel    = ft_to_m(self.vel)
+            self.vel_x  = yards_to_m(self.vel_x)
+          if self.l_traj is not None:
+            self.l_traj = inches_to_m(self.l_traj)
+            self.l_x    = yards_to_m(self.l_x)
 
+        # load initial values :
+        vx, vy = vel_comp(self.mv, self.theta)
+        self.y0 = [0.0, vx, self.traj[0], vy]
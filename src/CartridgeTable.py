@@ -0,0 +1,372 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy     import array, asarray, zeros, ones, empty, cumsum, \
+                      concatenate, repeat, column_stack, where, pi, integer
+from Cartridge import Cartridge
+from DragTable import compile_table
+import functions as func
+import model
+import json
+import csv
+
+_str = (str, type(u''))
+
+# drag models a table refers to by index, unless given its own :
+MODELS = ('G1', 'G2', 'G5', 'G6', 'G7', 'G8')
+
+# measured data blocks as (values, positions, values in imperial units
+# to metric, positions in imperial units to metric) :
+BLOCKS = {'traj'   : ('traj',   'x',     func.inches_to_m, func.yards_to_m),
+          'vel'    : ('vel',    'vel_x', func.ft_to_m,     func.yards_to_m),
+          'l_traj' : ('l_traj', 'l_x',   func.inches_to_m, func.yards_to_m)}
+
+# record keys of each block's values and positions, as Cartridge takes
+# them :
+_KEYS = {'traj' : ('traj', 'x'), 'vel' : ('velocity', 'vel_x'),
+         'l_traj' : ('long_traj', 'l_x')}
+
+
+def _numbers(v):
+  '''
+  PURPOSE:
+    A measured data field as a float array, or None when missing.
+    Strings, as read from CSV, hold numbers separated by spaces.
+  '''
+  if v is None:
+    return None
+  if isinstance(v, _str):
+    v = v.split()
+    if not v:
+      return None
+  return asarray(v, dtype=float).ravel()
+
+
+class Block(object):
+  """
+  Ragged measured data of the rows of a CartridgeTable: every row's
+  values and positions concatenated, and the offsets start, stop of
+  each row into them.  Views of a table share data and pos.
+  """
+  def __init__(self, data, pos, start, stop):
+    self.data  = data
+    self.pos   = pos
+    self.start = start
+    self.stop  = stop
+
+  def take(self, rows):
+    '''
+    PURPOSE:
+      The block of the given rows, sharing this block's data.
+    '''
+    return Block(self.data, self.pos, self.start[rows], self.stop[rows])
+
+  def row(self, i):
+    '''
+    PURPOSE:
+      Views of the values and positions of row i, or None, None when it
+      has none.
+    '''
+    a, b = self.start[i], self.stop[i]
+    if a == b:
+      return None, None
+    return self.data[a:b], self.pos[a:b]
+
+  def first(self):
+    '''
+    PURPOSE:
+      The first value of every row.
+    '''
+    return self.data[self.start]
+
+
+class CartridgeTable(object):
+  """
+  Column-oriented catalogue of cartridges.  The scalar fields of every
+  load are NumPy columns, and the measured data are ragged Blocks, so
+  that a catalogue of thousands of loads is a handful of arrays.
+  Indexing by row number or name returns a Cartridge whose arrays are
+  views of the table; slices and index arrays return tables sharing
+  its measured data.  A table may be passed as the cartridges of
+  Ballistics.batch_at_ranges, whose lanes are then its rows.
+  """
+  def __init__(self, records=(), models=None):
+    """
+    INPUTS:
+      records -- sequence of dicts with the keys of the Cartridge
+                 constructor: name, mass, caliber, mv, bc and optionally
+                 theta, units, traj, x, velocity, vel_x, long_traj, l_x
+                 and model, the name of a drag model in models or a
+                 model table.
+      models  -- names of the drag models of model.py (default MODELS).
+    OUTPUTS:
+      name        -- (N,) object array of names.
+      mass        -- (N,) bullet masses - g
+      cal         -- (N,) calibers - inches
+      mv          -- (N,) muzzle velocities - m/s
+      bc          -- (N,) ballistics coefficients
+      A           -- (N,) cross-sectional areas - m^2
+      theta       -- (N,) launch angles - radians
+      drag        -- (N,) drag model IDs, indices of models
+      models      -- list of the drag model tables
+      model_names -- list of their names
+      traj, vel, l_traj -- Blocks of the measured drops (m) at x (m),
+                           speeds (m/s) at vel_x (m) and long range
+                           drops at l_x.
+      index       -- dict of name to row.
+    """
+    names            = list(MODELS if models is None else models)
+    self.models      = [getattr(model, n) for n in names]
+    self.model_names = names
+
+    records = list(records)
+    n       = len(records)
+    get     = lambda k, d=None: [r.get(k, d) for r in records]
+    self.name  = empty(n, dtype=object)
+    self.name[:] = get('name')
+    self.mass  = func.grains_to_g(array(get('mass'), dtype=float))
+    self.cal   = array(get('caliber'), dtype=float)
+    self.mv    = array(get('mv'), dtype=float)
+    self.bc    = array(get('bc'), dtype=float)
+    self.theta = array(get('theta', 0.0), dtype=float)
+    self.drag  = array([self._model_id(m) for m in get('model')],
+                       dtype=int)
+    imperial   = array([u == 'i' for u in get('units', 'm')], dtype=bool)
+    self.mv    = where(imperial, func.ft_to_m(self.mv), self.mv)
+    self.A     = pi * func.inches_to_m(self.cal/2.0)**2
+
+    for b, (vk, pk) in _KEYS.items():
+      vals = [_numbers(v) for v in get(vk)]
+      pos  = [_numbers(p) for p in get(pk)]
+      if b == 'traj':
+        # as Cartridge, a single height is at the muzzle and no data is
+        # a zero height there :
+        for i, v in enumerate(vals):
+          if v is None:
+            vals[i], pos[i] = zeros(1), zeros(1)
+          elif len(v) == 1 and pos[i] is None:
+            pos[i] = zeros(1)
+      setattr(self, b, self._block(b, vals, pos, imperial))
+    self.index = self._build_index()
+
+  def _model_id(self, m):
+    '''
+    PURPOSE:
+      The index in models of the drag model m, a name or a table, adding
+      tables not yet in the catalogue.
+    '''
+    if m is None:
+      m = 'G1'
+    if isinstance(m, _str):
+      if m not in self.model_names:
+        self.models.append(getattr(model, m))
+        self.model_names.append(m)
+      return self.model_names.index(m)
+    for i, G in enumerate(self.models):
+      if G is m:
+        return i
+    self.models.append(m)
+    self.model_names.append('model%d' % len(self.models))
+    return len(self.models) - 1
+
+  def _block(self, b, vals, pos, imperial):
+    '''
+    PURPOSE:
+      Concatenate the ragged values and positions of block b, converting
+      the rows in imperial units to metric.
+    '''
+    for v, p in zip(vals, pos):
+      if v is not None and (p is None or len(p) != len(v)):
+        raise ValueError('%s values and positions differ in length' % b)
+    size  = array([0 if v is None else len(v) for v in vals], dtype=int)
+    stop  = cumsum(size)
+    start = stop - size
+    data  = concatenate([v for v in vals if v is not None] + [zeros(0)])
+    px    = concatenate([p for p, v in zip(pos, vals) if v is not None]
+                        + [zeros(0)])
+    conv  = repeat(imperial, size)
+    fv, fp = BLOCKS[b][2], BLOCKS[b][3]
+    data  = where(conv, fv(data), data)
+    px    = where(conv, fp(px), px)
+    return Block(data, px, start, stop)
+
+  def __len__(self):
+    return len(self.mv)
+
+  def _build_index(self):
+    '''
+    PURPOSE:
+      dict of name to row; the first row of a repeated name wins.
+    '''
+    index = {}
+    for i, name in enumerate(self.name):
+      index.setdefault(name, i)
+    return index
+
+  def row(self, name):
+    '''
+    PURPOSE:
+      The row of the cartridge named name.
+    '''
+    try:
+      return self.index[name]
+    except KeyError:
+      raise KeyError('no cartridge named %r' % name)
+
+  def __getitem__(self, key):
+    '''
+    PURPOSE:
+      A Cartridge view for a row number or name, or a table of the rows
+      of a slice, index array or boolean mask.
+    '''
+    if isinstance(key, _str):
+      return self.cartridge(self.row(key))
+    if isinstance(key, (int, integer)):
+      return self.cartridge(key)
+    return self.take(key)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self.cartridge(i)
+
+  def take(self, rows):
+    '''
+    PURPOSE:
+      A table of the given rows.  Its columns are views for slices and
+      copies for index arrays; its measured data are always shared.
+    '''
+    if not isinstance(rows, slice):
+      rows = asarray(rows)
+    t = CartridgeTable.__new__(CartridgeTable)
+    t.models      = self.models
+    t.model_names = self.model_names
+    for c in ('name', 'mass', 'cal', 'mv', 'bc', 'A', 'theta', 'drag'):
+      setattr(t, c, getattr(self, c)[rows])
+    for b in BLOCKS:
+      setattr(t, b, getattr(self, b).take(rows))
+    t.index = t._build_index()
+    return t
+
+  def cartridge(self, i):
+    '''
+    PURPOSE:
+      A Cartridge of row i, its measured data views of the table.
+      Changes to its fields, e.g. by zeroing, are not written back.
+    '''
+    if i < 0:
+      i += len(self)
+    c = Cartridge.__new__(Cartridge)
+    c.name   = self.name[i]
+    c.mass   = float(self.mass[i])
+    c.cal    = float(self.cal[i])
+    c.mv     = float(self.mv[i])
+    c.bc     = float(self.bc[i])
+    c.A      = float(self.A[i])
+    c.ff     = c.A / c.bc
+    c.theta  = float(self.theta[i])
+    c.model  = self.models[self.drag[i]]
+    c.drag   = compile_table(c.model)
+    c.y      = []
+    c.traj, c.x      = self.traj.row(i)
+    c.vel, c.vel_x   = self.vel.row(i)
+    c.l_traj, c.l_x  = self.l_traj.row(i)
+    vx, vy = func.vel_comp(c.mv, c.theta)
+    c.y0   = [0.0, vx, c.traj[0], vy]
+    return c
+
+  def cartridges(self):
+    '''
+    PURPOSE:
+      Object array of a Cartridge for every row, e.g. for Ballistics.
+    '''
+    out    = empty(len(self), dtype=object)
+    out[:] = list(self)
+    return out
+
+  def y0(self):
+    '''
+    PURPOSE:
+      (N, 4) launch states [x, vx, y, vy] of every row, for the batch
+      solvers.
+    '''
+    vx, vy = func.vel_comp(self.mv, self.theta)
+    return column_stack([zeros(len(self)), vx, self.traj.first(), vy])
+
+  def drag_tables(self, mach=1.0):
+    '''
+    PURPOSE:
+      The compiled DragTable of every row, compiling each distinct
+      model and Mach scaling once.
+    INPUTS:
+      mach - float or (N,) speed of sound ratios as in compile_table.
+    '''
+    mach   = ones(len(self)) * mach
+    tables = {}
+    out    = []
+    for d, m in zip(self.drag, mach):
+      key = (d, m)
+      if key not in tables:
+        tables[key] = compile_table(self.models[d], m)
+      out.append(tables[key])
+    return out
+
+
+def from_cartridges(carts):
+  '''
+  PURPOSE:
+    A CartridgeTable holding the fields and measured data of
+    Cartridges, all in metric units.
+  '''
+  records = []
+  for c in carts:
+    records.append({'name' : c.name, 'mass' : 1.0, 'caliber' : c.cal,
+                    'mv' : c.mv, 'bc' : c.bc, 'theta' : c.theta,
+                    'model' : c.model, 'traj' : c.traj, 'x' : c.x,
+                    'velocity' : c.vel, 'vel_x' : c.vel_x,
+                    'long_traj' : c.l_traj, 'l_x' : c.l_x})
+  t = CartridgeTable(records)
+  t.mass = array([c.mass for c in carts], dtype=float)
+  return t
+
+
+def load_json(path, models=None):
+  '''
+  PURPOSE:
+    Load a CartridgeTable from a JSON file holding a list of records,
+    or an object with the list under 'cartridges'.
+  '''
+  with open(path) as f:
+    doc = json.load(f)
+  if isinstance(doc, dict):
+    doc = doc['cartridges']
+  return CartridgeTable(doc, models)
+
+
+def load_csv(path, models=None):
+  '''
+  PURPOSE:
+    Load a CartridgeTable from a CSV file with a header row of record
+    keys.  Measured data fields hold numbers separated by spaces, and
+    empty fields are missing.
+  '''
+  records = []
+  with open(path) as f:
+    for r in csv.DictReader(f):
+      r = dict((k.strip(), v.strip()) for k, v in r.items()
+               if k is not None and v is not None and v.strip() != '')
+      for k in ('mass', 'caliber', 'mv', 'bc', 'theta'):
+        if k in r:
+          r[k] = float(r[k])
+      records.append(r)
+  return CartridgeTable(records, models)
@@ -0,0 +1,198 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy        import array, asarray, zeros, ones, sqrt, isnan, where, \
+                         nanpercentile, concatenate, column_stack, \
+                         maximum, nan
+from numpy.random import RandomState
+from Ballistics   import Ballistics
+from functions    import vel_comp
+
+QUANTITIES = ('drop', 'velocity', 'time')
+
+
+def _sample(cart, rho, sd, seed, m):
+  '''
+  PURPOSE:
+    Draw m shots of cart with normally distributed muzzle velocity,
+    ballistics coefficient, air density and launch angle.
+  INPUTS:
+    cart - Cartridge, its mv, bc and theta are the means.
+    rho  - mean air density in kg/m^3.
+    sd   - (sd_mv, sd_bc, sd_rho, sd_theta) standard deviations.
+    seed - seed of this chunk's RandomState.
+    m    - number of shots.
+  OUTPUTS:
+    y0  - (m, 4) initial states.
+    bc  - (m,) ballistics coefficients.
+    rho - (m,) air densities.
+  '''
+  rs    = RandomState(seed)
+  mv    = cart.mv    + sd[0]*rs.standard_normal(m)
+  bc    = cart.bc    + sd[1]*rs.standard_normal(m)
+  rho   = rho        + sd[2]*rs.standard_normal(m)
+  theta = cart.theta + sd[3]*rs.standard_normal(m)
+  vx, vy = vel_comp(mv, theta)
+  y0    = column_stack([zeros(m), vx, ones(m)*cart.traj[0], vy])
+  return y0, maximum(bc, 1e-6), maximum(rho, 0.0)
+
+
+def _chunk(ball, cart, ranges, sd, seed, m, target, keep):
+  '''
+  PURPOSE:
+    Integrate one chunk of the ensemble as a single batch and reduce it
+    to its count, mean and sum of squared deviations at each range.
+  INPUTS:
+    ball - Ballistics object, or the dict of its constructor arguments
+           when called in a worker process.
+    keep - also return the per-shot values.
+  OUTPUTS:
+    dict of the chunk's partial statistics and, if keep, its (m, k, 3)
+    values of drop, velocity and time at the ranges.
+  '''
+  if isinstance(ball, dict):
+    ball = Ballistics(array([cart]), **ball)
+  y0, bc, rho = _sample(cart, ball.rho, sd, seed, m)
+  y, t = ball.batch_at_ranges(y0, cart, ranges, bc, rho)
+  vals = array([y[:,:,2], sqrt(y[:,:,1]**2 + y[:,:,3]**2), t])
+  vals = vals.transpose(1, 2, 0)
+
+  ok   = ~isnan(vals)
+  n    = ok.sum(axis=0)
+  mean = where(n > 0, where(ok, vals, 0.0).sum(axis=0) / maximum(n, 1), 0.0)
+  M2   = where(ok, (vals - mean)**2, 0.0).sum(axis=0)
+  hits = zeros(len(ranges), dtype=int)
+  if target is not None:
+    hits = (abs(where(ok[:,:,0], vals[:,:,0], nan)) <= target).sum(axis=0)
+  part = {'n' : n, 'mean' : mean, 'M2' : M2, 'hits' : hits}
+  if keep:
+    part['values'] = vals
+  return part
+
+
+def _merge(a, b):
+  '''
+  PURPOSE:
+    Combine the partial statistics of two chunks (Chan et al.).
+  '''
+  n     = a['n'] + b['n']
+  nn    = maximum(n, 1)
+  delta = b['mean'] - a['mean']
+  return {'n'    : n,
+          'mean' : a['mean'] + delta * b['n'] / nn,
+          'M2'   : a['M2'] + b['M2'] + delta**2 * a['n'] * b['n'] / nn,
+          'hits' : a['hits'] + b['hits']}
+
+
+class Dispersion(object):
+  """
+  Monte Carlo dispersion of a zeroed cartridge.  Lot and atmosphere
+  variation are sampled with a seeded generator and every sample is
+  integrated together as one batch, keeping only its state at the
+  requested ranges.
+  """
+  def __init__(self, ball, cart, ranges, sd_mv=0.0, sd_bc=0.0,
+               sd_rho=0.0, sd_theta=0.0, seed=0, percentiles=(5, 50, 95),
+               target=None):
+    """
+    INPUTS:
+      ball        -- Ballistics object setting the model and time steps.
+      cart        -- Cartridge, usually zeroed by Ballistics.hit_target;
+                     its mv, bc and theta are the sample means.
+      ranges      -- increasing ranges in meters to report.
+      sd_mv       -- standard deviation of the muzzle velocity - m/s
+      sd_bc       -- standard deviation of the ballistics coefficient
+      sd_rho      -- standard deviation of the air density - kg/m^3,
+                     about Ballistics.rho
+      sd_theta    -- standard deviation of the launch angle - radians
+      seed        -- seed of the random generator.
+      percentiles -- percentiles in [0, 100] to report (None for none,
+                     which avoids keeping the per-shot values).
+      target      -- radius in meters about the line of sight counted
+                     as a hit (default None, no hit probability).
+    """
+    self.ball        = ball
+    self.cart        = cart
+    self.ranges      = asarray(ranges, dtype=float)
+    self.sd          = (sd_mv, sd_bc, sd_rho, sd_theta)
+    self.seed        = seed
+    self.percentiles = percentiles
+    self.target      = target
+
+  def run(self, n, chunk=1000, processes=1):
+    '''
+    PURPOSE:
+      Sample and integrate n shots in chunks of at most chunk lanes,
+      merging each chunk's statistics as it finishes.
+    INPUTS:
+      n         - number of shots.
+      chunk     - number of shots integrated together.
+      processes - number of worker processes (default 1, in process).
+                  Each chunk has its own seed, so the results do not
+                  depend on the number of processes.
+    OUTPUTS:
+      dict with, for each range,
+        range           - ranges in meters.
+        n               - number of shots which reached the range.
+        mean, std       - dicts of the mean and standard deviation of
+                          drop (m), velocity (m/s) and time (s).
+        percentiles     - dict of percentile to a dict of the same.
+        hit_probability - fraction of all n shots within target.
+    '''
+    sizes = [chunk] * (n // chunk) + ([n % chunk] if n % chunk else [])
+    seeds = RandomState(self.seed).randint(2**31 - 1, size=len(sizes))
+    keep  = self.percentiles is not None
+
+    if processes > 1:
+      from multiprocessing import Pool
+      pool = Pool(processes)
+      jobs = [pool.apply_async(_chunk, (self.ball._spec(), self.cart,
+                                        self.ranges, self.sd, s, m,
+                                        self.target, keep))
+              for s, m in zip(seeds, sizes)]
+      pool.close()
+      parts = (j.get() for j in jobs)
+    else:
+      pool  = None
+      parts = (_chunk(self.ball, self.cart, self.ranges, self.sd, s, m,
+                      self.target, keep) for s, m in zip(seeds, sizes))
+
+    total  = None
+    values = []
+    try:
+      for part in parts:
+        if keep:
+          values.append(part['values'])
+        total = part if total is None else _merge(total, part)
+    finally:
+      if pool is not None:
+        pool.join()
+
+    cnt = total['n']
+    std = where(cnt > 1, sqrt(total['M2'] / maximum(cnt - 1, 1)), nan)
+    avg = where(cnt > 0, total['mean'], nan)
+    out = {'range' : self.ranges,
+           'n'     : cnt[:,0],
+           'mean'  : dict((q, avg[:,i]) for i, q in enumerate(QUANTITIES)),
+           'std'   : dict((q, std[:,i]) for i, q in enumerate(QUANTITIES)),
+           'percentiles' : {}}
+    if keep:
+      vals = concatenate(values)
+      for p in self.percentiles:
+        pc = nanpercentile(vals, p, axis=0)
+        out['percentiles'][p] = dict((q, pc[:,i])
+                                     for i, q in enumerate(QUANTITIES))
+    if self.target is not None:
+      out['hit_probability'] = total['hits'] / float(n)
+    return out
@@ -0,0 +1,200 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy      import asarray, diff, zeros, sign, clip, \
+                       searchsorted, arange, concatenate, unique, \
+                       column_stack, ones, loadtxt, pi, where, shape
+from bisect     import bisect_right
+from threading  import Lock
+from DragTable  import DragTable
+from Atmosphere import RHO_STD, A_STD
+import functions as func
+import os
+
+# A = K Cd for a bullet whose bc is its sectional density in lb/in^2,
+# with the air at RHO_STD in lb/ft^3 :
+K = func.kg_to_lbs(RHO_STD) / func.m3_to_ft3(1.0) * pi / (8 * 144.0)
+
+
+def pchip_slopes(x, y):
+  '''
+  PURPOSE:
+    Derivatives at the knots of the monotone piecewise cubic Hermite
+    interpolant of (x, y) (Fritsch and Carlson), which overshoots
+    neither the data nor its extrema.
+  '''
+  h = diff(x)
+  d = diff(y) / h
+  m = zeros(len(x))
+  if len(x) == 2:
+    m[:] = d[0]
+    return m
+
+  w1 = 2*h[1:] + h[:-1]
+  w2 = h[1:] + 2*h[:-1]
+  same = d[:-1]*d[1:] > 0
+  dl   = where(same, d[:-1], 1.0)      # the weighted harmonic mean is
+  dr   = where(same, d[1:],  1.0)      # only kept where both agree
+  m[1:-1] = where(same, (w1 + w2) / (w1/dl + w2/dr), 0.0)
+
+  # one-sided three-point ends, kept monotone :
+  for e, (h0, h1, d0, d1) in ((0,  (h[0],  h[1],  d[0],  d[1])),
+                              (-1, (h[-1], h[-2], d[-1], d[-2]))):
+    me = ((2*h0 + h1)*d0 - h0*d1) / (h0 + h1)
+    if sign(me) != sign(d0):
+      me = 0.0
+    elif sign(d0) != sign(d1) and abs(me) > 3*abs(d0):
+      me = 3*d0
+    m[e] = me
+  return m
+
+
+class DragCurve(DragTable):
+  """
+  A drag coefficient curve against Mach number, such as one measured by
+  Doppler radar, compiled to a monotone cubic (PCHIP) interpolant.  It
+  is a DragTable of A = K Cd and M = 2 tabulated every step ft/s, so it
+  serves as the model of a Cartridge with the G model, batched or not,
+  while lookup and lookup_array evaluate the cubic itself.  With the G
+  model the bc of a bullet with its own curve is its sectional density
+  in lb/in^2.  With the e model cd and cd_speed give the coefficient.
+  """
+  def __init__(self, mach, cd, name=None, step=5.0, a=A_STD):
+    """
+    INPUTS:
+      mach -- Mach numbers of the data, sorted here.
+      cd   -- drag coefficients at mach.
+      name -- name of the curve.
+      step -- spacing of the tabulation in ft/s.
+      a    -- speed of sound of the curve's Mach numbers - m/s
+    OUTPUTS:
+      mach, cd -- the data, by increasing Mach number.
+      slopes   -- dCd/dMach at the data.
+      a        -- speed of sound - m/s
+    """
+    mach, i = unique(asarray(mach, dtype=float), return_index=True)
+    if len(mach) < 2:
+      raise ValueError('a drag curve needs at least two Mach numbers')
+    self.mach_data = mach
+    self.cd_data   = asarray(cd, dtype=float)[i]
+    self.slopes    = pchip_slopes(self.mach_data, self.cd_data)
+    self.name      = name
+    self.step      = step
+    self.a         = a
+    self._a_fts    = func.m_to_ft(a)
+    self._x        = list(self.mach_data)
+
+    # tabulate from rest to past the data, on the data's own knots too :
+    top  = max(self.mach_data[-1]*self._a_fts, 4500.0)
+    v    = unique(concatenate([arange(0.0, top + step, step),
+                               self.mach_data*self._a_fts]))
+    G    = column_stack([v, K*self.cd(v / self._a_fts), 2*ones(len(v))])
+    DragTable.__init__(self, G[::-1])
+
+  def cd(self, mach):
+    '''
+    PURPOSE:
+      Drag coefficients at Mach numbers, held constant beyond the data.
+    INPUTS:
+      mach - float or array of Mach numbers.
+    '''
+    x, y, m = self.mach_data, self.cd_data, self.slopes
+    if isinstance(mach, float):
+      mach = min(max(mach, x[0]), x[-1])
+      i    = min(bisect_right(self._x, mach) - 1, len(x) - 2)
+    else:
+      mach = clip(mach, x[0], x[-1])
+      i    = clip(searchsorted(x, mach, 'right') - 1, 0, len(x) - 2)
+    h  = x[i+1] - x[i]
+    t  = (mach - x[i]) / h
+    t2 = t*t
+    t3 = t2*t
+    return (2*t3 - 3*t2 + 1)*y[i] + (t3 - 2*t2 + t)*h*m[i] + \
+           (-2*t3 + 3*t2)*y[i+1] + (t3 - t2)*h*m[i+1]
+
+  def mach(self, s):
+    '''
+    PURPOSE:
+      This curve in air whose speed of sound is 1/s times a, as
+      DragTable.mach.
+    '''
+    return DragCurve(self.mach_data, self.cd_data, self.name, self.step,
+                     self.a / s)
+
+  def cd_speed(self, v):
+    '''
+    PURPOSE:
+      Drag coefficients at speeds v in m/s.
+    '''
+    return self.cd(v / self.a)
+
+  def lookup(self, v):
+    '''
+    PURPOSE:
+      A and M at a speed v in ft/s from the cubic, as DragTable.lookup.
+    '''
+    return K*self.cd(float(v) / self._a_fts) / self.bc, 2.0
+
+  def lookup_array(self, v):
+    '''
+    PURPOSE:
+      A and M at speeds v in ft/s from the cubic, as
+      DragTable.lookup_array.
+    '''
+    return K*self.cd(asarray(v) / self._a_fts) / self.bc, 2*ones(shape(v))
+
+
+def read_curve(path):
+  '''
+  PURPOSE:
+    Read Mach numbers and drag coefficients from a text file of two
+    columns, separated by commas or white space, skipping '#' comments
+    and a header line of names.
+  '''
+  with open(path) as f:
+    lines = [l.split('#')[0].replace(',', ' ').strip() for l in f]
+  lines = [l for l in lines if l]
+  try:
+    float(lines[0].split()[0])
+  except ValueError:
+    lines = lines[1:]
+  data = loadtxt(lines, ndmin=2)
+  return data[:,0], data[:,1]
+
+
+_curves = {}
+_lock   = Lock()
+
+def load(path, step=5.0):
+  '''
+  PURPOSE:
+    The compiled DragCurve of a Cd against Mach file, read and compiled
+    on first use and shared afterwards until the file changes, when it
+    replaces the old curve so that only one is kept per file and step.
+  INPUTS:
+    path - file as read by read_curve.
+    step - tabulation spacing in ft/s, as in DragCurve.
+  '''
+  st    = os.stat(path)
+  key   = (os.path.abspath(path), step)
+  stamp = (st.st_mtime, st.st_size)
+  entry = _curves.get(key)
+  if entry is None or entry[0] != stamp:
+    with _lock:
+      entry = _curves.get(key)
+      if entry is None or entry[0] != stamp:
+        mach, cd = read_curve(path)
+        entry = (stamp, DragCurve(mach, cd, os.path.basename(path), step))
+        _curves[key] = entry
+  return entry[1]
@@ -0,0 +1,210 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy     import array, asarray, diff, append, clip, searchsorted, \
+                      concatenate, arange, repeat, cumsum, where
+from bisect    import bisect_right
+from threading import Lock
+from collections import OrderedDict
+
+
+class DragTable(object):
+  """
+  A G model table compiled for fast lookups of the A and M coefficients.
+  """
+  def __init__(self, G, bc=1.0):
+    """
+    INPUTS:
+      G  -- {G1, G2, G5, G6, G7, G8} - ballistics model table with rows
+            [velocity, A, M] in decreasing velocity.
+      bc -- ballistics coefficient folded into A (default 1.0, unfolded).
+    OUTPUTS:
+      v  -- breakpoint velocities in increasing order - ft/s
+      A  -- A coefficient at each breakpoint divided by bc
+      M  -- M exponent at each breakpoint
+      dA -- slope of A across each segment, dA[i] between v[i] and v[i+1]
+      dM -- slope of M across each segment
+      bc -- ballistics coefficient folded into A
+    """
+    G       = asarray(G, dtype=float)[::-1]
+    self.G  = G
+    self.bc = bc
+    self.v  = G[:,0].copy()
+    self.A  = G[:,1] / bc
+    self.M  = G[:,2].copy()
+    self.dA = diff(self.A) / diff(self.v)
+    self.dM = diff(self.M) / diff(self.v)
+    self.n  = len(self.v)
+
+    # python lists keep the scalar path free of numpy scalar overhead :
+    self._v  = list(self.v)
+    self._A  = list(self.A)
+    self._M  = list(self.M)
+    self._dA = list(self.dA)
+    self._dM = list(self.dM)
+
+  def fold(self, bc):
+    '''
+    PURPOSE:
+      Return a copy of this table with A already divided by bc.
+    '''
+    return DragTable(self.G[::-1], self.bc * bc)
+
+  def mach(self, s):
+    '''
+    PURPOSE:
+      Return a copy of this table indexed by Mach number in air whose
+      speed of sound is 1/s times the standard, so that the drag at
+      speed v is the standard drag at the speed v s of the same Mach
+      number.  Breakpoints move to v/s and A becomes A s^(M-2).
+    '''
+    G = self.G[::-1].copy()
+    G[:,0] = G[:,0] / s
+    G[:,1] = G[:,1] * s**(G[:,2] - 2)
+    return DragTable(G, self.bc)
+
+  def lookup(self, v):
+    '''
+    PURPOSE:
+      Interpolate A and M for a single velocity by bisection.
+    INPUTS:
+      v - float - current velocity of the bullet in ft/s.
+    OUTPUTS:
+      A - A coefficient (divided by bc for a folded table).
+      M - M exponent.
+    '''
+    vn = self._v
+    if v <= vn[0]:
+      return self._A[0], self._M[0]
+    if v >= vn[-1]:
+      return self._A[-1], self._M[-1]
+    i  = bisect_right(vn, v) - 1
+    dv = v - vn[i]
+    return self._A[i] + dv*self._dA[i], self._M[i] + dv*self._dM[i]
+
+  def lookup_array(self, v):
+    '''
+    PURPOSE:
+      Interpolate A and M for an array of velocities with searchsorted.
+    INPUTS:
+      v - array - current velocities of the bullets in ft/s.
+    OUTPUTS:
+      A - array of A coefficients.
+      M - array of M exponents.
+    '''
+    v  = clip(v, self.v[0], self.v[-1])
+    i  = clip(searchsorted(self.v, v, 'right') - 1, 0, self.n - 2)
+    dv = v - self.v[i]
+    return self.A[i] + dv*self.dA[i], self.M[i] + dv*self.dM[i]
+
+
+class DragTableStack(object):
+  """
+  Many folded drag tables concatenated so that a whole batch of lanes,
+  each with its own table and bc, is looked up with one searchsorted.
+  """
+  def __init__(self, tables, bc=None):
+    """
+    INPUTS:
+      tables -- sequence of DragTable objects, one per lane.
+      bc     -- ballistics coefficient of each lane, folded into the
+                lane's A (default None, tables are used as given).
+    """
+    lo   = array([t.v[0]  for t in tables])
+    hi   = array([t.v[-1] for t in tables])
+    size = array([t.n     for t in tables])
+    span = (hi - lo).max() + 1.0
+
+    self.lo     = lo
+    self.hi     = hi
+    self.off    = arange(len(tables)) * span - lo   # key offset per lane
+    self.start  = concatenate([[0], cumsum(size)[:-1]])
+    self.last   = self.start + size - 2             # last segment per lane
+    self.key    = concatenate([t.v for t in tables]) + \
+                  repeat(self.off, size)
+    self.v      = concatenate([t.v for t in tables])
+    self.A      = concatenate([t.A for t in tables])
+    self.M      = concatenate([t.M for t in tables])
+    self.dA     = concatenate([append(t.dA, 0.0) for t in tables])
+    self.dM     = concatenate([append(t.dM, 0.0) for t in tables])
+    if bc is not None:
+      scale     = repeat(asarray(bc, dtype=float), size)
+      self.A    = self.A  / scale
+      self.dA   = self.dA / scale
+
+  def lookup_array(self, v, lanes, slopes=False):
+    '''
+    PURPOSE:
+      Interpolate A and M for each lane's velocity.
+    INPUTS:
+      v      - array - current velocity of each lane in ft/s.
+      lanes  - int array - index of the table used by each entry of v.
+      slopes - also return dA/dv and dM/dv, zero beyond the table.
+    OUTPUTS:
+      A - array of A coefficients (divided by each lane's bc).
+      M - array of M exponents.
+      dA, dM - arrays of their slopes, when slopes is True.
+    '''
+    vc = clip(v, self.lo[lanes], self.hi[lanes])
+    i  = searchsorted(self.key, vc + self.off[lanes], 'right') - 1
+    i  = clip(i, self.start[lanes], self.last[lanes])
+    dv = vc - self.v[i]
+    A  = self.A[i] + dv*self.dA[i]
+    M  = self.M[i] + dv*self.dM[i]
+    if not slopes:
+      return A, M
+    inside = vc == v
+    return A, M, where(inside, self.dA[i], 0.0), where(inside, self.dM[i], 0.0)
+
+
+_registry   = OrderedDict()
+_lock       = Lock()
+MAX_TABLES  = 256
+
+def compile_table(G, mach=1.0):
+  '''
+  PURPOSE:
+    Return the shared compiled DragTable for model table G, building it
+    on first use.  Compiled tables are memoized so every cartridge and
+    thread using the same G and atmosphere shares one instance; the
+    MAX_TABLES most recently used are kept, so that sweeps over many
+    atmospheres do not grow the registry without bound.
+  INPUTS:
+    G    - {G1, G2, G5, G6, G7, G8} or an already compiled DragTable.
+    mach - speed of sound ratio of the air, as in DragTable.mach
+           (default 1.0, standard air).
+  OUTPUTS:
+    DragTable for G.
+  '''
+  if isinstance(G, DragTable) and mach == 1.0:
+    return G
+  # each entry holds a reference to its G, so that the id in its key
+  # cannot be reused while the entry lives :
+  key = (id(G), float(mach))
+  with _lock:
+    entry = _registry.pop(key, None)
+    if entry is not None:
+      _registry[key] = entry       # most recently used
+      return entry[1]
+  if mach != 1.0 and not isinstance(G, DragTable):
+    table = compile_table(G).mach(mach)
+  elif mach != 1.0:
+    table = G.mach(mach)
+  else:
+    table = DragTable(G)
+  with _lock:
+    entry = _registry.setdefault(key, (G, table))
+    while len(_registry) > MAX_TABLES:
+      _registry.popitem(last=False)
+  return entry[1]
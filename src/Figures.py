@@ -0,0 +1,228 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy import asarray, arange, zeros, nonzero, argmax, hypot, ptp
+import functions as func
+import os
+import re
+
+
+def units_of(units):
+  '''
+  PURPOSE:
+    Conversions from meters and m/s for plotting in units, [m] = metric,
+    [i] = yards, inches and feet/s.
+  OUTPUTS:
+    (fx, fy, fv) conversion functions and (xunit, yunit, vunit) names.
+  '''
+  if units != 'm':
+    return (func.m_to_yards, func.m_to_inches, func.m_to_ft), \
+           ('yards', 'inches', 'feet/s')
+  same = lambda a: a
+  return (same, same, same), ('m', 'm', 'm/s')
+
+
+def downsample(x, y, tol=1e-3):
+  '''
+  PURPOSE:
+    Indices of the points of the curve (x, y) needed to draw it within
+    tol of every point, by Ramer-Douglas-Peucker simplification.
+  INPUTS:
+    x, y - arrays of the curve.
+    tol  - largest distance of a dropped point from the drawn polyline,
+           as a fraction of the span of each axis; 1e-3 is under a pixel
+           on axes a thousand pixels across.
+  OUTPUTS:
+    increasing array of indices, always holding the first and last.
+  '''
+  x = asarray(x, dtype=float)
+  y = asarray(y, dtype=float)
+  n = len(x)
+  if n < 3 or tol <= 0:
+    return arange(n)
+
+  # measure in fractions of the axes, so the error is the same on both :
+  u = x / (ptp(x) or 1.0)
+  w = y / (ptp(y) or 1.0)
+  keep = zeros(n, dtype=bool)
+  keep[0] = keep[-1] = True
+  stack = [(0, n - 1)]
+  while stack:
+    i, j = stack.pop()
+    if j - i < 2:
+      continue
+    du, dw = u[j] - u[i], w[j] - w[i]
+    L = hypot(du, dw)
+    if L > 0:
+      d = abs(du*(w[i+1:j] - w[i]) - dw*(u[i+1:j] - u[i])) / L
+    else:
+      d = hypot(u[i+1:j] - u[i], w[i+1:j] - w[i])
+    k = argmax(d)
+    if d[k] > tol:
+      m = i + 1 + k
+      keep[m] = True
+      stack.append((i, m))
+      stack.append((m, j))
+  return nonzero(keep)[0]
+
+
+def new_figure(figsize):
+  '''
+  PURPOSE:
+    A figure drawn by the non-interactive Agg backend, independent of
+    pyplot, so that it needs no display and is freed with its last
+    reference.
+  '''
+  from matplotlib.figure import Figure
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
+  fig = Figure(figsize=figsize)
+  FigureCanvasAgg(fig)
+  return fig
+
+
+class FigureTemplate(object):
+  """
+  The trajectory and velocity figure of Ballistics.plot, with its axes,
+  lines and labels built once and their data replaced for each
+  cartridge, so that rendering a catalogue keeps a single figure alive.
+  """
+  def __init__(self, label, units='m', figsize=(14,10), tol=1e-3,
+               figure=None):
+    """
+    INPUTS:
+      label   -- legend label of the model curves, e.g. the intMethod.
+      units   -- units of the axes, [m] = metric, [i] = imperial.
+      figsize -- figure size in inches.
+      tol     -- downsampling tolerance of the model curves, as in
+                 downsample (0 to draw every point).
+      figure  -- figure to draw in (default a new Agg figure).
+    """
+    if figure is None:
+      figure = new_figure(figsize)
+    self.fig      = figure
+    self.tol      = tol
+    self.conv, un = units_of(units)
+
+    self.ax_y = figure.add_subplot(211)
+    self.ax_v = figure.add_subplot(212)
+    for ax, name, unit in ((self.ax_y, 'Drop', un[1]),
+                           (self.ax_v, 'Velocity', un[2])):
+      ax.set_xlabel('Distance (%s)' % un[0])
+      ax.set_ylabel('%s (%s)' % (name, unit))
+      ax.grid()
+    self.data_y,  = self.ax_y.plot([], [], 'r.', label='Data')
+    self.model_y, = self.ax_y.plot([], [], lw=2, label=label)
+    self.data_v,  = self.ax_v.plot([], [], 'r.', label='Data')
+    self.model_v, = self.ax_v.plot([], [], lw=2, label=label)
+    self.err_y    = self.ax_y.text(0.98, 0.1, '', ha='right',
+                                   transform=self.ax_y.transAxes)
+    self.mv       = self.ax_y.text(0.98, 0.02, '', ha='right',
+                                   transform=self.ax_y.transAxes)
+    self.err_v    = self.ax_v.text(0.98, 0.02, '', ha='right',
+                                   transform=self.ax_v.transAxes)
+
+  def draw(self, cart, x, y, v, yErr, vErr):
+    '''
+    PURPOSE:
+      Replace the figure's data with cart's, given the model's range,
+      height and speed and their errors as returned by
+      Ballistics.calc_error.
+    '''
+    fx, fy, fv = self.conv
+    x, y, v    = fx(x), fy(y), fv(v)
+    iy = downsample(x, y, self.tol)
+    iv = downsample(x, v, self.tol)
+    self.model_y.set_data(x[iy], y[iy])
+    self.model_v.set_data(x[iv], v[iv])
+
+    has_y = len(cart.traj) > 1
+    has_v = cart.vel is not None
+    if has_y:
+      self.data_y.set_data(fx(cart.x), fy(cart.traj))
+    else:
+      self.data_y.set_data([], [])
+    if has_v:
+      self.data_v.set_data(fx(cart.vel_x), fv(cart.vel))
+    else:
+      self.data_v.set_data([], [])
+    self.err_y.set_text('Mean-Squared Err: %f m' % yErr)
+    self.mv.set_text('Muzzle Velocity: %.0f m/s' % cart.mv)
+    self.err_v.set_text('Mean-Squared Err: %f m/s' % vErr if has_v else '')
+
+    for ax, data, model, has, title in \
+        ((self.ax_y, self.data_y, self.model_y, has_y, 'Trajectory'),
+         (self.ax_v, self.data_v, self.model_v, has_v, 'Velocity')):
+      ax.set_title('%s for %s' % (title, cart.name))
+      ax.relim()
+      ax.autoscale_view()
+      leg = ax.legend([data, model] if has else [model],
+                      [data.get_label(), model.get_label()] if has
+                      else [model.get_label()], loc='lower left')
+      leg.get_frame().set_alpha(0.5)
+
+  def save(self, filename, dpi=100):
+    '''
+    PURPOSE:
+      Write the figure to filename, its format from the extension.
+    '''
+    self.fig.savefig(filename, dpi=dpi)
+
+
+def filename(cart, directory, fmt='png', index=None):
+  '''
+  PURPOSE:
+    The file in directory for the figure of cart, named from cart.name
+    and, if given, suffixed with index to tell apart cartridges whose
+    names are alike.
+  '''
+  name = re.sub(r'[^A-Za-z0-9.+-]+', '_', cart.name).strip('_')
+  name = name or 'cartridge'
+  if index is not None:
+    name = '%s_%d' % (name, index)
+  return os.path.join(directory, '%s.%s' % (name, fmt))
+
+
+def render(ball, directory, carts=None, units='m', fmt='png', dpi=100,
+           figsize=(14,10), tol=1e-3):
+  '''
+  PURPOSE:
+    Write the trajectory and velocity figure of every cartridge to
+    directory without a display, reusing one FigureTemplate.
+  INPUTS:
+    ball      - Ballistics object whose cartridges are integrated, e.g.
+                by hit_target.
+    directory - output directory, created if needed.
+    carts     - cartridges to render (default ball.cart).
+    units, figsize, tol - as in FigureTemplate.
+    fmt       - file format, e.g. 'png', 'svg' or 'pdf'.
+    dpi       - resolution of raster formats.
+  OUTPUTS:
+    list of the files written, in the order of carts.  A cartridge
+    whose file name is already taken by an earlier one is suffixed
+    with its index in carts, so no figure overwrites another.
+  '''
+  if carts is None:
+    carts = ball.cart
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  tmpl  = FigureTemplate(ball.intMethod, units, figsize, tol)
+  files = []
+  for i, cart in enumerate(carts):
+    tmpl.draw(cart, *ball.calc_error(cart))
+    f = filename(cart, directory, fmt)
+    if f in files:
+      f = filename(cart, directory, fmt, i)
+    files.append(f)
+    tmpl.save(f, dpi)
+  return files
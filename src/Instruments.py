@@ -0,0 +1,206 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import time
+import logging
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class Instruments(object):
+  """
+  Counters and per-phase wall times of a Ballistics object.  Phases may
+  nest; when the outermost phase ends, a report of everything counted
+  and timed within it is sent to every sink and the counters restart.
+  """
+  enabled = True
+
+  def __init__(self, *sinks):
+    """
+    INPUTS:
+      sinks -- callables receiving each report, e.g. a DictSink, a
+               LoggingSink or any function of one dict.
+    OUTPUTS:
+      counts -- dict of counter name to count since the last report.
+      times  -- dict of phase name to wall time in seconds.
+      calls  -- dict of phase name to number of times it was entered.
+    """
+    self.sinks = list(sinks)
+    self.depth = 0
+    self.reset()
+
+  def reset(self):
+    '''
+    PURPOSE:
+      Zero every counter and timer.
+    '''
+    self.counts = {}
+    self.times  = {}
+    self.calls  = {}
+
+  def count(self, name, n=1):
+    '''
+    PURPOSE:
+      Add n to the counter name.
+    '''
+    self.counts[name] = self.counts.get(name, 0) + n
+
+  def counted(self, name, f):
+    '''
+    PURPOSE:
+      Wrap the function f so that every call adds one to counter name.
+    '''
+    def wrapper(*args):
+      self.counts[name] = self.counts.get(name, 0) + 1
+      return f(*args)
+    return wrapper
+
+  def phase(self, name):
+    '''
+    PURPOSE:
+      Context manager timing the phase name.
+    '''
+    return _Phase(self, name)
+
+  def report(self, phase=None):
+    '''
+    PURPOSE:
+      Snapshot of the counters and timers, labelled with the phase which
+      produced it.
+    '''
+    return {'phase'  : phase,
+            'counts' : dict(self.counts),
+            'times'  : dict(self.times),
+            'calls'  : dict(self.calls)}
+
+  def flush(self, phase=None):
+    '''
+    PURPOSE:
+      Send a report to every sink and restart the counters.
+    '''
+    r = self.report(phase)
+    for sink in self.sinks:
+      sink(r)
+    self.reset()
+    return r
+
+
+class _Phase(object):
+
+  def __init__(self, inst, name):
+    self.inst = inst
+    self.name = name
+
+  def __enter__(self):
+    self.inst.depth += 1
+    self.t0 = clock()
+    return self
+
+  def __exit__(self, *exc):
+    inst = self.inst
+    dt   = clock() - self.t0
+    inst.times[self.name] = inst.times.get(self.name, 0.0) + dt
+    inst.calls[self.name] = inst.calls.get(self.name, 0) + 1
+    inst.depth -= 1
+    if inst.depth == 0:
+      inst.flush(self.name)
+    return False
+
+
+class NullInstruments(object):
+  """
+  Disabled instruments, the default of Ballistics.  Every method does
+  nothing, and callers skip per-step counting when enabled is False.
+  """
+  enabled = False
+  sinks   = ()
+
+  def reset(self):
+    pass
+
+  def count(self, name, n=1):
+    pass
+
+  def counted(self, name, f):
+    return f
+
+  def phase(self, name):
+    return _null_phase
+
+  def report(self, phase=None):
+    return {'phase' : phase, 'counts' : {}, 'times' : {}, 'calls' : {}}
+
+  def flush(self, phase=None):
+    return self.report(phase)
+
+
+class _NullPhase(object):
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+_null_phase = _NullPhase()
+NULL        = NullInstruments()
+
+
+class DictSink(object):
+  """
+  Sink accumulating every report into a metrics dict.
+  """
+  def __init__(self, metrics=None):
+    """
+    INPUTS:
+      metrics -- dict to accumulate into (default a new dict), with keys
+                 'counts', 'times' and 'calls' of summed values and
+                 'reports', the number of reports received.
+    """
+    if metrics is None:
+      metrics = {}
+    for k in ('counts', 'times', 'calls'):
+      metrics.setdefault(k, {})
+    metrics.setdefault('reports', 0)
+    self.metrics = metrics
+
+  def __call__(self, report):
+    m = self.metrics
+    for k in ('counts', 'times', 'calls'):
+      for name, value in report[k].items():
+        m[k][name] = m[k].get(name, 0) + value
+    m['reports'] += 1
+
+
+class LoggingSink(object):
+  """
+  Sink writing every report to a logger.
+  """
+  def __init__(self, logger=None, level=logging.INFO):
+    """
+    INPUTS:
+      logger -- logging.Logger (default the 'bullet_drag' logger).
+      level  -- logging level of the messages.
+    """
+    if logger is None:
+      logger = logging.getLogger('bullet_drag')
+    self.logger = logger
+    self.level  = level
+
+  def __call__(self, report):
+    times  = ' '.join('%s=%.6fs' % kv
+                      for kv in sorted(report['times'].items()))
+    counts = ' '.join('%s=%d' % kv
+                      for kv in sorted(report['counts'].items()))
+    self.logger.log(self.level, '%s: %s %s', report['phase'], times, counts)
@@ -0,0 +1,128 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy          import arange, array, column_stack, atleast_1d, sqrt, \
+                           isnan
+from numpy.lib      import format
+from io             import BytesIO
+import functions as func
+import zipfile
+import csv
+
+# metric to imperial factors of the range, drop, velocity and energy
+# columns, applied in one multiply :
+_to_imperial = array([func.m_to_yards(1.0), func.m_to_inches(1.0),
+                      func.m_to_ft(1.0), func.j_to_ftlbs(1.0)])
+
+COLUMNS = ['range_m', 'drop_m', 'velocity_m_s', 'energy_j',
+           'range_yd', 'drop_in', 'velocity_ft_s', 'energy_ft_lbs',
+           'time_s']
+
+class RangeCard(object):
+  """
+  Drop, velocity, energy and time-of-flight tables for many cartridges
+  and zero ranges, produced one cartridge at a time so that a whole
+  catalogue can be streamed to disk.
+  """
+  def __init__(self, ball, step=100.0, max_range=1000.0, units='i',
+               tol=1e-5):
+    """
+    INPUTS:
+      ball      -- Ballistics object used to zero and integrate.
+      step      -- range increment of the table rows.
+      max_range -- last range of the table.
+      units     -- units of step and max_range, [m] = meters,
+                   [i] = yards.
+      tol       -- zeroing tolerance in meters.
+    OUTPUTS:
+      ranges    -- table ranges in meters.
+    """
+    self.ball   = ball
+    self.tol    = tol
+    self.ranges = arange(0.0, max_range + step/2.0, step)
+    if units == 'i':
+      self.ranges = func.yards_to_m(self.ranges)
+
+  def table(self, cart, zero):
+    '''
+    PURPOSE:
+      Zero cart at the range zero (meters) and tabulate its trajectory.
+    OUTPUTS:
+      (n, 9) array with one row per range and the columns of COLUMNS,
+      raising ValueError if the trajectory does not reach every range.
+    '''
+    self.ball.find_theta(cart, zero, self.tol, 0.0)
+    vx, vy  = func.vel_comp(cart.mv, cart.theta)
+    cart.y0 = [0.0, vx, cart.traj[0], vy]
+    T = self.ball.model_integrate(cart, rng=self.ranges[-1])
+
+    y      = T.state(self.ranges)
+    v      = sqrt(y[:,1]**2 + y[:,3]**2)
+    e      = 0.5 * cart.mass/1000.0 * v**2
+    metric = column_stack([self.ranges, y[:,2], v, e])
+    table  = column_stack([metric, metric*_to_imperial,
+                           T.time(self.ranges)])
+    if isnan(table).any():
+      raise ValueError('%s does not reach %g m within tmax' %
+                       (cart.name, self.ranges[isnan(table).any(1)][0]))
+    return table
+
+  def generate(self, carts, zeros):
+    '''
+    PURPOSE:
+      Yield (cart, zero, table) for every cartridge and zero range in
+      meters, as each one finishes.
+    '''
+    for cart in carts:
+      for zero in atleast_1d(zeros):
+        yield cart, zero, self.table(cart, zero)
+
+  def write_csv(self, f, carts, zeros):
+    '''
+    PURPOSE:
+      Stream the range cards of carts at each zero range to the csv
+      file f (a path or an open file), one row per range.
+    '''
+    if isinstance(f, str):
+      with open(f, 'w') as fh:
+        return self.write_csv(fh, carts, zeros)
+    w = csv.writer(f)
+    w.writerow(['name', 'zero_m'] + COLUMNS)
+    for cart, zero, table in self.generate(carts, zeros):
+      for row in table:
+        w.writerow([cart.name, repr(float(zero))] +
+                   [repr(float(v)) for v in row])
+      f.flush()
+
+  def write_npz(self, path, carts, zeros):
+    '''
+    PURPOSE:
+      Stream the range cards to an npz archive at path, readable with
+      numpy.load, holding one (n, 9) array per cartridge and zero range
+      plus the 'names', 'zeros' and 'columns' index arrays.
+    '''
+    names = []
+    zs    = []
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+      def put(key, a):
+        buf = BytesIO()
+        format.write_array(buf, array(a))
+        zf.writestr(key + '.npy', buf.getvalue())
+      for i, (cart, zero, table) in enumerate(self.generate(carts, zeros)):
+        put('card_%d' % i, table)
+        names.append(cart.name)
+        zs.append(zero)
+      put('names',   array(names, dtype=str))
+      put('zeros',   array(zs, dtype=float))
+      put('columns', array(COLUMNS, dtype=str))
@@ -0,0 +1,532 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Local HTTP service of zeroing, trajectory and range card solves (Python
+3, standard library only).  Concurrent requests of a kind arriving
+within a short window are coalesced into one batched solve, identical
+requests in flight share one answer, and the solves run in an executor
+off the event loop :
+
+  python Service.py --port 8080
+
+  POST /zero       {"cartridge" : {...}, "range" : 300}
+  POST /trajectory {"cartridge" : {...}, "ranges" : [100, 200, 300]}
+  POST /rangecard  {"cartridge" : {...}, "zero" : 100, "ranges" : [...]}
+  GET  /metrics
+
+A cartridge is a record of the Cartridge constructor's keys, as in
+CartridgeTable, e.g. {"name" : "308", "mass" : 168, "caliber" : 0.308,
+"mv" : 800, "bc" : 0.45, "traj" : -0.04, "model" : "G7"}.
+'''
+from numpy              import array, asarray, concatenate, unique, \
+                               searchsorted, sqrt, isfinite, isnan
+from collections        import deque
+from concurrent.futures import ThreadPoolExecutor
+from Ballistics         import Ballistics
+from CartridgeTable     import CartridgeTable, MODELS
+from RangeCard          import COLUMNS, _to_imperial
+from Instruments        import clock
+import numpy
+import asyncio
+import argparse
+import json
+
+_REQUIRED = ('name', 'mass', 'caliber', 'mv', 'bc')
+_KEYS     = _REQUIRED + ('theta', 'units', 'traj', 'x', 'velocity', 'vel_x',
+                         'long_traj', 'l_x', 'model')
+
+REASONS   = {200 : 'OK', 400 : 'Bad Request', 404 : 'Not Found',
+             405 : 'Method Not Allowed', 500 : 'Internal Server Error'}
+
+
+def _list(a):
+  '''
+  PURPOSE:
+    An array as nested lists for JSON, with None in place of nan.
+  '''
+  a = asarray(a, dtype=float)
+  return numpy.where(isfinite(a), a, None).tolist()
+
+
+def _ranges(doc, key='ranges'):
+  r = array(doc[key], dtype=float).ravel()
+  if len(r) == 0 or (r <= 0).any() or (r[1:] <= r[:-1]).any():
+    raise ValueError('%s must be increasing positive ranges' % key)
+  return r.tolist()
+
+
+def parse(kind, doc):
+  '''
+  PURPOSE:
+    Check the JSON document of a request of kind 'zero', 'trajectory'
+    or 'rangecard' and return it normalized, with its defaults filled
+    in, so that equal requests compare equal.
+  OUTPUTS:
+    dict, raising ValueError on a bad request.
+  '''
+  if not isinstance(doc, dict) or not isinstance(doc.get('cartridge'), dict):
+    raise ValueError('the request needs a "cartridge" object')
+  cart    = dict(doc['cartridge'])
+  missing = [k for k in _REQUIRED if k not in cart]
+  if missing:
+    raise ValueError('the cartridge needs %s' % ', '.join(missing))
+  unknown = sorted(k for k in cart if k not in _KEYS)
+  if unknown:
+    raise ValueError('unknown cartridge keys %s' % ', '.join(unknown))
+  for k in _REQUIRED[1:]:
+    cart[k] = float(cart[k])
+    if not cart[k] > 0:
+      raise ValueError('the cartridge %s must be positive' % k)
+  if cart.get('model', 'G1') not in MODELS:
+    raise ValueError('unknown drag model %r, use one of %s' %
+                     (cart['model'], ', '.join(MODELS)))
+  if cart.get('units', 'm') not in ('m', 'i'):
+    raise ValueError('the cartridge units must be "m" or "i"')
+  try:
+    CartridgeTable([cart])
+  except Exception as e:
+    raise ValueError('bad cartridge: %s' % e)
+  req = {'cartridge' : cart}
+  if kind == 'zero':
+    req['range']   = float(doc['range'])
+  elif kind == 'trajectory':
+    req['ranges']  = _ranges(doc)
+    req['theta']   = float(doc.get('theta', cart.get('theta', 0.0)))
+  elif kind == 'rangecard':
+    req['range']   = float(doc['zero'])
+    req['ranges']  = _ranges(doc)
+  if kind != 'trajectory':
+    req['tol']     = float(doc.get('tol', 1e-5))
+    req['height']  = float(doc.get('height', 0.0))
+    req['maxiter'] = int(doc.get('maxiter', 20))
+  return req
+
+
+class Solver(object):
+  """
+  The batched solves of each kind of request, each taking a list of
+  parsed requests and returning a list of their results, or of the
+  exceptions of those which failed.  They run in the service's executor,
+  one batch at a time, sharing a Ballistics object.
+  """
+  def __init__(self, ball):
+    """
+    INPUTS:
+      ball -- Ballistics object whose settings every solve uses; its
+              cartridges are not used.
+    """
+    self.ball = ball
+
+  def table(self, reqs):
+    '''
+    PURPOSE:
+      The CartridgeTable of the requests' cartridges, one row each.
+    '''
+    return CartridgeTable([r['cartridge'] for r in reqs])
+
+  def _zero(self, table, reqs):
+    '''
+    PURPOSE:
+      Zero every row of table at its request's range with batch_zero,
+      one call per distinct tol and maxiter, setting its theta.
+    '''
+    out    = [None] * len(reqs)
+    groups = {}
+    for i, r in enumerate(reqs):
+      groups.setdefault((r['tol'], r['maxiter']), []).append(i)
+    for (tol, maxiter), rows in groups.items():
+      diag = self.ball.batch_zero(table.take(rows),
+                                  [reqs[i]['range'] for i in rows], tol,
+                                  [reqs[i]['height'] for i in rows],
+                                  maxiter)
+      for j, i in enumerate(rows):
+        if isnan(diag['theta'][j]):
+          out[i] = ValueError('%s does not reach %g m within tmax' %
+                              (table.name[i], reqs[i]['range']))
+          continue
+        table.theta[i] = diag['theta'][j]
+        out[i] = {'theta'      : float(diag['theta'][j]),
+                  'residual'   : float(diag['residual'][j]),
+                  'iterations' : int(diag['iterations'][j]),
+                  'converged'  : bool(diag['converged'][j])}
+    return out
+
+  def _states(self, table, reqs):
+    '''
+    PURPOSE:
+      Integrate every row of table from its theta as one batch, to the
+      union of the requests' ranges.
+    OUTPUTS:
+      per request, its (k, 4) states and (k,) times at its ranges.
+    '''
+    R    = unique(concatenate([r['ranges'] for r in reqs]))
+    y, t = self.ball.batch_at_ranges(table.y0(), table, R)
+    out  = []
+    for i, r in enumerate(reqs):
+      j = searchsorted(R, r['ranges'])
+      out.append((y[i, j], t[i, j]))
+    return out
+
+  def zero(self, reqs):
+    return self._zero(self.table(reqs), reqs)
+
+  def trajectory(self, reqs):
+    table = self.table(reqs)
+    table.theta[:] = [r['theta'] for r in reqs]
+    out   = []
+    for r, (y, t) in zip(reqs, self._states(table, reqs)):
+      out.append({'range'    : r['ranges'],
+                  'drop'     : _list(y[:,2]),
+                  'velocity' : _list(sqrt(y[:,1]**2 + y[:,3]**2)),
+                  'time'     : _list(t)})
+    return out
+
+  def rangecard(self, reqs):
+    '''
+    PURPOSE:
+      Zero each cartridge, then tabulate the rows of RangeCard.table for
+      every cartridge which zeroed, as one batch.
+    '''
+    table = self.table(reqs)
+    out   = self._zero(table, reqs)
+    ok    = [i for i, d in enumerate(out) if not isinstance(d, Exception)]
+    if not ok:
+      return out
+    sub   = [reqs[i] for i in ok]
+    for i, (y, t) in zip(ok, self._states(table.take(ok), sub)):
+      v      = sqrt(y[:,1]**2 + y[:,3]**2)
+      e      = 0.5 * table.mass[i]/1000.0 * v**2
+      metric = numpy.column_stack([reqs[i]['ranges'], y[:,2], v, e])
+      rows   = numpy.column_stack([metric, metric*_to_imperial, t])
+      out[i] = dict(out[i], columns=COLUMNS, rows=_list(rows))
+    return out
+
+
+class Metrics(object):
+  """
+  Counters, queue depths and request latencies of a Service.
+  """
+  def __init__(self, window=1024):
+    """
+    INPUTS:
+      window -- number of recent latencies kept per route for the
+                percentiles.
+    """
+    self.counts    = {}
+    self.queued    = 0       # parsed requests waiting for an answer
+    self.pending   = 0       # requests waiting for their batch to start
+    self.running   = 0       # batches in the executor
+    self.latencies = {}
+    self.window    = window
+
+  def count(self, name, n=1):
+    self.counts[name] = self.counts.get(name, 0) + n
+
+  def latency(self, route, dt):
+    '''
+    PURPOSE:
+      Record dt seconds taken to answer a request to route.
+    '''
+    if route not in self.latencies:
+      self.latencies[route] = deque(maxlen=self.window)
+    self.latencies[route].append(dt)
+
+  def snapshot(self):
+    '''
+    PURPOSE:
+      The metrics as a dict for JSON, with the count, mean, median, 95th
+      percentile and largest of each route's recent latencies.
+    '''
+    lat = {}
+    for route, d in self.latencies.items():
+      a = sorted(d)
+      lat[route] = {'count' : len(a),
+                    'mean'  : sum(a) / len(a),
+                    'p50'   : a[len(a) // 2],
+                    'p95'   : a[min(int(0.95*len(a)), len(a) - 1)],
+                    'max'   : a[-1]}
+    return {'counts'      : dict(self.counts),
+            'queue_depth' : self.queued,
+            'pending'     : self.pending,
+            'running'     : self.running,
+            'latency_s'   : lat}
+
+
+class Batcher(object):
+  """
+  Coalesces the requests of one kind submitted within window seconds of
+  the first, or until max_batch of them, into one call of solve in the
+  executor.
+  """
+  def __init__(self, name, solve, executor, metrics, window=0.005,
+               max_batch=256):
+    """
+    INPUTS:
+      name      -- kind of request, for the metrics.
+      solve     -- function of a list of requests returning the list of
+                   their results or exceptions.
+      executor  -- concurrent.futures executor the solves run in.
+      metrics   -- Metrics of the service.
+      window    -- longest wait in seconds for a batch to fill.
+      max_batch -- largest number of requests in a batch.
+    """
+    self.name      = name
+    self.solve     = solve
+    self.executor  = executor
+    self.metrics   = metrics
+    self.window    = window
+    self.max_batch = max_batch
+    self.batch     = []
+    self.timer     = None
+
+  def submit(self, req):
+    '''
+    PURPOSE:
+      Add req to the open batch.
+    OUTPUTS:
+      asyncio future of its result.
+    '''
+    loop = asyncio.get_event_loop()
+    fut  = loop.create_future()
+    self.batch.append((req, fut))
+    self.metrics.pending += 1
+    if len(self.batch) >= self.max_batch:
+      self.flush()
+    elif self.timer is None:
+      self.timer = loop.call_later(self.window, self.flush)
+    return fut
+
+  def flush(self):
+    '''
+    PURPOSE:
+      Start solving the open batch.
+    '''
+    if self.timer is not None:
+      self.timer.cancel()
+      self.timer = None
+    batch, self.batch = self.batch, []
+    if batch:
+      self.metrics.pending -= len(batch)
+      asyncio.ensure_future(self._run(batch))
+
+  async def _run(self, batch):
+    loop = asyncio.get_event_loop()
+    m    = self.metrics
+    m.count('batches')
+    m.count('%s_batched' % self.name, len(batch))
+    m.running += 1
+    try:
+      out = await loop.run_in_executor(self.executor, self.solve,
+                                       [req for req, fut in batch])
+    except Exception as e:
+      # solve each request alone, so that one bad request does not fail
+      # the others coalesced with it :
+      m.count('batch_failures')
+      out = [e]
+      if len(batch) > 1:
+        out = []
+        for req, fut in batch:
+          try:
+            out += await loop.run_in_executor(self.executor, self.solve,
+                                              [req])
+          except Exception as e:
+            out.append(e)
+    finally:
+      m.running -= 1
+    for (req, fut), res in zip(batch, out):
+      if fut.cancelled():
+        continue
+      if isinstance(res, Exception):
+        fut.set_exception(res)
+      else:
+        fut.set_result(res)
+
+
+class Service(object):
+  """
+  The asyncio HTTP/1.1 server of a Solver.  Each POST is parsed, then
+  answered by the in-flight future of an identical request if there is
+  one, and otherwise submitted to the Batcher of its kind.
+  """
+  def __init__(self, ball, window=0.005, max_batch=256, executor=None):
+    """
+    INPUTS:
+      ball      -- Ballistics object of the solves.
+      window    -- batching window in seconds.
+      max_batch -- largest batch of each kind.
+      executor  -- executor of the solves (default one worker thread,
+                   as they share ball).
+    """
+    if executor is None:
+      executor = ThreadPoolExecutor(1)
+    self.solver   = Solver(ball)
+    self.metrics  = Metrics()
+    self.executor = executor
+    self.inflight = {}
+    self.batchers = dict((kind, Batcher(kind, getattr(self.solver, kind),
+                                        executor, self.metrics, window,
+                                        max_batch))
+                         for kind in ('zero', 'trajectory', 'rangecard'))
+    self.server   = None
+
+  async def request(self, kind, doc):
+    '''
+    PURPOSE:
+      Answer one request of kind from its JSON document, sharing the
+      answer of an identical request in flight.
+    '''
+    req = parse(kind, doc)
+    key = (kind, json.dumps(req, sort_keys=True))
+    fut = self.inflight.get(key)
+    if fut is not None:
+      self.metrics.count('deduplicated')
+    else:
+      fut = self.batchers[kind].submit(req)
+      self.inflight[key] = fut
+      fut.add_done_callback(lambda f: self.inflight.pop(key, None))
+    self.metrics.queued += 1
+    try:
+      return await asyncio.shield(fut)
+    finally:
+      self.metrics.queued -= 1
+
+  async def dispatch(self, method, path, body):
+    '''
+    PURPOSE:
+      The status and JSON document answering an HTTP request.
+    '''
+    route = path.split('?')[0].strip('/')
+    if route == 'metrics':
+      if method != 'GET':
+        return 405, {'error' : 'use GET'}
+      return 200, self.metrics.snapshot()
+    if route not in self.batchers:
+      return 404, {'error' : 'no route /%s' % route}
+    if method != 'POST':
+      return 405, {'error' : 'use POST'}
+    try:
+      doc = json.loads(body.decode('utf-8') or 'null')
+      return 200, await self.request(route, doc)
+    except (ValueError, KeyError, TypeError) as e:
+      self.metrics.count('errors')
+      return 400, {'error' : str(e)}
+    except Exception as e:
+      self.metrics.count('errors')
+      return 500, {'error' : '%s: %s' % (type(e).__name__, e)}
+
+  async def _client(self, reader, writer):
+    '''
+    PURPOSE:
+      Serve the requests of one connection, kept alive unless the
+      client asks to close it.
+    '''
+    try:
+      while True:
+        line = await reader.readline()
+        if not line.strip():
+          break
+        t0 = clock()
+        method, path = line.decode('latin-1').split()[:2]
+        headers = {}
+        while True:
+          h = await reader.readline()
+          if not h.strip():
+            break
+          k, v = h.decode('latin-1').split(':', 1)
+          headers[k.strip().lower()] = v.strip()
+        body = await reader.readexactly(int(headers.get('content-length',
+                                                         0)))
+        self.metrics.count('requests')
+        status, doc = await self.dispatch(method, path, body)
+        data  = json.dumps(doc).encode('utf-8')
+        close = headers.get('connection', '').lower() == 'close'
+        writer.write(('HTTP/1.1 %d %s\r\n'
+                      'Content-Type: application/json\r\n'
+                      'Content-Length: %d\r\n'
+                      'Connection: %s\r\n\r\n'
+                      % (status, REASONS[status], len(data),
+                         'close' if close else 'keep-alive'))
+                     .encode('latin-1') + data)
+        await writer.drain()
+        route = path.split('?')[0].strip('/')
+        known = route == 'metrics' or route in self.batchers
+        self.metrics.latency('/' + route if known else 'other',
+                             clock() - t0)
+        if close:
+          break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+      pass
+    finally:
+      writer.close()
+
+  async def start(self, host='127.0.0.1', port=8080, backlog=1024):
+    '''
+    PURPOSE:
+      Start listening on host and port (0 for any free port).  The
+      backlog of unaccepted connections is deep, so that bursts of
+      clients are not made to retry their connects.
+    OUTPUTS:
+      the (host, port) listened on.
+    '''
+    self.server = await asyncio.start_server(self._client, host, port,
+                                             backlog=backlog)
+    return self.server.sockets[0].getsockname()[:2]
+
+  async def stop(self):
+    '''
+    PURPOSE:
+      Stop listening and wait for the open connections to close.
+    '''
+    self.server.close()
+    await self.server.wait_closed()
+
+
+def main(argv=None):
+  '''
+  PURPOSE:
+    Run a Service on localhost until interrupted.
+  '''
+  p = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  p.add_argument('--host', default='127.0.0.1')
+  p.add_argument('--port', type=int, default=8080)
+  p.add_argument('--method', default='RungeKutta',
+                 help='intMethod of the Ballistics object')
+  p.add_argument('--model', default='g', help='drag model, g or e')
+  p.add_argument('--dt', type=float, default=0.001,
+                 help='output and integration time step in seconds')
+  p.add_argument('--tmax', type=float, default=10.0,
+                 help='longest time of flight integrated in seconds')
+  p.add_argument('--window', type=float, default=0.005,
+                 help='batching window in seconds')
+  p.add_argument('--max-batch', type=int, default=256)
+  a = p.parse_args(argv)
+
+  ball    = Ballistics([], a.method, 0.0, a.tmax, a.dt, a.dt,
+                       model=a.model, tmax=a.tmax)
+  service = Service(ball, a.window, a.max_batch)
+  loop    = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  host, port = loop.run_until_complete(service.start(a.host, a.port))
+  print('serving on http://%s:%d' % (host, port))
+  try:
+    loop.run_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    loop.run_until_complete(service.stop())
+
+
+if __name__ == '__main__':
+  main()
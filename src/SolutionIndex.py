@@ -0,0 +1,339 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy import asarray, arange, linspace, zeros, ones, \
+                  column_stack, concatenate, ascontiguousarray, \
+                  floor, clip, maximum, append, nan, isnan, sqrt, \
+                  load as np_load, save as np_save
+import functions as func
+import hashlib
+import tempfile
+import json
+import os
+
+COLUMNS = ['theta', 'time', 'velocity', 'theta_error']
+VERSION = 1
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _fire(ball, cart, theta, rng):
+  '''
+  PURPOSE:
+    Fire cart at each launch angle of theta as one batch, every lane
+    retiring at its own range.
+  INPUTS:
+    ball  - Ballistics object.
+    cart  - Cartridge, fired from the height cart.traj[0].
+    theta - (N,) launch angles in radians.
+    rng   - (N,) range of each lane in meters.
+  OUTPUTS:
+    y - (N, 4) states at each lane's range, nan where not reached.
+    t - (N,) times of flight.
+  '''
+  n      = len(theta)
+  vx, vy = func.vel_comp(cart.mv, theta)
+  y0     = column_stack([zeros(n), vx, ones(n)*cart.traj[0], vy])
+  return ball.batch_to_range(y0, cart, rng)
+
+
+def _fan(ball, cart, ranges, zero, angles, fan):
+  '''
+  PURPOSE:
+    Launch angles hitting zero at ranges, interpolated linearly from a
+    fan of angles fired as one batch, and the slopes of the height at
+    each range with respect to the angle.
+  '''
+  theta  = linspace(angles[0], angles[1], fan)
+  vx, vy = func.vel_comp(cart.mv, theta)
+  y0     = column_stack([zeros(fan), vx, ones(fan)*cart.traj[0], vy])
+  y, t   = ball.batch_at_ranges(y0, cart, ranges)
+  h      = y[:,:,2].T - zero             # (k, fan), increasing in theta
+
+  # the first angle of each range at or above zero, and the one below :
+  above  = h >= 0
+  j      = above.argmax(1)
+  ok     = above.any(1) & (j > 0)
+  j      = clip(j, 1, fan - 1)
+  k      = arange(len(ranges))
+  h0, h1 = h[k, j-1], h[k, j]
+  ok    &= ~isnan(h0)
+  s      = (h1 - h0) / (theta[j] - theta[j-1])
+  th     = theta[j-1] - h0 / s
+  th[~ok] = nan
+  return th, s
+
+
+class SolutionIndex(object):
+  """
+  Launch angle, time of flight and velocity of one cartridge in one
+  atmosphere against range, on a uniform grid of ranges, so that a
+  firing solution is a constant-time linear interpolation.  The table
+  is a plain (K, 4) array with the columns of COLUMNS, which save writes
+  as a .npy file beside a JSON sidecar of its metadata, so that load
+  can map it read-only into any number of processes.
+  """
+  def __init__(self, data, meta):
+    """
+    INPUTS:
+      data -- (K, 4) array, row i at range r0 + i*step, e.g. a numpy
+              memmap.  Its theta_error column bounds the angle error of
+              queries between rows i and i + 1.
+      meta -- dict with at least r0 and step, as written by build.
+    OUTPUTS:
+      r0, step, r_max -- first, spacing and last range in meters.
+      errors          -- dict of the largest errors found at any
+                         checked range, with keys theta (radians),
+                         height (meters), time (seconds) and velocity
+                         (m/s).
+    """
+    self.data   = data
+    self.meta   = meta
+    self.r0     = float(meta['r0'])
+    self.step   = float(meta['step'])
+    self.r_max  = self.r0 + self.step*(len(data) - 1)
+    self.errors = meta.get('errors', {})
+
+  def __len__(self):
+    return len(self.data)
+
+  def __repr__(self):
+    return 'SolutionIndex(%r, %g to %g m every %g m)' % \
+           (self.meta.get('name'), self.r0, self.r_max, self.step)
+
+  def ranges(self):
+    '''
+    PURPOSE:
+      The ranges of the rows in meters.
+    '''
+    return self.r0 + self.step*arange(len(self.data))
+
+  def query(self, rng):
+    '''
+    PURPOSE:
+      Firing solution at rng, within errors of the exact solution.
+    INPUTS:
+      rng - float or array of ranges in meters.
+    OUTPUTS:
+      (theta, time, velocity) - launch angle in radians, time of flight
+      in seconds and velocity in m/s at rng, floats or arrays.  Arrays
+      are nan outside [r0, r_max]; a float out of the index raises
+      ValueError.
+    '''
+    if isinstance(rng, (float, int)):
+      u = (rng - self.r0) / self.step
+      if not 0 <= u <= len(self.data) - 1:
+        raise ValueError('%g m is outside the index, %g to %g m' %
+                         (rng, self.r0, self.r_max))
+      i = min(int(u), len(self.data) - 2)
+      w = u - i
+      a, b = self.data[i], self.data[i+1]
+      return tuple(float(a[c] + w*(b[c] - a[c])) for c in range(3))
+
+    u   = (asarray(rng, dtype=float) - self.r0) / self.step
+    out = (u < 0) | (u > len(self.data) - 1)
+    i   = clip(floor(u), 0, len(self.data) - 2).astype(int)
+    w   = (u - i)[...,None]
+    v   = self.data[i] + w*(self.data[i+1] - self.data[i])
+    v[out] = nan
+    return v[...,0], v[...,1], v[...,2]
+
+  def theta(self, rng):
+    '''
+    PURPOSE:
+      Launch angle in radians hitting the zero height at rng.
+    '''
+    return self.query(rng)[0]
+
+  def time(self, rng):
+    '''
+    PURPOSE:
+      Time of flight in seconds to rng.
+    '''
+    return self.query(rng)[1]
+
+  def error(self, rng):
+    '''
+    PURPOSE:
+      Bound on the error in radians of theta(rng), that of the rows
+      either side of rng.
+    '''
+    if isinstance(rng, (float, int)):
+      self.query(rng)
+      i = min(int((rng - self.r0) / self.step), len(self.data) - 2)
+      return float(self.data[i, 3])
+    u = (asarray(rng, dtype=float) - self.r0) / self.step
+    e = self.data[clip(floor(u), 0, len(self.data) - 2).astype(int), 3]
+    e[(u < 0) | (u > len(self.data) - 1)] = nan
+    return e
+
+  def matches(self, ball, cart, zero=0.0):
+    '''
+    PURPOSE:
+      True if this index was built for cart and zero with the settings
+      of ball, as a guard against serving a stale file.
+    '''
+    return self.meta.get('key') == _key(ball, cart, zero, self.r0,
+                                        self.step, len(self.data))
+
+  def save(self, path):
+    '''
+    PURPOSE:
+      Write the table to path + '.npy' and then the metadata, with the
+      table's shape and checksum, to path + '.json', each through a
+      temporary file of its own replaced atomically.  A load racing the
+      save sees a table not matching its metadata and raises, rather
+      than mixing the two.
+    '''
+    path = _base(path)
+    data = ascontiguousarray(self.data)
+    meta = dict(self.meta, shape=list(data.shape), sha1=_checksum(data))
+    _write(path + '.npy', lambda f: np_save(f, data))
+    _write(path + '.json', lambda f: f.write(
+             json.dumps(meta, indent=2, sort_keys=True).encode()))
+
+
+def _base(path):
+  return path[:-4] if path.endswith('.npy') else path
+
+
+def _checksum(data):
+  return hashlib.sha1(ascontiguousarray(data, dtype=float).tobytes()) \
+                .hexdigest()
+
+
+def _write(path, write):
+  '''
+  PURPOSE:
+    Call write on a temporary file beside path, then replace path with
+    it, so that concurrent saves never share a temporary file.
+  '''
+  fd, tmp = tempfile.mkstemp('.tmp', os.path.basename(path) + '.',
+                             os.path.dirname(path) or '.')
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      write(f)
+    _replace(tmp, path)
+  except BaseException:
+    try:
+      os.remove(tmp)
+    except OSError:
+      pass
+    raise
+
+
+def _key(ball, cart, zero, r0, step, k):
+  return ball._cache_key(cart, 'index', cart.traj[0], zero, r0, step, k)
+
+
+def build(ball, cart, max_range, step=5.0, zero=0.0, angles=(-0.01, 0.15),
+          fan=64):
+  '''
+  PURPOSE:
+    The SolutionIndex of cart in the air of ball (its rho or atmosphere)
+    from three batched integrations:
+      1. a fan of launch angles recorded at every range of the grid,
+         inverted per range for a first angle,
+      2. one lane per range at that angle, correcting it by a secant
+         step with the fan's slope,
+      3. one lane per range at the corrected angle, giving the stored
+         time and velocity, and one per midpoint at the interpolated
+         angle, whose misses give the error bounds.
+  INPUTS:
+    ball      - Ballistics object.
+    cart      - Cartridge, fired from the height cart.traj[0].
+    max_range - last range in meters; the index stops earlier where
+                zero cannot be reached with angles, or within ball.tmax.
+    step      - range spacing in meters.
+    zero      - height hit at each range, as in find_theta.
+    angles    - (low, high) launch angles of the fan in radians, which
+                must bracket the solutions on the flat branch.
+    fan       - number of angles in the fan.
+  OUTPUTS:
+    SolutionIndex.  Its errors hold the largest angle, height, time and
+    velocity errors at the grid ranges and midpoints, which bound those
+    of queries since linear interpolation errs most between rows, and
+    its theta_error column the angle errors of each interval.
+  '''
+  ranges = arange(step, max_range + step/2.0, step)
+  th, s  = _fan(ball, cart, ranges, zero, angles, fan)
+  bad    = isnan(th)
+  if bad.any():
+    last = bad.argmax()
+    if last < 2:
+      raise ValueError('%s does not reach zero at %g m within angles %s'
+                       % (cart.name, ranges[0], str(angles)))
+    ranges, th, s = ranges[:last], th[:last], s[:last]
+
+  y, t   = _fire(ball, cart, th, ranges)
+  th     = th - (y[:,2] - zero) / s
+
+  mid    = ranges[:-1] + step/2.0
+  th_mid = (th[:-1] + th[1:]) / 2.0
+  y, t   = _fire(ball, cart, concatenate([th, th_mid]),
+                 concatenate([ranges, mid]))
+  v      = sqrt(y[:,1]**2 + y[:,3]**2)
+  s_all  = concatenate([s, (s[:-1] + s[1:]) / 2.0])
+  k      = len(ranges)
+
+  # the angle error of each interval, the worst of its ends and of its
+  # neighbours' middles and its own, as the error peaks off the middle
+  # where the curvature of theta changes across the interval :
+  dh     = abs(y[:,2] - zero)
+  dth    = dh / abs(s_all)
+  m      = dth[k:]
+  m      = maximum(m, maximum(append(m[1:], 0.0), append(0.0, m[:-1])))
+  e      = maximum(maximum(dth[:k-1], dth[1:k]), m)
+  data   = ascontiguousarray(column_stack([th, t[:k], v[:k],
+                                           append(e, dth[k-1])]))
+  errors = {'height'   : dh.max(),
+            'theta'    : dth.max(),
+            'time'     : abs(t[k:] - (t[:k-1] + t[1:k]) / 2.0).max(),
+            'velocity' : abs(v[k:] - (v[:k-1] + v[1:k]) / 2.0).max()}
+  meta   = {'version'   : VERSION,
+            'name'      : cart.name,
+            'columns'   : COLUMNS,
+            'r0'        : float(ranges[0]),
+            'step'      : float(step),
+            'zero'      : float(zero),
+            'model'     : ball.model,
+            'intMethod' : ball.intMethod,
+            'rho'       : float(ball.rho),
+            'mach'      : float(ball.mach),
+            'errors'    : dict((n, float(e)) for n, e in errors.items()),
+            'key'       : _key(ball, cart, zero, float(ranges[0]),
+                               float(step), k)}
+  return SolutionIndex(data, meta)
+
+
+def load(path, mmap_mode='r'):
+  '''
+  PURPOSE:
+    The SolutionIndex written by SolutionIndex.save to path, its table
+    mapped from the file with mmap_mode (default 'r', read-only and
+    shared between processes; None to read it into memory).  Raises
+    ValueError if the table does not match the shape and checksum of
+    its metadata, as when read during a save.
+  '''
+  path = _base(path)
+  with open(path + '.json') as f:
+    meta = json.load(f)
+  if meta.get('version') != VERSION:
+    raise ValueError('%s is not a version %d solution index' %
+                     (path, VERSION))
+  data = np_load(path + '.npy', mmap_mode=mmap_mode)
+  if 'sha1' in meta and (list(data.shape) != meta.get('shape') or
+                         _checksum(data) != meta['sha1']):
+    raise ValueError('%s.npy does not match %s.json' % (path, path))
+  return SolutionIndex(data, meta)
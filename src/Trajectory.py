@@ -0,0 +1,119 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy import asarray, atleast_1d, clip, searchsorted, sqrt, nan, \
+                  where, diff, newaxis, finfo
+
+class Trajectory(object):
+  """
+  Dense output of an integrated trajectory.  The state between samples
+  is a cubic Hermite interpolant built from the samples and the model's
+  derivatives at them, so queries at any time or range are answered
+  without building a new interpolant.
+  """
+  def __init__(self, t, y, dy, mass=None):
+    """
+    INPUTS:
+      t    -- (n,) sample times in seconds.
+      y    -- (n, 4) states [x, vx, y, vy] at the samples.
+      dy   -- (n, 4) derivatives of the states at the samples.
+      mass -- mass of the bullet in grams, for energy.
+    OUTPUTS:
+      t, y, dy, mass as given, and the cubic coefficients c of every
+      interval, so that y(t[i] + s h[i]) = c0 + c1 s + c2 s^2 + c3 s^3.
+    """
+    self.t    = asarray(t, dtype=float)
+    self.y    = asarray(y, dtype=float)
+    self.dy   = asarray(dy, dtype=float)
+    self.mass = mass
+    self.h    = diff(self.t)
+
+    h  = self.h[:,newaxis]
+    y0 = self.y[:-1]
+    y1 = self.y[1:]
+    m0 = self.dy[:-1] * h
+    m1 = self.dy[1:]  * h
+    self.c0 = y0
+    self.c1 = m0
+    self.c2 = 3*(y1 - y0) - 2*m0 - m1
+    self.c3 = 2*(y0 - y1) + m0 + m1
+
+  def _eval(self, i, s):
+    s = s[:,newaxis]
+    return self.c0[i] + s*(self.c1[i] + s*(self.c2[i] + s*self.c3[i]))
+
+  def at_time(self, t):
+    '''
+    PURPOSE:
+      States [x, vx, y, vy] at times t, nan outside the trajectory.
+    '''
+    t = atleast_1d(asarray(t, dtype=float))
+    i = clip(searchsorted(self.t, t, 'right') - 1, 0, len(self.h) - 1)
+    s = (t - self.t[i]) / self.h[i]
+    y = self._eval(i, s)
+    out = (t < self.t[0]) | (t > self.t[-1])
+    y[out] = nan
+    return y
+
+  def time(self, x, iterations=4):
+    '''
+    PURPOSE:
+      Time of flight to ranges x in meters, nan outside the trajectory.
+      x(t) is inverted on each interval by Newton iteration on the
+      cubic, started from the linear guess.
+    '''
+    x  = atleast_1d(asarray(x, dtype=float))
+    xn = self.y[:,0]
+    i  = clip(searchsorted(xn, x, 'right') - 1, 0, len(self.h) - 1)
+    a0, a1, a2, a3 = self.c0[i,0], self.c1[i,0], self.c2[i,0], self.c3[i,0]
+    s  = (x - xn[i]) / (xn[i+1] - xn[i])
+    for k in range(iterations):
+      p  = a0 + s*(a1 + s*(a2 + s*a3)) - x
+      dp = a1 + s*(2*a2 + s*3*a3)
+      s  = clip(s - p/dp, 0.0, 1.0)
+    t = self.t[i] + s*self.h[i]
+
+    # ranges within rounding of the ends, such as that of a range event
+    # located an ulp short of it, are on the trajectory :
+    tol = 4*finfo(float).eps*abs(xn).max()
+    return where((x < xn[0] - tol) | (x > xn[-1] + tol), nan, t)
+
+  def state(self, x):
+    '''
+    PURPOSE:
+      States [x, vx, y, vy] at ranges x in meters.
+    '''
+    return self.at_time(self.time(x))
+
+  def drop(self, x):
+    '''
+    PURPOSE:
+      Height of the bullet relative to the line of sight at ranges x.
+    '''
+    return self.state(x)[:,2]
+
+  def velocity(self, x):
+    '''
+    PURPOSE:
+      Speed of the bullet at ranges x.
+    '''
+    y = self.state(x)
+    return sqrt(y[:,1]**2 + y[:,3]**2)
+
+  def energy(self, x):
+    '''
+    PURPOSE:
+      Kinetic energy of the bullet in joules at ranges x.
+    '''
+    return 0.5 * self.mass/1000.0 * self.velocity(x)**2
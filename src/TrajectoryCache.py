@@ -0,0 +1,215 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy       import array, asarray, ndarray, load, savez
+from collections import OrderedDict
+from threading   import Lock
+import hashlib
+import tempfile
+import os
+
+def make_key(*parts):
+  '''
+  PURPOSE:
+    Canonical content hash of numbers, strings, None, arrays and nested
+    tuples or lists of them.  Floats are hashed by their exact binary
+    value so equal inputs always give equal keys.
+  OUTPUTS:
+    hex digest string.
+  '''
+  h = hashlib.sha1()
+  def feed(p):
+    if p is None or isinstance(p, (bool, str)):
+      h.update(repr(p).encode('utf-8'))
+    elif isinstance(p, (tuple, list)):
+      h.update(b'(')
+      for q in p:
+        feed(q)
+      h.update(b')')
+    elif isinstance(p, ndarray):
+      p = asarray(p, dtype=float)
+      h.update(repr(p.shape).encode('utf-8'))
+      h.update(p.tobytes())
+    else:
+      h.update(float(p).hex().encode('utf-8'))
+    h.update(b';')
+  feed(parts)
+  return h.hexdigest()
+
+
+_replace = getattr(os, 'replace', os.rename)
+
+def _remove(f):
+  '''
+  PURPOSE:
+    Remove the file f, returning False if it is already gone.
+  '''
+  try:
+    os.remove(f)
+    return True
+  except OSError:
+    return False
+
+
+def _copy(value):
+  '''
+  PURPOSE:
+    Copy of a dict of arrays, so that callers never hold the cached ones.
+  '''
+  return dict((k, v.copy()) for k, v in value.items())
+
+
+class TrajectoryCache(object):
+  """
+  Content-addressed cache of integrated trajectories and zeroing
+  results.  Entries are dicts of numpy arrays held in an in-memory LRU
+  tier and, optionally, an on-disk tier of npz files, both evicted by
+  size.
+  """
+  def __init__(self, max_bytes=64*2**20, path=None, max_disk_bytes=None):
+    """
+    INPUTS:
+      max_bytes      -- size of the in-memory tier in bytes.
+      path           -- directory of the on-disk tier (default None, no
+                        disk tier).
+      max_disk_bytes -- size of the on-disk tier in bytes (default None,
+                        unbounded).
+    """
+    self.max_bytes      = max_bytes
+    self.path           = path
+    self.max_disk_bytes = max_disk_bytes
+    self.nbytes         = 0
+    self.hits           = 0
+    self.disk_hits      = 0
+    self.misses         = 0
+    self.evictions      = 0
+    self._mem           = OrderedDict()
+    self._lock          = Lock()
+    if path is not None and not os.path.isdir(path):
+      os.makedirs(path)
+
+  def _file(self, key):
+    return os.path.join(self.path, key + '.npz')
+
+  def get(self, key):
+    '''
+    PURPOSE:
+      Return a copy of the entry stored under key, or None on a miss.
+    '''
+    with self._lock:
+      entry = self._mem.get(key)
+      if entry is not None:
+        self._mem.pop(key)
+        self._mem[key] = entry     # most recently used
+        self.hits += 1
+        return _copy(entry[0])
+    if self.path is not None and os.path.exists(self._file(key)):
+      try:
+        with load(self._file(key)) as f:
+          value = dict((k, f[k]) for k in f.files)
+      except (IOError, OSError, ValueError):
+        value = None
+      if value is not None:
+        try:
+          os.utime(self._file(key), None)
+        except OSError:
+          pass
+        self._store(key, value)
+        with self._lock:
+          self.disk_hits += 1
+        return _copy(value)
+    with self._lock:
+      self.misses += 1
+    return None
+
+  def put(self, key, value):
+    '''
+    PURPOSE:
+      Store a copy of value, a dict of arrays, under key in every tier.
+    '''
+    value = dict((k, array(v)) for k, v in value.items())
+    self._store(key, value)
+    if self.path is not None:
+      # a temporary file of our own, as other processes may be writing
+      # the same key :
+      fd, tmp = tempfile.mkstemp('.tmp.npz', key[:16], self.path)
+      try:
+        with os.fdopen(fd, 'wb') as f:
+          savez(f, **value)
+        _replace(tmp, self._file(key))
+      except BaseException:
+        _remove(tmp)
+        raise
+      self._trim_disk()
+
+  def _store(self, key, value):
+    size = sum(v.nbytes for v in value.values())
+    with self._lock:
+      if key in self._mem:
+        self.nbytes -= self._mem.pop(key)[1]
+      if size > self.max_bytes:
+        return
+      self._mem[key] = (value, size)
+      self.nbytes += size
+      while self.nbytes > self.max_bytes:
+        k, (v, s) = self._mem.popitem(last=False)
+        self.nbytes    -= s
+        self.evictions += 1
+
+  def _trim_disk(self):
+    if self.max_disk_bytes is None:
+      return
+    # other processes sharing the directory may remove files under us :
+    files = []
+    for f in os.listdir(self.path):
+      if f.endswith('.npz') and not f.endswith('.tmp.npz'):
+        try:
+          st = os.stat(os.path.join(self.path, f))
+        except OSError:
+          continue
+        files.append((st.st_mtime, st.st_size, os.path.join(self.path, f)))
+    files.sort()
+    total = sum(size for mtime, size, f in files)
+    for mtime, size, f in files:
+      if total <= self.max_disk_bytes:
+        break
+      total -= size
+      if _remove(f):
+        with self._lock:
+          self.evictions += 1
+
+  def clear(self):
+    '''
+    PURPOSE:
+      Empty the in-memory tier.
+    '''
+    with self._lock:
+      self._mem.clear()
+      self.nbytes = 0
+
+  def stats(self):
+    '''
+    PURPOSE:
+      Hit and miss statistics of the cache.
+    '''
+    with self._lock:
+      lookups = self.hits + self.disk_hits + self.misses
+      return {'hits'      : self.hits,
+              'disk_hits' : self.disk_hits,
+              'misses'    : self.misses,
+              'hit_rate'  : (self.hits + self.disk_hits) / float(lookups)
+                            if lookups else 0.0,
+              'entries'   : len(self._mem),
+              'bytes'     : self.nbytes,
+              'evictions' : self.evictions}
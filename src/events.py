@@ -0,0 +1,186 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy     import asarray, sqrt
+from functions import m_to_ft
+
+class Event(object):
+  """
+  A trajectory event, located where f(t, y) crosses zero.
+  """
+  def __init__(self, name, f, direction=0, terminal=False):
+    """
+    INPUTS:
+      name      -- key the event is recorded under in Cartridge.events
+      f         -- f(t, y) event function of time and state [x, vx, y, vy]
+      direction -- 1 to only detect f rising through zero, -1 falling,
+                   0 either
+      terminal  -- stop the integration at the event
+    """
+    self.name      = name
+    self.f         = f
+    self.direction = direction
+    self.terminal  = terminal
+
+  def crossed(self, g0, g1):
+    '''
+    PURPOSE:
+      True if the event function values g0, g1 at the ends of a step
+      bracket a zero in the requested direction.
+    '''
+    if self.direction >= 0 and g0 < 0 <= g1:
+      return True
+    if self.direction <= 0 and g0 > 0 >= g1:
+      return True
+    return False
+
+
+def range_event(rng):
+  '''
+  PURPOSE:
+    Terminal event when the bullet passes the range rng in meters.
+  '''
+  return Event('range', lambda t, y: y[0] - rng, 1, terminal=True)
+
+def apex_event():
+  '''
+  PURPOSE:
+    Event at the top of the trajectory, where vy falls through zero.
+  '''
+  return Event('apex', lambda t, y: y[3], -1)
+
+def speed_event(name, v):
+  '''
+  PURPOSE:
+    Event when the bullet slows through the speed v in ft/s.
+  '''
+  return Event(name, lambda t, y: m_to_ft(sqrt(y[1]**2 + y[3]**2)) - v, -1)
+
+def impact_event(ground):
+  '''
+  PURPOSE:
+    Terminal event when the bullet falls through the height ground in
+    meters.
+  '''
+  return Event('impact', lambda t, y: y[2] - ground, -1, terminal=True)
+
+def default_events(rng=None, ground=None):
+  '''
+  PURPOSE:
+    The events recorded by Ballistics.model_integrate: apex, the
+    supersonic to transonic crossing (1340 ft/s), the subsonic crossing
+    (1125 ft/s) and, if given, the terminal range and ground impact.
+  '''
+  events = [apex_event(),
+            speed_event('transonic', 1340.0),
+            speed_event('subsonic',  1125.0)]
+  if rng is not None:
+    events.append(range_event(rng))
+  if ground is not None:
+    events.append(impact_event(ground))
+  return events
+
+
+def hermite(t0, y0, f0, t1, y1, f1, t):
+  '''
+  PURPOSE:
+    Cubic Hermite interpolation of the state between two steps from
+    the states and their derivatives.
+  '''
+  h  = t1 - t0
+  s  = (t - t0) / h
+  s2 = s*s
+  s3 = s2*s
+  return (2*s3 - 3*s2 + 1)*y0 + (s3 - 2*s2 + s)*h*f0 + \
+         (3*s2 - 2*s3)*y1 + (s3 - s2)*h*f1
+
+def locate(event, t0, t1, interp, tol=1e-12, maxiter=50):
+  '''
+  PURPOSE:
+    Root-locate event between two steps with the Illinois method on an
+    interpolant of the state.
+  INPUTS:
+    event  - Event bracketed by the step.
+    t0, t1 - times at the start and end of the step.
+    interp - interp(t) state at time t within the step.
+  OUTPUTS:
+    t - time of the event.
+    y - state at the event.
+  '''
+  a, b   = t0, t1
+  ga, gb = event.f(t0, interp(t0)), event.f(t1, interp(t1))
+  side   = 0
+  t, y   = t1, interp(t1)
+  for i in range(maxiter):
+    t  = (a*gb - b*ga) / (gb - ga)
+    y  = interp(t)
+    gt = event.f(t, y)
+    if abs(gt) <= tol or b - a <= tol * abs(t1 - t0):
+      break
+    if (gt > 0) == (gb > 0):
+      b, gb = t, gt
+      if side == -1:
+        ga /= 2.0
+      side = -1
+    else:
+      a, ga = t, gt
+      if side == 1:
+        gb /= 2.0
+      side = 1
+  return t, y
+
+
+def scan(events, found, t0, y0, t1, y1, rhs, interp=None):
+  '''
+  PURPOSE:
+    Check one step for events, recording the first occurrence of each
+    in found.  Without an interpolant, derivatives for a Hermite
+    interpolant are only evaluated when an event function changes
+    sign, so scanning is nearly free otherwise.
+  INPUTS:
+    events - sequence of Event objects.
+    found  - dict of event name to (t, y), updated in place.
+    t0, y0 - time and state at the start of the step.
+    t1, y1 - time and state at the end of the step.
+    rhs    - rhs(t, y) derivative of the state.
+    interp - interp(t) dense output of the step (default None, cubic
+             Hermite from rhs).
+  OUTPUTS:
+    (t, y) of the earliest terminal event in the step, or None.
+  '''
+  stop = None
+  new  = []
+  for event in events:
+    if event.name in found:
+      continue
+    if not event.crossed(event.f(t0, y0), event.f(t1, y1)):
+      continue
+    if interp is None:
+      y0 = asarray(y0)
+      y1 = asarray(y1)
+      f0 = asarray(rhs(t0, y0))
+      f1 = asarray(rhs(t1, y1))
+      interp = lambda t: hermite(t0, y0, f0, t1, y1, f1, t)
+    t, y = locate(event, t0, t1, interp)
+    found[event.name] = (t, y)
+    new.append(event.name)
+    if event.terminal and (stop is None or t < stop[0]):
+      stop = (t, y)
+
+  # forget events located after the integration stopped :
+  if stop is not None:
+    for name in new:
+      if found[name][0] > stop[0]:
+        del found[name]
+  return stop
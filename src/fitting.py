@@ -0,0 +1,227 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from numpy        import array, asarray, zeros, ones, sqrt, cos, sin, \
+                         unique, concatenate, searchsorted, column_stack, \
+                         isnan, inf, where, eye, diag, dot, maximum, \
+                         repeat, tile, full, nonzero, argmin, linspace
+from numpy.linalg import solve, LinAlgError
+
+PARAMS = ('mv', 'bc')
+
+
+def datasets(cart):
+  '''
+  PURPOSE:
+    The measured data of a cartridge, as a list of (kind, x, data) with
+    kind 'drop' for the traj/x and l_traj/l_x heights in meters and
+    'velocity' for the vel/vel_x speeds in m/s.
+  '''
+  sets = []
+  if len(cart.traj) > 1:
+    sets.append(('drop', asarray(cart.x, float), asarray(cart.traj, float)))
+  if cart.l_traj is not None:
+    sets.append(('drop', asarray(cart.l_x, float),
+                 asarray(cart.l_traj, float)))
+  if cart.vel is not None:
+    sets.append(('velocity', asarray(cart.vel_x, float),
+                 asarray(cart.vel, float)))
+  return sets
+
+
+class _Problem(object):
+  """
+  Weighted residuals of a cartridge's datasets for batches of candidate
+  parameter vectors, each candidate integrated as one lane per dataset.
+  A candidate holds the fitted entries of PARAMS followed by the launch
+  angle of every drop dataset, as each was shot with its own zero.
+  """
+  def __init__(self, ball, cart, params, sigma_y, sigma_v):
+    self.ball   = ball
+    self.cart   = cart
+    self.params = list(params)
+    self.sets   = datasets(cart)
+    if not self.sets:
+      raise ValueError('%s has no measured data to fit' % cart.name)
+    for p in self.params:
+      if p not in PARAMS:
+        raise ValueError('cannot fit %r, choose from %s' % (p, PARAMS))
+
+    self.ranges = unique(concatenate([s[1] for s in self.sets]))
+    self.index  = [searchsorted(self.ranges, s[1]) for s in self.sets]
+    drops       = [i for i, s in enumerate(self.sets) if s[0] == 'drop']
+    self.nparam = len(self.params) + len(drops)
+
+    # launch angle column and muzzle height of each dataset's lane :
+    self.col    = []
+    self.height = []
+    for i, (kind, x, data) in enumerate(self.sets):
+      if kind == 'drop':
+        self.col.append(len(self.params) + drops.index(i))
+        self.height.append(data[0] if x[0] == 0 else cart.traj[0])
+      else:
+        self.col.append(len(self.params) if drops else None)
+        self.height.append(cart.traj[0])
+    self.sigma  = concatenate([full(len(s[2]), sigma_y if s[0] == 'drop'
+                                    else sigma_v) for s in self.sets])
+    self.data   = concatenate([s[2] for s in self.sets])
+    self.lo     = array([1e-6]*len(self.params) +
+                        [-inf]*(self.nparam - len(self.params)))
+
+  def initial(self, mv, bc):
+    return array([{'mv' : mv, 'bc' : bc}[p] for p in self.params] +
+                 [self.cart.theta]*(self.nparam - len(self.params)))
+
+  def value(self, p, name):
+    if name in self.params:
+      return p[:,self.params.index(name)]
+    return ones(len(p)) * getattr(self.cart, name)
+
+  def model(self, p):
+    '''
+    PURPOSE:
+      Modelled drops and speeds at the measured ranges for the (C, P)
+      candidates p, nan where a range is not reached.
+    '''
+    C, D  = len(p), len(self.sets)
+    mv    = repeat(self.value(p, 'mv'), D)
+    bc    = repeat(self.value(p, 'bc'), D)
+    theta = column_stack([p[:,c] if c is not None
+                          else ones(C)*self.cart.theta for c in self.col])
+    theta = theta.ravel()
+    y0    = column_stack([zeros(C*D), mv*cos(theta),
+                          tile(self.height, C), mv*sin(theta)])
+    y, t  = self.ball.batch_at_ranges(y0, self.cart, self.ranges, bc)
+    y     = y.reshape(C, D, len(self.ranges), 4)
+    out   = []
+    for d, (kind, x, data) in enumerate(self.sets):
+      yd = y[:,d,self.index[d]]
+      if kind == 'drop':
+        out.append(yd[:,:,2])
+      else:
+        out.append(sqrt(yd[:,:,1]**2 + yd[:,:,3]**2))
+    return concatenate(out, axis=1)
+
+  def jacobian(self, p, rstep=1e-6):
+    '''
+    PURPOSE:
+      Weighted residuals and their forward-difference Jacobians for the
+      (C, P) candidates p, evaluated together as C*(P+1) candidates.
+    OUTPUTS:
+      r - (C, m) residuals.
+      J - (C, m, P) Jacobians.
+    '''
+    C, P = p.shape
+    h    = rstep * maximum(abs(p), 1e-3)
+    pts  = repeat(p[:,None,:], P + 1, 1)
+    pts[:,1:] += h[:,:,None] * eye(P)
+    r    = (self.model(pts.reshape(-1, P)) - self.data) / self.sigma
+    r    = r.reshape(C, P + 1, -1)
+    J    = (r[:,1:] - r[:,:1]) / h[:,:,None]
+    return r[:,0], J.transpose(0, 2, 1)
+
+
+def fit(ball, cart, params=('bc',), starts=1, sigma_y=0.01, sigma_v=1.0,
+        maxiter=50, tol=1e-8):
+  '''
+  PURPOSE:
+    Fit the ballistics coefficient and/or muzzle velocity of cart to all
+    of its measured data (traj/x, l_traj/l_x and vel/vel_x) by
+    Levenberg-Marquardt on the combined drop and velocity error.  The
+    launch angle of every drop dataset is fitted alongside.  All starts
+    are iterated in lockstep, and each iteration integrates every
+    start's trial point and finite-difference perturbations as a single
+    batch through Ballistics.batch_at_ranges.
+  INPUTS:
+    ball    - Ballistics object setting the model and time steps.
+    cart    - Cartridge with measured data; its mv, bc and theta are the
+              starting guesses.
+    params  - names of the parameters to fit, from PARAMS.
+    starts  - number of starts, with bc spread over a factor of two
+              either side of cart.bc, or a sequence of (mv, bc) pairs.
+    sigma_y - drop measurement uncertainty in meters.
+    sigma_v - velocity measurement uncertainty in m/s.
+    maxiter - iteration budget of each start.
+    tol     - relative decrease of the cost at which a start converges.
+  OUTPUTS:
+    dict with keys
+      mv, bc       - best fit muzzle velocity (m/s) and bc.
+      theta        - fitted launch angle of each drop dataset.
+      cost         - sum of squared weighted residuals.
+      rms_drop     - RMS drop error in meters.
+      rms_velocity - RMS velocity error in m/s.
+      iterations   - iterations taken by the best start.
+      converged    - True if the best start converged.
+      starts       - (S, P) final parameters of every start.
+      costs        - (S,) final cost of every start.
+  '''
+  prob = _Problem(ball, cart, params, sigma_y, sigma_v)
+  if isinstance(starts, int):
+    f = 2.0**linspace(-1, 1, starts) if starts > 1 else [1.0]
+    starts = [(cart.mv, cart.bc*fi) for fi in f]
+  p    = array([prob.initial(mv, bc) for mv, bc in starts])
+  S, P = p.shape
+
+  r, J = prob.jacobian(p)
+  cost = where(isnan(r).any(axis=1), inf, (r**2).sum(axis=1))
+  lam  = full(S, 1e-3)
+  its  = zeros(S, dtype=int)
+  done = zeros(S, dtype=bool)
+  conv = zeros(S, dtype=bool)
+  for it in range(maxiter):
+    act = nonzero(~done)[0]
+    if len(act) == 0:
+      break
+    trial = p[act].copy()
+    for k, a in enumerate(act):
+      Ja = where(isnan(J[a]), 0.0, J[a])
+      ra = where(isnan(r[a]), 0.0, r[a])
+      A  = dot(Ja.T, Ja)
+      try:
+        d = solve(A + lam[a]*diag(maximum(diag(A), 1e-12)), -dot(Ja.T, ra))
+      except LinAlgError:
+        d = zeros(P)
+      trial[k] = maximum(p[a] + d, prob.lo)
+    rt, Jt = prob.jacobian(trial)
+    ct     = where(isnan(rt).any(axis=1), inf, (rt**2).sum(axis=1))
+
+    for k, a in enumerate(act):
+      its[a] += 1
+      if ct[k] < cost[a]:
+        rel    = (cost[a] - ct[k]) / cost[a]
+        small  = (abs(trial[k] - p[a]) <= 1e-12*(abs(p[a]) + 1e-12)).all()
+        p[a], r[a], J[a], cost[a] = trial[k], rt[k], Jt[k], ct[k]
+        lam[a] = maximum(lam[a] / 10.0, 1e-12)
+        if rel < tol or small or cost[a] == 0:
+          done[a] = conv[a] = True
+      else:
+        lam[a] *= 10.0
+        if lam[a] > 1e10:             # no descent left, at a minimum
+          done[a] = conv[a] = cost[a] < inf
+
+  b     = argmin(cost)
+  pb    = p[b:b+1]
+  res   = prob.model(pb)[0] - prob.data
+  drop  = concatenate([full(len(s[2]), s[0] == 'drop') for s in prob.sets])
+  rms   = lambda e: sqrt((e**2).mean()) if len(e) else 0.0
+  return {'mv'           : prob.value(pb, 'mv')[0],
+          'bc'           : prob.value(pb, 'bc')[0],
+          'theta'        : p[b, len(prob.params):],
+          'cost'         : cost[b],
+          'rms_drop'     : rms(res[drop]),
+          'rms_velocity' : rms(res[~drop]),
+          'iterations'   : its[b],
+          'converged'    : conv[b],
+          'starts'       : p,
+          'costs'        : cost}
@@ -15,46 +15,25 @@
 
 from numpy import *
 from functions import *
+from DragTable import compile_table
+from numpy.polynomial.legendre import leggauss
 
 def g_param(G, v):
     '''
     PURPOSE:
       Interpolate between model data points.
     INPUTS:
-      G - {G1, G2, G5, G6, G7, G9} - ballistics model to use.
+      G - {G1, G2, G5, G6, G7, G9} - ballistics model to use, or its
+          compiled DragTable.
       v - float - current velocity of the bullet.
     OUTPUTS:
       A - 
       M - 
+    NOTES:
+      The table is compiled once by DragTable.compile_table and looked
+      up by bisection.
     '''
-    Gvel = G[:,0]        # Velocity from G model
-    vh = where(Gvel>=v)  # Indicies with greater velocity than v
-    vl = where(Gvel<=v)  # Indicies with lower velocity than v
-    ih = vh[0][-1]       # first index of velocity in G above v
-    il = vl[0][0]        # first index of velocity in G below v
-    
-    #if v corresponds to velocity in G, use values in table
-    if  ih == il:
-        A = G[ih,1]
-        M = G[ih,2]
-    
-    #if v is intermediate value, linearly interploate between G values
-    else:
-        vl = G[il,0]
-        vh = G[ih,0]
-        ah = G[ih,1]
-        al = G[il,1]
-        mh = G[ih,2]
-        ml = G[il,2]
-        
-        # y = mx + b where 
-        # m = (ah-al) / (vh-vl)
-        # x = v-vl and
-        # b = al.
-        A = (v-vl) * (ah-al) / (vh-vl) + al
-        M = (v-vl) * (mh-ml) / (vh-vl) + ml
-    
-    return A, M
+    return compile_table(G).lookup(v)
 
 
 def vel_comp(v, theta):
@@ -85,7 +64,8 @@ def fbar_gmodel(t, x, g, bc, G):
       x[2]  - float - the y-position
       x[3]  - float - the y-component velocity
       g     - gravitational acceleration
-      bc    - float - Ballistics coefficient.
+      bc    - float - Ballistics coefficient (divided by the density
+              ratio of the air).
       G     - {G1, G2, G5, G6, G7, G9} - ballistics model to use.
     OUTPUTS:
       An array [vx, ax, vy, ay] where:
@@ -122,7 +102,7 @@ def get_cd(v):
       return 0.15
 
 
-def fbar_emodel(t, x, g, m, rho, A):
+def fbar_emodel(t, x, g, m, rho, A, cd=None):
     """
     PURPOSE:
       Model the path of a bullet using mathematical functions.
@@ -136,6 +116,8 @@ def fbar_emodel(t, x, g, m, rho, A):
       m     - mass of the bullet                (lbs)
       rho   - density of fluid (air)            (lbs/ft^3)
       A     - sectional area of bullet in       (ft^2)
+      cd    - DragCurve giving the drag coefficient (default None,
+              get_cd)
     OUTPUTS:
       An array [vx, ax, vy, ay] where:
         vx - x-component velocity               (ft/s)
@@ -150,14 +132,357 @@ def fbar_emodel(t, x, g, m, rho, A):
     vx = x[1]
     vy = x[3]
     v = sqrt(vx**2 + vy**2)
-    cd = get_cd(v)
+    Cd = get_cd(v) if cd is None else cd.cd_speed(v)
     
-    ax = -((1/2.)*rho*vx**2*cd*A)/m
-    ay = -g - ((1/2.)*rho*vy**2*cd*A)/m
+    ax = -((1/2.)*rho*vx**2*Cd*A)/m
+    ay = -g - ((1/2.)*rho*vy**2*Cd*A)/m
     
     return array( [vx, ax, vy, ay] )
 
 
+def g_param_array(G, v):
+    '''
+    PURPOSE:
+      Vectorized form of g_param for an array of velocities.
+    INPUTS:
+      G - {G1, G2, G5, G6, G7, G9} - ballistics model to use, or its
+          compiled DragTable.
+      v - array - current velocities of the bullets.
+    OUTPUTS:
+      A - array of A coefficients, one per velocity.
+      M - array of M exponents, one per velocity.
+    '''
+    return compile_table(G).lookup_array(v)
+
+
+def fbar_gmodel_batch(t, x, g, drag, lanes):
+    """
+    PURPOSE:
+      Vectorized fbar_gmodel advancing N bullets at once.
+    INPUTS:
+      t     - time, only used in non-autonomous systems.
+      x     - (N, 4) array of states [x, vx, y, vy], one row per lane.
+      g     - gravitational acceleration
+      drag  - DragTableStack of every lane's drag table folded with its
+              ballistics coefficient divided by the air's density ratio.
+      lanes - (N,) int array of the drag table used by each row of x.
+    OUTPUTS:
+      An (N, 4) array of rows [vx, ax, vy, ay] as in fbar_gmodel.
+    """
+    vx = m_to_ft(x[:,1])
+    vy = m_to_ft(x[:,3])
+    v = sqrt(vx**2 + vy**2)
+    A, M = drag.lookup_array(v, lanes)
+
+    k = A*v**(M-1)
+
+    return column_stack( [vx, -vx*k, vy, -g - vy*k] )
+
+
+_gl_x, _gl_w = leggauss(5)   # Gauss-Legendre nodes and weights on [-1, 1]
+
+def gmodel_segment(drag, va, vb, J):
+    """
+    PURPOSE:
+      Integrate the flat-fire G model in the velocity domain across one
+      drag table segment, where speed obeys dv/dt = -c (A/bc) v^M and
+      c converts m/s to ft/s as in fbar_gmodel.
+    INPUTS:
+      drag  - DragTable folded with the bullet's ballistics coefficient.
+      va    - float - speed entering the segment (ft/s).
+      vb    - float - speed leaving the segment, vb < va (ft/s).
+      J     - float - integral of dt/w entering the segment, where w is
+              the speed in m/s.
+    OUTPUTS:
+      dt - time spent in the segment.
+      ds - path length travelled in the segment.
+      dJ - increment of J across the segment.
+      dK - increment of K = int(v J dt) across the segment, so that
+           gravity drop at the end of the segment is g K.
+    """
+    c  = m_to_ft(1.0)
+    h  = (va - vb) / 2.0
+    v  = (va + vb) / 2.0 + h*_gl_x
+    A, M = drag.lookup_array(v)
+    D  = A*v**M
+
+    # J at each quadrature node from a nested rule on [v, va] :
+    hq = (va - v) / 2.0
+    u  = ((va + v) / 2.0)[:,newaxis] + hq[:,newaxis]*_gl_x
+    Au, Mu = drag.lookup_array(u)
+    Jq = J + hq*dot(1.0/(u*Au*u**Mu), _gl_w)
+
+    dt = h*dot(_gl_w, 1.0/(c*D))
+    ds = h*dot(_gl_w, v/(c*D))
+    dJ = h*dot(_gl_w, 1.0/(v*D))
+    dK = h*dot(_gl_w, v*Jq/(c*D))
+    return dt, ds, dJ, dK
+
+
+def get_cd_array(v):
+    """
+    PURPOSE:
+      Vectorized form of get_cd.
+    INPUT:
+      v - array of velocities in ft/sec
+    OUTPUT:
+      cd - array of drag coefficients
+    """
+    return where(v > 1000, 16/sqrt(v), 0.15)
+
+
+def fbar_emodel_batch(t, x, g, m, rho, A, cd=None):
+    """
+    PURPOSE:
+      Vectorized fbar_emodel advancing N bullets at once.
+    INPUTS:
+      t     - time, only used in non-autonomous systems.
+      x     - (N, 4) array of states [x, vx, y, vy], one row per lane.
+      g     - gravitational acceleration
+      m     - (N,) array of bullet masses.
+      rho   - density of fluid (air)
+      A     - (N,) array of bullet sectional areas.
+      cd    - DragCurve shared by the lanes (default None, get_cd).
+    OUTPUTS:
+      An (N, 4) array of rows [vx, ax, vy, ay] as in fbar_emodel.
+    """
+    vx = x[:,1]
+    vy = x[:,3]
+    v = sqrt(vx**2 + vy**2)
+    Cd = get_cd_array(v) if cd is None else cd.cd_speed(v)
+    k = (1/2.)*rho*Cd*A/m
+
+    return column_stack( [vx, -k*vx**2, vy, -g - k*vy**2] )
+
+
+SENS_PARAMS = ('mv', 'bc', 'rho', 'theta')
+
+def sens_initial(y0):
+    """
+    PURPOSE:
+      Augment initial states with their sensitivities to SENS_PARAMS.
+      Only the muzzle velocity and launch angle enter the initial state.
+    INPUTS:
+      y0 - (N, 4) array of initial states [x, vx, y, vy].
+    OUTPUTS:
+      (N, 20) array of rows [x, vx, y, vy, S] where S is the 4x4
+      sensitivity matrix dy/dp flattened row by row.
+    """
+    y0 = asarray(y0, dtype=float)
+    n  = len(y0)
+    vx = y0[:,1]
+    vy = y0[:,3]
+    mv = sqrt(vx**2 + vy**2)
+    S  = zeros((n, 4, 4))
+    S[:,1,0] = vx / mv
+    S[:,3,0] = vy / mv
+    S[:,1,3] = -vy
+    S[:,3,3] = vx
+    return column_stack( [y0, S.reshape(n, 16)] )
+
+
+def fbar_gmodel_sens_batch(t, x, g, drag, lanes, bc, rho):
+    """
+    PURPOSE:
+      fbar_gmodel_batch with the variational equations dS/dt = F S + f_p
+      of the state's sensitivities S to SENS_PARAMS, where F is the
+      Jacobian of the model with respect to the state and f_p with
+      respect to the parameters.
+    INPUTS:
+      t     - time, only used in non-autonomous systems.
+      x     - (N, 20) array of states augmented as by sens_initial.
+      g     - gravitational acceleration
+      drag  - DragTableStack as in fbar_gmodel_batch.
+      lanes - (N,) int array of the drag table used by each row of x.
+      bc    - (N,) array of ballistics coefficients.
+      rho   - (N,) array of densities of fluid (air), which drag is
+              proportional to.
+    OUTPUTS:
+      An (N, 20) array of the derivatives of x.
+    """
+    c  = m_to_ft(1.0)
+    vx = c*x[:,1]
+    vy = c*x[:,3]
+    v  = sqrt(vx**2 + vy**2)
+    A, M, dA, dM = drag.lookup_array(v, lanes, slopes=True)
+
+    k  = A*v**(M-1)
+    kv = k*(dA/A + dM*log(v) + (M-1)/v)   # dk/dv
+    ku = kv*c*vx/v                        # dk/dx[1]
+    kw = kv*c*vy/v                        # dk/dx[3]
+
+    n  = len(x)
+    F  = zeros((n, 4, 4))
+    F[:,0,1] = c
+    F[:,1,1] = -c*k - vx*ku
+    F[:,1,3] = -vx*kw
+    F[:,2,3] = c
+    F[:,3,1] = -vy*ku
+    F[:,3,3] = -c*k - vy*kw
+    fp = zeros((n, 4, 4))
+    fp[:,1,1] = vx*k/bc
+    fp[:,3,1] = vy*k/bc
+    fp[:,1,2] = -vx*k/rho
+    fp[:,3,2] = -vy*k/rho
+
+    S  = x[:,4:].reshape(n, 4, 4)
+    dS = einsum('nij,njk->nik', F, S) + fp
+    return column_stack( [vx, -vx*k, vy, -g - vy*k, dS.reshape(n, 16)] )
+
+
+def fbar_emodel_sens_batch(t, x, g, m, rho, A):
+    """
+    PURPOSE:
+      fbar_emodel_batch with the variational equations of the state's
+      sensitivities to SENS_PARAMS, as in fbar_gmodel_sens_batch.
+    INPUTS:
+      t     - time, only used in non-autonomous systems.
+      x     - (N, 20) array of states augmented as by sens_initial.
+      g     - gravitational acceleration
+      m     - (N,) array of bullet masses.
+      rho   - (N,) array of densities of fluid (air)
+      A     - (N,) array of bullet sectional areas.
+    OUTPUTS:
+      An (N, 20) array of the derivatives of x.
+    """
+    vx = x[:,1]
+    vy = x[:,3]
+    v  = sqrt(vx**2 + vy**2)
+    k  = (1/2.)*rho*get_cd_array(v)*A/m
+    kv = (1/2.)*rho*where(v > 1000, -8/v**1.5, 0.0)*A/m   # dk/dv
+
+    n  = len(x)
+    F  = zeros((n, 4, 4))
+    F[:,0,1] = 1.0
+    F[:,1,1] = -2*k*vx - vx**2*kv*vx/v
+    F[:,1,3] = -vx**2*kv*vy/v
+    F[:,2,3] = 1.0
+    F[:,3,1] = -vy**2*kv*vx/v
+    F[:,3,3] = -2*k*vy - vy**2*kv*vy/v
+    fp = zeros((n, 4, 4))
+    fp[:,1,2] = -k*vx**2/rho
+    fp[:,3,2] = -k*vy**2/rho
+
+    S  = x[:,4:].reshape(n, 4, 4)
+    dS = einsum('nij,njk->nik', F, S) + fp
+    return column_stack( [vx, -k*vx**2, vy, -g - k*vy**2, dS.reshape(n, 16)] )
+
+
+OMEGA_EARTH = 7.292115e-5   # rotation rate of the earth - rad/s
+
+def wind_vector(speed, angle):
+    """
+    PURPOSE:
+      Velocity of the air in the shooter's frame for a wind of speed
+      blowing from angle.
+    INPUTS:
+      speed - float or array - wind speed in m/s.
+      angle - float or array - direction the wind blows from, clockwise
+              from the line of fire in radians (0 head wind, pi/2 from
+              the right, pi tail wind).
+    OUTPUT:
+      (..., 3) array of air velocities [wx, wy, wz] along the range,
+      up and to the right.
+    """
+    speed = asarray(speed, dtype=float)
+    angle = asarray(angle, dtype=float)
+    return stack( [-speed*cos(angle), zeros(broadcast(speed, angle).shape),
+                   -speed*sin(angle)], axis=-1 )
+
+
+def earth_rotation(latitude, azimuth):
+    """
+    PURPOSE:
+      The earth's angular velocity in the shooter's frame, for Coriolis
+      acceleration.
+    INPUTS:
+      latitude - latitude of the firing point in radians, north positive.
+      azimuth  - direction of fire clockwise from north in radians.
+    OUTPUT:
+      array [Ox, Oy, Oz] along the range, up and to the right - rad/s.
+    """
+    return OMEGA_EARTH * array( [cos(latitude)*cos(azimuth),
+                                 sin(latitude),
+                                 -cos(latitude)*sin(azimuth)] )
+
+
+def _coriolis(v, omega):
+    """
+    PURPOSE:
+      Coriolis acceleration -2 omega x v of (N, 3) velocities v.
+    """
+    return -2*cross(omega, v)
+
+
+def fbar_gmodel3_batch(t, x, g, drag, lanes, wind, omega=None):
+    """
+    PURPOSE:
+      Three dimensional fbar_gmodel_batch with wind and, optionally,
+      Coriolis acceleration.  Drag acts against the velocity relative
+      to the air.
+    INPUTS:
+      t     - time, only used in non-autonomous systems.
+      x     - (N, 6) array of states [x, vx, y, vy, z, vz], where z is
+              to the right of the line of fire.
+      g     - gravitational acceleration
+      drag  - DragTableStack as in fbar_gmodel_batch.
+      lanes - (N,) int array of the drag table used by each row of x.
+      wind  - (N, 3) array of air velocities, as from wind_vector.
+      omega - (N, 3) array of the earth's angular velocity, as from
+              earth_rotation (default None, no Coriolis acceleration).
+    OUTPUTS:
+      An (N, 6) array of rows [vx, ax, vy, ay, vz, az] in the units of
+      fbar_gmodel.
+    """
+    c  = m_to_ft(1.0)
+    u  = x[:,1::2]
+    r  = c*(u - wind)                    # velocity relative to the air
+    v  = sqrt((r**2).sum(axis=1))
+    A, M = drag.lookup_array(v, lanes)
+
+    a  = -r*(A*v**(M-1))[:,newaxis]
+    a[:,1] -= g
+    if omega is not None:
+      a += c*_coriolis(u, omega)
+    return column_stack( [c*u[:,0], a[:,0], c*u[:,1], a[:,1],
+                          c*u[:,2], a[:,2]] )
+
+
+def fbar_emodel3_batch(t, x, g, m, rho, A, wind, omega=None, cd=None):
+    """
+    PURPOSE:
+      Three dimensional fbar_emodel_batch with wind and, optionally,
+      Coriolis acceleration, as in fbar_gmodel3_batch.
+    INPUTS:
+      t     - time, only used in non-autonomous systems.
+      x     - (N, 6) array of states [x, vx, y, vy, z, vz].
+      g     - gravitational acceleration
+      m     - (N,) array of bullet masses.
+      rho   - density of fluid (air)
+      A     - (N,) array of bullet sectional areas.
+      wind  - (N, 3) array of air velocities.
+      omega - (N, 3) array of the earth's angular velocity (default
+              None).
+      cd    - DragCurve shared by the lanes (default None, get_cd).
+    OUTPUTS:
+      An (N, 6) array of rows [vx, ax, vy, ay, vz, az].
+    """
+    u  = x[:,1::2]
+    r  = u - wind
+    v  = sqrt((r**2).sum(axis=1))
+    Cd = get_cd_array(v) if cd is None else cd.cd_speed(v)
+    k  = (1/2.)*rho*Cd*A/m
+
+    # each component of drag goes with the square of that component, the
+    # range and height as in fbar_emodel and the crosswind signed :
+    a  = -k[:,newaxis]*r**2
+    a[:,2] = -k*r[:,2]*abs(r[:,2])
+    a[:,1] -= g
+    if omega is not None:
+      a += _coriolis(u, omega)
+    return column_stack( [u[:,0], a[:,0], u[:,1], a[:,1], u[:,2], a[:,2]] )
+
+
 def array_list_convert(f, l):
     l = array(l)
     l = f(l)
@@ -221,6 +546,12 @@ def m3_to_ft3(m):
 def kg_to_lbs(kg):
     return kg * 2.20462262
 
+def j_to_ftlbs(j):
+    return j * 0.737562149
+
+def mph_to_mps(mph):
+    return mph * 0.44704
+
 def degrees_to_rad(deg):
     return deg * pi / 180.0
 
@@ -0,0 +1,271 @@
+#    Copyright (C) <2012>  <cummings.evan@gmail.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from numpy import array, asarray, empty, inf, sqrt, mean, maximum, \
+                  minimum, dot, tensordot, arange, isfinite, finfo
+
+def rk4_step(f, t, y, h, args):
+  '''
+  PURPOSE:
+    Advance a batch of states one classical fourth-order Runge-Kutta
+    step.
+  INPUTS:
+    f    - right-hand side f(t, y, *args) returning an array shaped
+           like y.
+    t    - float - current time.
+    y    - (N, n) array of states, one row per lane.
+    h    - float - step size.
+    args - tuple of extra arguments passed to f.
+  OUTPUTS:
+    (N, n) array of states at time t + h.
+  '''
+  k1 = f(t,         y,            *args)
+  k2 = f(t + h/2.0, y + h/2.0*k1, *args)
+  k3 = f(t + h/2.0, y + h/2.0*k2, *args)
+  k4 = f(t + h,     y + h*k3,     *args)
+  return y + h/6.0*(k1 + 2*k2 + 2*k3 + k4)
+
+
+def euler_step(f, t, y, h, args):
+  '''
+  PURPOSE:
+    Advance a batch of states one explicit Euler step, as rk4_step.
+  '''
+  return y + h*f(t, y, *args)
+
+
+def euler_cromer_step(f, t, y, h, args):
+  '''
+  PURPOSE:
+    Advance a batch of states one Euler-Cromer step, as rk4_step.  The
+    states hold interleaved [position, velocity] pairs; the velocities
+    take an Euler step and the positions then move with the new
+    velocities.
+  '''
+  y1 = array(y, dtype=float)
+  y1[...,1::2] += h*f(t, y, *args)[...,1::2]
+  y1[...,0::2] += h*f(t, y1, *args)[...,0::2]
+  return y1
+
+
+def euler_richardson_step(f, t, y, h, args):
+  '''
+  PURPOSE:
+    Advance a batch of states one Euler-Richardson (midpoint) step, as
+    rk4_step.
+  '''
+  k1 = f(t, y, *args)
+  return y + h*f(t + h/2.0, y + h/2.0*k1, *args)
+
+
+def predictor_step(f, t, y, h, args):
+  '''
+  PURPOSE:
+    Advance a batch of states one predictor-corrector (Heun) step, as
+    rk4_step: an Euler prediction corrected by the trapezoidal rule.
+  '''
+  k1 = f(t, y, *args)
+  k2 = f(t + h, y + h*k1, *args)
+  return y + h/2.0*(k1 + k2)
+
+
+# fixed-step methods by their Ballistics.intMethod names, and the number
+# of right-hand side evaluations each makes per step :
+STEPS = {'Euler'           : euler_step,
+         'EulerCromer'     : euler_cromer_step,
+         'EulerRichardson' : euler_richardson_step,
+         'Predictor'       : predictor_step,
+         'RungeKutta'      : rk4_step}
+
+RHS_CALLS = {euler_step            : 1,
+             euler_cromer_step     : 2,
+             euler_richardson_step : 2,
+             predictor_step        : 2,
+             rk4_step              : 4}
+
+
+def fixed_grid(step, f, t0, y0, dt, nsub, nsteps, args=()):
+  '''
+  PURPOSE:
+    Integrate a state or batch of states over a whole time grid with a
+    fixed-step method, taking nsub steps per sample.
+  INPUTS:
+    step   - step function from STEPS.
+    f      - right-hand side f(t, y, *args).
+    t0     - float - initial time.
+    y0     - (n,) state or (N, n) batch of states.
+    dt     - float - time between samples.
+    nsub   - int - steps per sample.
+    nsteps - int - number of samples after t0.
+    args   - tuple of extra arguments passed to f.
+  OUTPUTS:
+    t - (nsteps + 1,) sample times.
+    y - (nsteps + 1,) + y0.shape array of the samples, y[0] = y0.
+  '''
+  y0   = asarray(y0, dtype=float)
+  y    = empty((nsteps + 1,) + y0.shape)
+  y[0] = y0
+  h    = dt / nsub
+  t    = t0
+  for k in range(nsteps):
+    yk = y[k]
+    for j in range(nsub):
+      yk = step(f, t + j*h, yk, h, args)
+    y[k+1] = yk
+    t      = t0 + (k + 1)*dt
+  return t0 + dt*arange(nsteps + 1), y
+
+
+# Dormand-Prince 5(4) tableau :
+_dp_c = array([0, 1/5., 3/10., 4/5., 8/9., 1])
+_dp_a = [array([]),
+         array([1/5.]),
+         array([3/40., 9/40.]),
+         array([44/45., -56/15., 32/9.]),
+         array([19372/6561., -25360/2187., 64448/6561., -212/729.]),
+         array([9017/3168., -355/33., 46732/5247., 49/176.,
+                -5103/18656.])]
+_dp_b = array([35/384., 0, 500/1113., 125/192., -2187/6784., 11/84., 0])
+_dp_e = array([71/57600., 0, -71/16695., 71/1920., -17253/339200.,
+               22/525., -1/40.])
+
+# coefficients of the fourth-order continuous extension :
+_dp_p = array([
+  [1, -8048581381/2820520608., 8663915743/2820520608.,
+   -12715105075/11282082432.],
+  [0, 0, 0, 0],
+  [0, 131558114200/32700410799., -68118460800/10900136933.,
+   87487479700/32700410799.],
+  [0, -1754552775/470086768., 14199869525/1410260304.,
+   -10690763975/1880347072.],
+  [0, 127303824393/49829197408., -318862633887/49829197408.,
+   701980252875/199316789632.],
+  [0, -282668133/205662961., 2019193451/616988883.,
+   -1453857185/822651844.],
+  [0, 40617522/29380423., -110615467/29380423., 69997945/29380423.]])
+_eps  = finfo(float).eps
+
+
+class DormandPrince(object):
+  """
+  Adaptive Dormand-Prince 5(4) integrator with error control and dense
+  output.  States may be single vectors or (N, n) batches, in which
+  case every lane takes the same step and must meet the tolerance.
+  """
+  def __init__(self, f, args=(), rtol=1e-6, atol=1e-9, hmax=inf):
+    """
+    INPUTS:
+      f    -- right-hand side f(t, y, *args).
+      args -- tuple of extra arguments passed to f.
+      rtol -- relative tolerance on the local error.
+      atol -- absolute tolerance on the local error.
+      hmax -- largest step allowed.
+    OUTPUTS:
+      nfev    -- number of right-hand side evaluations.
+      nsteps  -- number of accepted steps.
+      nreject -- number of rejected steps.
+    """
+    self.f       = f
+    self.args    = args
+    self.rtol    = rtol
+    self.atol    = atol
+    self.hmax    = hmax
+    self.nfev    = 0
+    self.nsteps  = 0
+    self.nreject = 0
+
+  def _f(self, t, y):
+    self.nfev += 1
+    return asarray(self.f(t, y, *self.args))
+
+  def _norm(self, e, y0, y1):
+    sc = self.atol + self.rtol*maximum(abs(y0), abs(y1))
+    return sqrt(mean((e/sc)**2, axis=-1)).max()
+
+  def start(self, t, y, h=None):
+    '''
+    PURPOSE:
+      Set the initial time and state, choosing the first step size by
+      the usual Hairer-Wanner estimate when h is not given.
+    '''
+    self.t  = t
+    self.y  = asarray(y, dtype=float)
+    self.fy = self._f(t, self.y)
+    if h is None:
+      d0 = self._norm(self.y, self.y, self.y)
+      d1 = self._norm(self.fy, self.y, self.y)
+      h  = 1e-6 if d0 < 1e-5 or d1 < 1e-5 else 0.01 * d0/d1
+      f1 = self._f(t + h, self.y + h*self.fy)
+      d2 = self._norm(f1 - self.fy, self.y, self.y) / h
+      if d1 <= 1e-15 and d2 <= 1e-15:
+        h1 = maximum(1e-6, h*1e-3)
+      else:
+        h1 = (0.01 / maximum(d1, d2))**(1/5.)
+      h = minimum(100*h, h1)
+    self.h = minimum(h, self.hmax)
+
+  def step(self):
+    '''
+    PURPOSE:
+      Take one accepted step, shrinking the step size until the local
+      error estimate is within tolerance.  Raises ValueError if the
+      error estimate is not finite or the step falls below the
+      resolution of t, rather than shrinking it forever.
+    OUTPUTS:
+      t - time at the end of the step.
+      y - state at the end of the step.
+    '''
+    t, y, h = self.t, self.y, self.h
+    K    = empty((7,) + y.shape)
+    K[0] = self.fy
+    rejected = False
+    while True:
+      for i in range(1, 6):
+        K[i] = self._f(t + _dp_c[i]*h, y + h*tensordot(_dp_a[i], K[:i], 1))
+      y1   = y + h*tensordot(_dp_b[:6], K[:6], 1)
+      K[6] = self._f(t + h, y1)
+      err  = self._norm(h*tensordot(_dp_e, K, 1), y, y1)
+      if not isfinite(err):
+        raise ValueError('non-finite error estimate at t = %g' % t)
+      if err <= 1.0:
+        break
+      self.nreject += 1
+      rejected = True
+      h = h * maximum(0.2, 0.9*err**(-1/5.))
+      if h < 16*_eps*abs(t):
+        raise ValueError('step size %g too small at t = %g' % (h, t))
+
+    self.t_old, self.y_old, self.K, self.h_old = t, y, K, h
+    self.t, self.y, self.fy = t + h, y1, K[6]
+    self.nsteps += 1
+    # grow the step, but not straight after a rejection :
+    if err == 0:
+      fac = 5.0
+    else:
+      fac = minimum(5.0, 0.9*err**(-1/5.))
+    if rejected:
+      fac = minimum(1.0, fac)
+    self.h = minimum(h*fac, self.hmax)
+    return self.t, self.y
+
+  def dense(self, t):
+    '''
+    PURPOSE:
+      Fourth-order dense output of the state at time t within the last
+      step.
+    '''
+    s = (t - self.t_old) / self.h_old
+    Q = dot(_dp_p, array([s, s**2, s**3, s**4]))
+    return self.y_old + self.h_old*tensordot(Q, self.K, 1)